@@ -0,0 +1,50 @@
+"""
+Микробенчмарк памяти корпуса: List[List[str]] против TokenCorpus.
+Запуск из корня проекта: python -m benchmarks.corpus
+"""
+import random
+import tracemalloc
+
+from topics.corpus import TokenCorpus
+
+N_COMMENTS = 100_000
+VOCAB_SIZE = 30_000
+
+
+def synthetic_corpus(n: int, seed: int = 7) -> list:
+    """
+    Синтетический очищенный корпус. Токены - отдельные строки, как после split()
+    :param n: количество комментариев
+    :param seed: зерно генератора
+    """
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, VOCAB_SIZE + 1)]
+    ranks = range(VOCAB_SIZE)
+    return [' '.join(f'слово{rank}' for rank in rng.choices(ranks, weights, k=rng.randint(3, 25))).split()
+            for _ in range(n)]
+
+
+def traced_size(build) -> int:
+    """
+    Память, занятая результатом функции
+    """
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main() -> None:
+    texts = [' '.join(tokens) for tokens in synthetic_corpus(N_COMMENTS)]
+    list_size = traced_size(lambda: [text.split() for text in texts])
+    corpus_size = traced_size(lambda: TokenCorpus.from_texts(text.split() for text in texts))
+
+    print(f'Комментариев: {N_COMMENTS}')
+    print(f'List[List[str]]: {list_size / 2 ** 20:.1f} МБ')
+    print(f'TokenCorpus: {corpus_size / 2 ** 20:.1f} МБ (x{list_size / corpus_size:.1f} меньше)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Микробенчмарк политики типов: float64 против float32 на числовом пути
+(эмбеддинги -> StandardScaler -> граф соседей -> KMeans) и переполнение меток int8.
+Запуск из корня проекта: python -m benchmarks.dtypes
+"""
+import time
+import tracemalloc
+
+import numpy as np
+from sklearn.cluster import KMeans
+from sklearn.neighbors import NearestNeighbors
+from sklearn.preprocessing import StandardScaler
+
+from topics.clusters import compact_labels
+
+N_TEXTS = 100_000
+VECTOR_SIZE = 100
+N_NEIGHBORS = 15
+N_CLUSTERS = 20
+
+
+def numeric_path(embeddings: np.array) -> np.array:
+    """
+    Числовая часть конвейера без моделей, которым нужны внешние данные
+    :param embeddings: эмбеддинги текстов
+    :return: метки кластеров
+    """
+    scaled = StandardScaler().fit_transform(embeddings)
+    NearestNeighbors(n_neighbors=N_NEIGHBORS).fit(scaled).kneighbors(scaled[:10_000])
+    return KMeans(n_clusters=N_CLUSTERS, n_init=1, random_state=7).fit(scaled).labels_
+
+
+def measure(dtype) -> tuple:
+    """
+    Время и пик памяти пути для типа данных
+    """
+    rng = np.random.default_rng(7)
+    tracemalloc.start()
+    start = time.perf_counter()
+    embeddings = rng.standard_normal((N_TEXTS, VECTOR_SIZE), dtype=dtype)
+    numeric_path(embeddings)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main() -> None:
+    print(f'Текстов: {N_TEXTS}, размерность: {VECTOR_SIZE}')
+    results = {dtype.__name__: measure(dtype) for dtype in (np.float64, np.float32)}
+    for name, (seconds, peak) in results.items():
+        print(f'{name}: {seconds:.2f} c, пик памяти {peak / 2 ** 20:.1f} МБ')
+    (t64, m64), (t32, m32) = results.values()
+    print(f'float32: x{t64 / t32:.2f} быстрее, x{m64 / m32:.2f} меньше памяти')
+
+    # метки 128..199 в int8 становятся отрицательными и неотличимы от служебных значений
+    labels = np.arange(-1, 200)
+    compact = compact_labels(labels)
+    print(f'200 кластеров в int8: {np.sum(labels.astype(np.int8) < 0) - 1} меток переполнены, '
+          f'в {compact.dtype}: {np.sum(compact < 0) - 1}')
+
+
+if __name__ == '__main__':
+    main()
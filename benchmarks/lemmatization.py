@@ -0,0 +1,96 @@
+"""
+Микробенчмарк кеша лемм: лемматизация без кеша, с холодным и с тёплым кешем.
+Тёплый кеш загружается из файла, как после перезапуска приложения.
+Заодно сравнивает результат с лемматизацией целых текстов: кеш лемматизирует слова
+без контекста, поэтому у омонимов леммы могут расходиться.
+Запуск из корня проекта: python -m benchmarks.lemmatization [файл комментариев, по одному в строке]
+"""
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import List, Tuple
+
+from topics import TextPreprocessor, LemmaCache
+
+N_COMMENTS = 20_000
+WORDS = ['видео', 'видосы', 'спасибо', 'автору', 'автор', 'лайк', 'лайки', 'классный', 'классное', 'ролик',
+         'ролики', 'смотрю', 'смотрел', 'смотреть', 'канал', 'канала', 'подписался', 'подписка', 'контент',
+         'хороший', 'хорошее', 'лучший', 'лучшее', 'жду', 'ждём', 'продолжения', 'новое', 'новых', 'выпуск',
+         'выпуски', 'интересно', 'интересный', 'музыка', 'музыку', 'голос', 'голоса', 'шутки', 'шутка',
+         'смешно', 'согласен', 'согласна', 'мнение', 'вопрос', 'вопросы', 'ответ', 'ответы', 'люди', 'людей',
+         'человек', 'время', 'времени', 'год', 'года', 'лет', 'день', 'дня', 'россия', 'страна', 'страны']
+
+
+def synthetic_corpus(n: int, seed: int = 7) -> list:
+    """
+    Синтетический корпус очищенных комментариев.
+    Слова выбираются по закону Ципфа, как в реальных комментариях
+    :param n: количество комментариев
+    :param seed: зерно генератора
+    """
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, len(WORDS) + 1)]
+    return [' '.join(rng.choices(WORDS, weights, k=rng.randint(3, 25))) for _ in range(n)]
+
+
+def timed_lemmatization(prep: TextPreprocessor, corpus: list) -> Tuple[List[str], float]:
+    """
+    Лемматизация корпуса и её время
+    """
+    start = time.perf_counter()
+    lemmas = prep.lemmatization(corpus)
+    return lemmas, time.perf_counter() - start
+
+
+def lemma_differences(expected: List[str], actual: List[str]) -> Tuple[int, Counter]:
+    """
+    Расхождения лемматизации по словам
+    :param expected: тексты, лемматизированные целиком
+    :param actual: тексты, лемматизированные по словам
+    :return: количество различающихся текстов и пары (лемма в тексте, лемма без контекста)
+    """
+    n_texts, pairs = 0, Counter()
+    for expected_text, actual_text in zip(expected, actual):
+        if expected_text.split() == actual_text.split():
+            continue
+        n_texts += 1
+        pairs.update((e, a) for e, a in zip(expected_text.split(), actual_text.split()) if e != a)
+    return n_texts, pairs
+
+
+def main() -> None:
+    if len(sys.argv) > 1:
+        prep = TextPreprocessor()
+        with open(sys.argv[1], encoding='utf-8') as f:
+            corpus = [prep.preprocessing(line) for line in f]
+        corpus = [text for text in corpus if text]
+    else:
+        corpus = synthetic_corpus(N_COMMENTS)
+    expected, no_cache_time = timed_lemmatization(TextPreprocessor(), corpus)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / 'lemmas.pkl'
+        cold_cache = LemmaCache(path)
+        _, cold_time = timed_lemmatization(TextPreprocessor(lemma_cache=cold_cache), corpus)
+        cold_cache.save()
+
+        warm_cache = LemmaCache(path)
+        actual, warm_time = timed_lemmatization(TextPreprocessor(lemma_cache=warm_cache), corpus)
+
+    print(f'Комментариев: {len(corpus)}, словоформ в кеше: {len(warm_cache)}')
+    print(f'Без кеша: {no_cache_time:.2f} c')
+    print(f'Холодный кеш: {cold_time:.2f} c')
+    print(f'Тёплый кеш: {warm_time:.2f} c (x{no_cache_time / warm_time:.1f} к запуску без кеша)')
+
+    n_texts, pairs = lemma_differences(expected, actual)
+    print(f'Тексты с другими леммами: {n_texts} из {len(corpus)} ({n_texts / max(len(corpus), 1):.1%}), '
+          f'слов: {sum(pairs.values())}')
+    for (expected_lemma, actual_lemma), count in pairs.most_common(10):
+        print(f'  {expected_lemma} -> {actual_lemma}: {count}')
+
+
+if __name__ == '__main__':
+    main()
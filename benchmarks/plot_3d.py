@@ -0,0 +1,51 @@
+"""
+Микробенчмарк трехмерного графика: время построения и размер сериализованного графика
+в режимах детализации plot_3d.
+Запуск из корня проекта: python -m benchmarks.plot_3d
+"""
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+from utils.cluster import plot_3d, PLOT_MODES
+from utils.tool import get_color_map
+
+N_COMMENTS = 100_000
+N_CLUSTERS = 20
+
+
+def synthetic_projection(n: int, seed: int = 7) -> pd.DataFrame:
+    """
+    Синтетическая проекция: гауссовы кластеры разного размера и равномерный шум
+    :param n: количество точек
+    :param seed: зерно генератора
+    """
+    rng = np.random.default_rng(seed)
+    sizes = rng.dirichlet(np.ones(N_CLUSTERS)) * n * 0.9
+    labels = np.repeat(np.arange(N_CLUSTERS), sizes.astype(int))
+    centers = rng.uniform(-10, 10, size=(N_CLUSTERS, 3))
+    points = centers[labels] + rng.normal(scale=0.7, size=(len(labels), 3))
+    n_noise = n - len(labels)
+    points = np.vstack([points, rng.uniform(-12, 12, size=(n_noise, 3))])
+    labels = np.concatenate([labels, np.full(n_noise, -1)])
+    return pd.DataFrame({'x': points[:, 0], 'y': points[:, 1], 'z': points[:, 2],
+                         'KMeans': labels.astype(np.int8)}).astype({'x': np.float32, 'y': np.float32,
+                                                                    'z': np.float32})
+
+
+def main() -> None:
+    df = synthetic_projection(N_COMMENTS)
+    color_map = get_color_map(np.arange(N_CLUSTERS), px.colors.qualitative.Dark24)
+    print(f'Комментариев: {N_COMMENTS}, кластеров: {N_CLUSTERS}')
+    for mode, name in PLOT_MODES.items():
+        start = time.perf_counter()
+        fig, payload = plot_3d(df, 'benchmark', color='KMeans', color_discrete_map=color_map, mode=mode)
+        seconds = time.perf_counter() - start
+        n_points = sum(len(trace.x) for trace in fig.data)
+        print(f'{name}: {n_points} точек, {payload / 2 ** 20:.2f} МБ, {seconds:.2f} c')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Микробенчмарк очистки текста: последовательная цепочка шагов против слитной очистки.
+Запуск из корня проекта: python -m benchmarks.preprocessing
+"""
+import random
+import time
+
+from topics import TextPreprocessor
+
+N_COMMENTS = 100_000
+PARTS = ['Отличное видео', 'спасибо автору!!!', 'ЛАЙК 👍👍', '😂😂😂', '<br>', '<a href="https://youtu.be/x">ссылка</a>',
+         'https://www.youtube.com/watch?v=TpXVcVnR3vo', 'www.example.com/page', 'bit.ly/abc', '&quot;цитата&quot;',
+         'data.csv', 'notebook.ipynb', '12:45', '2022', 'great video', 'ёжик в тумане', '🤦‍♂️', '\n', '...', '#хештег']
+
+
+def synthetic_corpus(n: int, seed: int = 7) -> list:
+    """
+    Синтетический корпус комментариев из типичных кусков
+    :param n: количество комментариев
+    :param seed: зерно генератора
+    """
+    rng = random.Random(seed)
+    return [' '.join(rng.choices(PARTS, k=rng.randint(1, 12))) for _ in range(n)]
+
+
+def main() -> None:
+    prep = TextPreprocessor()
+    corpus = synthetic_corpus(N_COMMENTS)
+
+    start = time.perf_counter()
+    expected = [prep.preprocessing_chain(text) for text in corpus]
+    chain_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = [prep.preprocessing(text) for text in corpus]
+    fused_time = time.perf_counter() - start
+
+    assert result == expected, 'Результат слитной очистки отличается от цепочки шагов'
+    print(f'Комментариев: {N_COMMENTS}')
+    print(f'Цепочка шагов: {chain_time:.2f} c')
+    print(f'Слитная очистка: {fused_time:.2f} c (x{chain_time / fused_time:.1f})')
+
+
+if __name__ == '__main__':
+    main()
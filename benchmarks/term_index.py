@@ -0,0 +1,53 @@
+"""
+Бенчмарк построения статистики слов по кластерам (TermIndex) для нескольких разбиений.
+Запуск из корня проекта: python -m benchmarks.term_index
+"""
+import time
+
+import numpy as np
+
+from topics.corpus import TokenCorpus
+from topics.term_index import TermIndex
+
+N_COMMENTS = 100_000
+VOCAB_SIZE = 30_000
+N_LABEL_SETS = 5
+N_CLUSTERS = 30
+
+
+def synthetic_corpus(n: int, seed: int = 7) -> TokenCorpus:
+    """
+    Синтетический очищенный корпус: длины текстов 3..25, токены по закону Ципфа
+    :param n: количество комментариев
+    :param seed: зерно генератора
+    """
+    rng = np.random.default_rng(seed)
+    weights = 1 / np.arange(1, VOCAB_SIZE + 1)
+    lengths = rng.integers(3, 26, size=n)
+    ids = rng.choice(VOCAB_SIZE, size=lengths.sum(), p=weights / weights.sum()).astype(np.int32)
+    vocab = np.array([f'слово{rank}' for rank in range(VOCAB_SIZE)], dtype=object)
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    return TokenCorpus(vocab, ids, offsets)
+
+
+def main() -> None:
+    corpus = synthetic_corpus(N_COMMENTS)
+    rng = np.random.default_rng(0)
+    # метки как у кластеризации: -1 - шум
+    label_sets = [rng.integers(-1, N_CLUSTERS, size=N_COMMENTS) for _ in range(N_LABEL_SETS)]
+    # маска облаков слов: часть словаря отброшена как стопслова
+    allowed = rng.random(VOCAB_SIZE) > 0.1
+
+    start = time.perf_counter()
+    for labels in label_sets:
+        TermIndex.from_labels(corpus, labels, allowed=allowed)
+    elapsed = time.perf_counter() - start
+
+    print(f'Комментариев: {N_COMMENTS}, токенов: {len(corpus.ids) / 1e6:.1f}M, '
+          f'словарь: {len(np.unique(corpus.ids))}')
+    print(f'TermIndex.from_labels x{N_LABEL_SETS}: {elapsed:.2f} с '
+          f'({elapsed / N_LABEL_SETS:.2f} с на разбиение)')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,11 @@
 # этот файл должен находиться в одном месте с 'config.yaml'
 from pathlib import Path
 
-import matplotlib as plt
+import numpy as np
 import yaml
 
-CONFIG_FILE = Path(__file__).parent / 'config.yaml'
+ROOT_DIR = Path(__file__).parent
+CONFIG_FILE = ROOT_DIR / 'config.yaml'
 with open(CONFIG_FILE, 'r') as f:
     config = yaml.safe_load(f)
 
@@ -13,4 +14,7 @@ NOISE = -1
 NOISE_NAME = 'Шум'
 NOISE_COLOR = '#777676'
 
-plt.rcParams.update({'figure.max_open_warning': 0})
+# политика типов данных, задаётся в config.yaml
+FEATURES_DTYPE = np.dtype(config['dtype']['features'])
+COORDINATES_DTYPE = np.dtype(config['dtype']['coordinates'])
+LABEL_DTYPES = tuple(np.dtype(dtype) for dtype in config['dtype']['labels'])
@@ -1,6 +1,7 @@
 import streamlit as st
 
 from utils.eda import plot_tokens_distribution, plot_token_count
+from utils.snippet import get_result
 
 header = st.container()
 body = st.container()
@@ -9,14 +10,14 @@ with header:
     st.title('Разведочный анализ данных')
 
 with body:
-    if "result" not in st.session_state:
+    result = get_result()
+    if result is None:
         st.write('Сначала получите данные')
     else:
-        result = st.session_state.get('result')
         st.markdown('Краткая статистика по очищенным данным.')
         # Рассчитываем метрики
-        count_tokens, count_tokens_fig = plot_token_count(result.cleaned_corpus)
-        tokens_dist_fig = plot_tokens_distribution(result.cleaned_corpus)
+        count_tokens, count_tokens_fig = plot_token_count(result.cleaned_corpus, result.corpus_key)
+        tokens_dist_fig = plot_tokens_distribution(result.cleaned_corpus, result.corpus_key)
 
         # изображаем метрики
         col1, col2 = st.columns(2)
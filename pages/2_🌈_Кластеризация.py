@@ -1,7 +1,7 @@
 import streamlit as st
 
 from loader import VALID_ALGORITHM
-from utils.snippet import plot_streamlit_clusters
+from utils.snippet import plot_streamlit_clusters, get_result
 
 header = st.container()
 body = st.container()
@@ -11,10 +11,10 @@ with header:
 
 
 with body:
-    if "result" not in st.session_state:
+    result = get_result()
+    if result is None:
         st.write('Сначала получите данные')
     else:
-        result = st.session_state.get('result')
         st.markdown('Во вкладке *Данные* представлены исходные данные для кластеризации. '
                     'Далее следуют результаты кластеризации по каждому из алгоритмов:\n'
                     '+ Трёхмерная визуализация (Точка=Комментарий);\n'
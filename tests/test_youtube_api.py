@@ -0,0 +1,268 @@
+import json
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+from urllib.parse import urlparse, parse_qs
+
+import pyyoutube
+
+from topics import CommentArchive, YouTubeApi
+
+
+def thread(comment_id: str, published_at: str) -> dict:
+    """
+    Ветка комментариев в формате ответа API
+    :param comment_id: id комментария
+    :param published_at: время публикации
+    """
+    return {'kind': 'youtube#commentThread', 'id': comment_id,
+            'snippet': {'videoId': 'video',
+                        'topLevelComment': {'kind': 'youtube#comment', 'id': comment_id,
+                                            'snippet': {'textDisplay': f'text {comment_id}',
+                                                        'publishedAt': published_at}}}}
+
+
+def page(comment_ids: list, next_page_token: str = None) -> tuple:
+    """
+    Успешный ответ со страницей веток комментариев
+    :param comment_ids: id комментариев страницы
+    :param next_page_token: токен следующей страницы
+    """
+    body = {'kind': 'youtube#commentThreadListResponse',
+            'items': [thread(comment_id, f'2022-10-{i + 1:02d}T00:00:00Z')
+                      for i, comment_id in enumerate(comment_ids)]}
+    if next_page_token is not None:
+        body['nextPageToken'] = next_page_token
+    return 200, body
+
+
+def activity(video_id: str, activity_type: str = 'upload') -> dict:
+    """
+    Активность канала в формате ответа API
+    :param video_id: id видео
+    :param activity_type: тип активности
+    """
+    details = {'videoId': video_id} if activity_type == 'upload' \
+        else {'resourceId': {'kind': 'youtube#video', 'videoId': video_id}}
+    return {'kind': 'youtube#activity', 'id': f'{activity_type}-{video_id}',
+            'snippet': {'type': activity_type, 'channelId': 'channel'},
+            'contentDetails': {activity_type: details}}
+
+
+def activities(items: list, next_page_token: str = None) -> tuple:
+    """
+    Успешный ответ со страницей активностей канала
+    :param items: активности страницы
+    :param next_page_token: токен следующей страницы
+    """
+    body = {'kind': 'youtube#activityListResponse', 'items': items}
+    if next_page_token is not None:
+        body['nextPageToken'] = next_page_token
+    return 200, body
+
+
+def error(code: int, message: str = 'error') -> tuple:
+    """
+    Ответ API с ошибкой
+    :param code: код ответа
+    :param message: текст ошибки
+    """
+    return code, {'error': {'code': code, 'message': message}}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        page_token = query.get('pageToken')
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            if url.path.endswith('/activities'):
+                server.activity_requests.append(page_token)
+                responses = server.activities[page_token]
+            else:
+                video_id = query.get('videoId')
+                server.requests.append(page_token)
+                server.video_requests.append(video_id)
+                # задержка ответа для видео (time.sleep в тестах подменён)
+                threading.Event().wait(server.delays.get(video_id, 0))
+                # ответы на каждый токен страницы выдаются по очереди, последний повторяется.
+                # ответы для конкретного видео или порядка выдачи задаются ключами
+                # (video_id, page_token) и (order, page_token)
+                responses = server.responses.get((video_id, page_token)) \
+                    or server.responses.get((query.get('order'), page_token)) \
+                    or server.responses[page_token]
+            with server.lock:
+                status, body = responses.pop(0) if len(responses) > 1 else responses[0]
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class YouTubeApiTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.requests = []
+        self.server.video_requests = []
+        self.server.responses = {}
+        self.server.activity_requests = []
+        self.server.activities = {}
+        self.server.delays = {}
+        self.server.lock = threading.Lock()
+        self.server.in_flight = self.server.max_in_flight = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}/'
+        # задержки между повторами только запоминаются
+        sleep = mock.patch('topics.youtube_api.time.sleep')
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def make_api(self, **kwargs) -> YouTubeApi:
+        api = YouTubeApi('key', base_url=self.base_url, backoff=0.5, **kwargs)
+        # страницы заглушки по два комментария, как полные страницы API
+        api.PAGE_SIZE = 2
+        return api
+
+    def test_retries_with_exponential_backoff(self) -> None:
+        self.server.responses = {None: [error(503), error(429), page(['a', 'b'], 'p2')],
+                                 'p2': [error(500), page(['c'])]}
+        api = self.make_api(retries=3)
+        pages = [[item.id for item in items] for items, _ in api.iter_comment_threads('video', 10, 'time')]
+        self.assertEqual(pages, [['a', 'b'], ['c']])
+        self.assertEqual(self.server.requests, [None, None, None, 'p2', 'p2'])
+        self.assertEqual([c.args[0] for c in self.sleep.call_args_list], [0.5, 1.0, 0.5])
+
+    def test_gives_up_after_retries(self) -> None:
+        self.server.responses = {None: [error(503)]}
+        api = self.make_api(retries=2)
+        with self.assertRaises(pyyoutube.PyYouTubeException):
+            list(api.iter_comment_threads('video', 10, 'time'))
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_non_retryable_error_is_not_repeated(self) -> None:
+        # комментарии отключены: видео просто пропускается
+        self.server.responses = {None: [error(403, 'The video has disabled comments.')]}
+        api = self.make_api(retries=3)
+        self.assertEqual(list(api.iter_comment_threads('video', 10, 'time')), [])
+        self.assertEqual(self.server.requests, [None])
+        self.sleep.assert_not_called()
+
+    def test_resumes_from_failed_page(self) -> None:
+        self.server.responses = {None: [page(['a', 'b'], 'p2')],
+                                 'p2': [error(503)]}
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = CommentArchive(Path(tmp) / 'comments.sqlite')
+            api = self.make_api(retries=1, archive=archive)
+            with self.assertRaises(pyyoutube.PyYouTubeException):
+                api.extract_comments_by_video('video', 10, 'time')
+            self.assertEqual(archive.listing('video', 'time'), (2, 'p2'))
+
+            self.server.requests.clear()
+            self.server.responses['p2'] = [page(['c'])]
+            comments = api.extract_comments_by_video('video', 10, 'time')
+            # первая страница повторно не запрашивается
+            self.assertEqual(self.server.requests, ['p2'])
+            self.assertEqual(sorted(comments), ['text a', 'text b', 'text c'])
+            self.assertEqual(archive.listing('video', 'time'), (3, None))
+
+    def test_backfills_when_more_comments_requested(self) -> None:
+        self.server.responses = {None: [page(['a', 'b'], 'p2')],
+                                 'p2': [page(['c', 'd'], 'p3')],
+                                 'p3': [page(['e'])]}
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = CommentArchive(Path(tmp) / 'comments.sqlite')
+            api = self.make_api(archive=archive)
+            self.assertEqual(len(api.extract_comments_by_video('video', 2, 'time')), 2)
+            # архив свежий, но просят больше комментариев: выдача докачивается со следующей страницы
+            self.assertEqual(len(api.extract_comments_by_video('video', 4, 'time')), 4)
+            self.assertEqual(self.server.requests, [None, 'p2'])
+            self.assertEqual(archive.listing('video', 'time'), (4, 'p3'))
+            # хватает уже скачанного
+            self.assertEqual(len(api.extract_comments_by_video('video', 3, 'time')), 3)
+            self.assertEqual(self.server.requests, [None, 'p2'])
+
+    def test_keeps_requested_order(self) -> None:
+        # по релевантности первым идёт более старый комментарий
+        self.server.responses = {('relevance', None): [page(['a', 'b'])],
+                                 ('time', None): [page(['b', 'c'])]}
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = CommentArchive(Path(tmp) / 'comments.sqlite')
+            api = self.make_api(archive=archive)
+            self.assertEqual(api.extract_comments_by_video('video', 2, 'relevance'), ['text a', 'text b'])
+            # выдача в другом порядке ещё не скачивалась
+            self.assertEqual(api.extract_comments_by_video('video', 2, 'time'), ['text c', 'text b'])
+            self.assertEqual(api.extract_comments_by_video('video', 2, 'relevance'), ['text a', 'text b'])
+            self.assertEqual(self.server.requests, [None, None])
+
+    def test_list_of_videos_keeps_order_and_worker_limit(self) -> None:
+        video_ids = [f'video{i}' for i in range(6)]
+        self.server.responses = {(video_id, None): [page([f'{video_id}-a', f'{video_id}-b'])]
+                                 for video_id in video_ids}
+        # первые видео отвечают дольше всех
+        self.server.delays = {video_id: 0.05 * (len(video_ids) - i) for i, video_id in enumerate(video_ids)}
+        api = self.make_api(max_workers=2)
+        expected = [[f'text {video_id}-a', f'text {video_id}-b'] for video_id in video_ids]
+        self.assertEqual(api.extract_comments_by_list_of_video(video_ids, 2, 'time'), expected)
+        self.assertEqual(self.server.max_in_flight, 2)
+
+        self.server.max_in_flight = 0
+        pages = list(api.iter_comments_by_list_of_video(video_ids, 2, 'time'))
+        self.assertEqual(pages, expected)
+        self.assertEqual(self.server.max_in_flight, 2)
+        self.assertEqual(sorted(self.server.video_requests), sorted(video_ids * 2))
+
+    def test_video_ids_by_channel(self) -> None:
+        self.server.activities = {None: [activities([activity('v1'), activity('x', 'like'), activity('video')],
+                                                    'a2')],
+                                  'a2': [activities([activity('v2'), activity('v3')])]}
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = CommentArchive(Path(tmp) / 'comments.sqlite')
+            api = self.make_api(archive=archive)
+            # ролик по ссылке идёт первым и не повторяется, активности кроме загрузок пропускаются
+            self.assertEqual(api.get_video_id_by_channel('channel', 3, 'video'), ['video', 'v1', 'v2'])
+            self.assertEqual(self.server.activity_requests, [None, 'a2'])
+            self.assertEqual(archive.get_channel('v2'), 'channel')
+
+    def test_streams_new_video_while_archiving(self) -> None:
+        self.server.responses = {None: [page(['a', 'b'], 'p2')],
+                                 'p2': [page(['c'])]}
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = CommentArchive(Path(tmp) / 'comments.sqlite')
+            api = self.make_api(archive=archive)
+            pages = api.iter_comments_by_video('video', 10, 'time')
+            # первая страница отдаётся до запроса следующей
+            self.assertEqual(next(pages), ['text a', 'text b'])
+            self.assertEqual(self.server.requests, [None])
+            self.assertEqual(list(pages), [['text c']])
+            self.assertEqual(archive.listing('video', 'time'), (3, None))
+            self.assertIsNotNone(archive.refreshed_at('video'))
+
+    def test_stopped_consumer_cancels_pending_videos(self) -> None:
+        self.server.responses = {None: [page(['a', 'b'])]}
+        api = self.make_api(max_workers=1)
+        pages = api.iter_comments_by_list_of_video([f'video{i}' for i in range(5)], 2, 'time')
+        self.assertEqual(next(pages), ['text a', 'text b'])
+        pages.close()
+        # видео после остановки потребителя не запрашиваются
+        self.assertLessEqual(len(self.server.requests), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,20 @@
 # Порядок важен!!!!!!!!!!!!!!!!!!!!!
+from .archive import CommentArchive
 from .youtube_api import YouTubeApi
+from .corpus import TokenCorpus
+from .lemmatizer import MystemPool
+from .lemma_cache import LemmaCache
 from .preprocessing import TextPreprocessor
 from .embedding import Emdedder
+from .model_store import ModelStore
+from .stage_cache import StageCache
+from .disk_store import DiskStore
+from .near_duplicates import NearDuplicates
+from .neighbors import NeighborGraph
 from .reducer import Reducer
+from .scoring import ClusterScorer
 from .clusters import Cluster
+from .term_index import TermIndex
+from .wordclouds import WordClouds
+from .jobs import JobRunner
 from .topics import Topics
@@ -0,0 +1,204 @@
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import List, Tuple, Optional, Iterator, Union
+
+
+class CommentArchive:
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS comments (
+            video_id TEXT NOT NULL,
+            comment_id TEXT NOT NULL,
+            text TEXT NOT NULL,
+            published_at TEXT NOT NULL,
+            relevance_rank INTEGER,
+            PRIMARY KEY (video_id, comment_id)
+        );
+        CREATE INDEX IF NOT EXISTS comments_published ON comments (video_id, published_at);
+        CREATE TABLE IF NOT EXISTS videos (
+            video_id TEXT PRIMARY KEY,
+            channel_id TEXT,
+            refreshed_at REAL
+        );
+        CREATE TABLE IF NOT EXISTS listings (
+            video_id TEXT NOT NULL,
+            sort_order TEXT NOT NULL,
+            fetched INTEGER NOT NULL,
+            page_token TEXT,
+            PRIMARY KEY (video_id, sort_order)
+        );
+    '''
+    # место комментария в выдаче API по релевантности, для архивов без этой колонки
+    MIGRATION = '''
+        ALTER TABLE comments ADD COLUMN relevance_rank INTEGER;
+    '''
+    INDEXES = '''
+        CREATE INDEX IF NOT EXISTS comments_relevance ON comments (video_id, relevance_rank);
+    '''
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        """
+        Локальный архив комментариев в SQLite
+        :param path: файл базы данных
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self.connect()) as connection:
+            connection.executescript(self.SCHEMA)
+            columns = [row[1] for row in connection.execute('PRAGMA table_info(comments)')]
+            if 'relevance_rank' not in columns:
+                connection.executescript(self.MIGRATION)
+            connection.executescript(self.INDEXES)
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Новое соединение с базой. Соединение на каждый вызов,
+        так как архив используется из нескольких потоков
+        """
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def write_comments(connection: sqlite3.Connection, video_id: str, comments: List[Tuple[str, str, str]],
+                       first_rank: Optional[int] = None) -> None:
+        """
+        Добавляет или обновляет комментарии, не затирая их место в выдаче по релевантности
+        :param connection: соединение с базой
+        :param video_id: id видео
+        :param comments: список (id комментария, текст, время публикации)
+        :param first_rank: место первого комментария в выдаче по релевантности, None - не менять
+        """
+        if first_rank is None:
+            connection.executemany('INSERT INTO comments (video_id, comment_id, text, published_at) '
+                                   'VALUES (?, ?, ?, ?) ON CONFLICT (video_id, comment_id) DO UPDATE '
+                                   'SET text = excluded.text, published_at = excluded.published_at',
+                                   [(video_id, *comment) for comment in comments])
+        else:
+            connection.executemany('INSERT INTO comments VALUES (?, ?, ?, ?, ?) '
+                                   'ON CONFLICT (video_id, comment_id) DO UPDATE '
+                                   'SET text = excluded.text, published_at = excluded.published_at, '
+                                   'relevance_rank = excluded.relevance_rank',
+                                   [(video_id, *comment, first_rank + i) for i, comment in enumerate(comments)])
+
+    def add_comments(self, video_id: str, comments: List[Tuple[str, str, str]]) -> None:
+        """
+        Добавляет или обновляет комментарии видео
+        :param video_id: id видео
+        :param comments: список (id комментария, текст, время публикации)
+        """
+        with closing(self.connect()) as connection, connection:
+            self.write_comments(connection, video_id, comments)
+
+    def add_page(self, video_id: str, comments: List[Tuple[str, str, str]], order: str,
+                 fetched: int, page_token: Optional[str]) -> None:
+        """
+        Добавляет страницу выдачи API и запоминает, с какой страницы продолжить выдачу.
+        Комментарии и позиция пишутся в одной транзакции
+        :param video_id: id видео
+        :param comments: список (id комментария, текст, время публикации)
+        :param order: порядок выдачи API
+        :param fetched: сколько комментариев выдачи скачано вместе с этой страницей
+        :param page_token: токен следующей страницы, None - выдача закончилась
+        """
+        first_rank = fetched - len(comments) if order == 'relevance' else None
+        with closing(self.connect()) as connection, connection:
+            self.write_comments(connection, video_id, comments, first_rank)
+            connection.execute('INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?)',
+                               (video_id, order, fetched, page_token))
+
+    def listing(self, video_id: str, order: str) -> Optional[Tuple[int, Optional[str]]]:
+        """
+        Состояние скачивания выдачи API в порядке order
+        :param video_id: id видео
+        :param order: порядок выдачи API
+        :return: количество скачанных комментариев и токен следующей страницы
+                 или None, если выдача не скачивалась
+        """
+        with closing(self.connect()) as connection:
+            row = connection.execute('SELECT fetched, page_token FROM listings '
+                                     'WHERE video_id = ? AND sort_order = ?', (video_id, order)).fetchone()
+        return tuple(row) if row else None
+
+    def mark_refreshed(self, video_id: str) -> None:
+        """
+        Запоминает время обновления комментариев видео
+        :param video_id: id видео
+        """
+        with closing(self.connect()) as connection, connection:
+            connection.execute('INSERT INTO videos (video_id, refreshed_at) VALUES (?, ?) '
+                               'ON CONFLICT (video_id) DO UPDATE SET refreshed_at = excluded.refreshed_at',
+                               (video_id, time.time()))
+
+    def set_channel(self, video_id: str, channel_id: str) -> None:
+        """
+        Запоминает канал видео
+        :param video_id: id видео
+        :param channel_id: id канала
+        """
+        with closing(self.connect()) as connection, connection:
+            connection.execute('INSERT INTO videos (video_id, channel_id) VALUES (?, ?) '
+                               'ON CONFLICT (video_id) DO UPDATE SET channel_id = excluded.channel_id',
+                               (video_id, channel_id))
+
+    def get_channel(self, video_id: str) -> Optional[str]:
+        """
+        Канал видео, если он известен
+        :param video_id: id видео
+        """
+        with closing(self.connect()) as connection:
+            row = connection.execute('SELECT channel_id FROM videos WHERE video_id = ?', (video_id,)).fetchone()
+        return row[0] if row else None
+
+    def channel_videos(self, channel_id: str, n_videos: int, video_id: str) -> List[str]:
+        """
+        Видео канала из архива, начиная с переданного
+        :param channel_id: id канала
+        :param n_videos: максимальное количество видео
+        :param video_id: id видео, которое включить первым
+        :return: список из id видео
+        """
+        with closing(self.connect()) as connection:
+            rows = connection.execute('SELECT video_id FROM videos '
+                                      'WHERE channel_id = ? AND video_id != ? AND refreshed_at IS NOT NULL '
+                                      'ORDER BY refreshed_at DESC LIMIT ?',
+                                      (channel_id, video_id, n_videos - 1)).fetchall()
+        return [video_id] + [row[0] for row in rows]
+
+    def refreshed_at(self, video_id: str) -> Optional[float]:
+        """
+        Время последнего обновления комментариев видео
+        :param video_id: id видео
+        """
+        with closing(self.connect()) as connection:
+            row = connection.execute('SELECT refreshed_at FROM videos WHERE video_id = ?', (video_id,)).fetchone()
+        return row[0] if row else None
+
+    def last_published(self, video_id: str) -> Optional[str]:
+        """
+        Время публикации самого нового комментария видео в архиве
+        :param video_id: id видео
+        """
+        with closing(self.connect()) as connection:
+            row = connection.execute('SELECT MAX(published_at) FROM comments WHERE video_id = ?',
+                                     (video_id,)).fetchone()
+        return row[0]
+
+    def iter_comments(self, video_id: str, max_comments: int, page_size: int = 100,
+                      order: str = 'time') -> Iterator[List[str]]:
+        """
+        Постранично читает комментарии видео в порядке выдачи API.
+        По релевантности сначала идут комментарии в порядке скачанной выдачи,
+        затем докачанные позже новые. Иначе - самые новые
+        :param video_id: id видео
+        :param max_comments: максимальное число комментариев
+        :param page_size: размер страницы
+        :param order: порядок комментариев у API YouTube
+        :return: страницы текстов комментариев
+        """
+        order_by = 'relevance_rank IS NULL, relevance_rank, ' if order == 'relevance' else ''
+        with closing(self.connect()) as connection:
+            cursor = connection.execute('SELECT text FROM comments WHERE video_id = ? '
+                                        f'ORDER BY {order_by}published_at DESC LIMIT ?',
+                                        (video_id, max_comments))
+            for rows in iter(lambda: cursor.fetchmany(page_size), []):
+                yield [row[0] for row in rows]
@@ -1,20 +1,95 @@
 # Возникает ошибка при импорте hdbscan. Решение - установка библиотеки joblib версии 1.1.0
 # https://stackoverflow.com/questions/73830225/init-got-an-unexpected-keyword-argument-cachedir-when-importing-top2vec
-from typing import Tuple
+import logging
+import os
+from typing import Tuple, List, Optional
 
 import hdbscan
 import numpy as np
 import pandas as pd
-from sklearn.cluster import AgglomerativeClustering, SpectralClustering, KMeans, DBSCAN
-from sklearn.metrics import (calinski_harabasz_score,
-                             davies_bouldin_score,
-                             silhouette_score)
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.cluster import AgglomerativeClustering, SpectralClustering, KMeans, MiniBatchKMeans, DBSCAN
 from sklearn.preprocessing import MinMaxScaler
 
+from topics import ClusterScorer
+from topics.neighbors import NeighborGraph
+from topics.scoring import measure_call
+
+
+def fit_and_score(model, scorer: ClusterScorer, n: int, fit_data=None,
+                  fit_params: Optional[dict] = None) -> Tuple[Tuple[float, float, float], float, int]:
+    """
+    Обучает копию модели с n кластерами и считает метрики.
+    Функция уровня модуля, чтобы её можно было передать в пул процессов
+    :param model: модель-шаблон
+    :param scorer: подготовленный оценщик кластеров (по его выборке считаются метрики)
+    :param n: количество кластеров
+    :param fit_data: данные для обучения, если отличаются от выборки оценщика
+           (например, предпосчитанная матрица аффинности)
+    :param fit_params: дополнительные параметры fit (например, sample_weight)
+    :return: метрики calinski_harabasz, davies_bouldin, silhouette,
+             время и пик памяти их подсчёта (пик только при scorer.trace_memory)
+    """
+    model = clone(model).set_params(n_clusters=n)
+    model.fit(scorer.X if fit_data is None else fit_data, **(fit_params or {}))
+    return measure_call(scorer.score, model.labels_, trace_memory=scorer.trace_memory)
+
+
+def search_jobs(n_outer: int) -> int:
+    """
+    Количество процессов перебора числа кластеров, при котором все параллельные переборы
+    вместе занимают не больше ядер, чем есть
+    :param n_outer: сколько переборов может идти одновременно (алгоритмы в пуле x задачи)
+    """
+    return max(1, (os.cpu_count() or 1) // max(n_outer, 1))
+
+
+def compact_labels(labels: np.array, dtypes: Tuple[np.dtype, ...] = (np.int8, np.int16, np.int32)) -> np.array:
+    """
+    Приводит метки кластеров к наименьшему знаковому типу, вмещающему все кластеры
+    (int8 переполняется при числе кластеров больше 127)
+    :param labels: метки кластеров, шум -1
+    :param dtypes: допустимые типы по возрастанию размера
+    """
+    max_label = int(labels.max(initial=-1))
+    for dtype in dtypes:
+        if max_label <= np.iinfo(dtype).max:
+            return labels.astype(dtype, copy=False)
+    return labels.astype(np.int64, copy=False)
+
 
 class Cluster:
-    def __init__(self):
-        pass
+    def __init__(self, exhaustive: bool = True, coarse_step: int = 4, n_jobs: Optional[int] = -1,
+                 scorer: Optional[ClusterScorer] = None, neighbor_graph: Optional[NeighborGraph] = None,
+                 label_dtypes: Tuple[np.dtype, ...] = (np.int8, np.int16, np.int32)):
+        """
+        :param exhaustive: флаг - перебирать все числа кластеров из диапазона.
+               Иначе поиск идёт от грубой сетки к точной
+        :param coarse_step: шаг грубой сетки при неполном переборе
+        :param n_jobs: количество процессов для перебора числа кластеров
+        :param scorer: оценщик кластеров для подбора их количества
+        :param neighbor_graph: общий граф соседей кластеризуемых точек
+        :param label_dtypes: допустимые типы меток кластеров по возрастанию размера
+        """
+        self.exhaustive = exhaustive
+        self.coarse_step = coarse_step
+        self.n_jobs = n_jobs
+        self.scorer = scorer if scorer is not None else ClusterScorer()
+        self.neighbor_graph = neighbor_graph
+        self.label_dtypes = label_dtypes
+        self.scoring_stats = {}
+
+    def get_neighbor_graph(self, X, n_neighbors: int) -> NeighborGraph:
+        """
+        Общий граф соседей, если он построен по тем же точкам и с достаточным числом соседей,
+        иначе отдельный граф
+        :param n_neighbors: нужное количество соседей
+        """
+        graph = self.neighbor_graph
+        if graph is not None and graph.X is X and graph.n_neighbors >= n_neighbors:
+            return graph
+        return NeighborGraph(X, n_neighbors=n_neighbors)
 
     def hdbscan_clusters(self, X, **hdbscan_params) -> np.array:
         """
@@ -22,15 +97,21 @@ class Cluster:
         """
         model = hdbscan.HDBSCAN(**hdbscan_params)
         model.fit(X)
-        return model.labels_.astype(np.int8)
+        return compact_labels(model.labels_, self.label_dtypes)
 
     def dbscan_clusters(self, X, **dbscan_params) -> np.array:
         """
-        Кластеры алгоритма DBSCAN
+        Кластеры алгоритма DBSCAN.
+        Окрестности берутся запросом по радиусу к общему индексу соседей
         """
+        metric = dbscan_params.get('metric', 'euclidean')
+        graph = self.neighbor_graph
+        if graph is not None and graph.X is X and graph.metric == metric:
+            dbscan_params = {**dbscan_params, 'metric': 'precomputed'}
+            X = graph.radius_graph(dbscan_params.get('eps', 0.5))
         model = DBSCAN(**dbscan_params)
         model.fit(X)
-        return model.labels_.astype(np.int8)
+        return compact_labels(model.labels_, self.label_dtypes)
 
     def agglomerative_clusters(self, X, **aglomerat_params) -> np.array:
         """
@@ -38,57 +119,81 @@ class Cluster:
         """
         model = AgglomerativeClustering(**aglomerat_params)
         model.fit(X)
-        return model.labels_.astype(np.int8)
+        return compact_labels(model.labels_, self.label_dtypes)
 
     def spectral_clusters(self, X, n_minmax: Tuple[int, int], **spectral_params) -> np.array:
         """
         Кластеры алгоритма SpectralClustering
         :param n_minmax: диапазон количества кластеров для поиска лучшего числа
         """
+        # граф ближайших соседей строится один раз и переиспользуется всеми кандидатами
+        affinity = X
+        if spectral_params.get('affinity') == 'nearest_neighbors':
+            n_neighbors = spectral_params.get('n_neighbors', 10)
+            affinity = self.get_neighbor_graph(X, n_neighbors).knn_graph(n_neighbors)
+            spectral_params = {**spectral_params, 'affinity': 'precomputed_nearest_neighbors'}
+
         model = SpectralClustering(**spectral_params)
-        best_clusters = self.get_best_n_clusters(X, model, n_minmax)
+        best_clusters = self.get_best_n_clusters(X, model, n_minmax, fit_data=affinity)
         model = SpectralClustering(n_clusters=best_clusters, **spectral_params)
-        model.fit(X)
-        return model.labels_.astype(np.int8)
+        model.fit(affinity)
+        return compact_labels(model.labels_, self.label_dtypes)
 
-    def kmeans_clusters(self, X, n_minmax: Tuple[int, int], **kmeans_params) -> np.array:
+    def kmeans_clusters(self, X, n_minmax: Tuple[int, int], sample_weight: Optional[np.array] = None,
+                        **kmeans_params) -> np.array:
         """
         Кластеры алгоритма KMeans
         :param n_minmax: диапазон количества кластеров для поиска лучшего числа
+        :param sample_weight: веса примеров (количество схлопнутых почти одинаковых комментариев)
         """
         model = KMeans(**kmeans_params)
-        best_clusters = self.get_best_n_clusters(X, model, n_minmax)
+        best_clusters = self.get_best_n_clusters(X, model, n_minmax,
+                                                 fit_params={'sample_weight': sample_weight})
         model = KMeans(n_clusters=best_clusters, **kmeans_params)
-        model.fit(X)
-        return model.labels_.astype(np.int8)
+        model.fit(X, sample_weight=sample_weight)
+        return compact_labels(model.labels_, self.label_dtypes)
 
-    def get_best_n_clusters(self, X_train, model, n_minmax: Tuple[int, int]) -> int:
+    def minibatch_kmeans_clusters(self, X, n_minmax: Tuple[int, int], sample_weight: Optional[np.array] = None,
+                                  **kmeans_params) -> np.array:
         """
-        Вычисляет лучшее количество кластеров ориентируясь на метрики
+        Кластеры алгоритма MiniBatchKMeans (KMeans для больших данных)
+        :param n_minmax: диапазон количества кластеров для поиска лучшего числа
+        :param sample_weight: веса примеров (количество схлопнутых почти одинаковых комментариев)
+        """
+        model = MiniBatchKMeans(**kmeans_params)
+        best_clusters = self.get_best_n_clusters(X, model, n_minmax,
+                                                 fit_params={'sample_weight': sample_weight})
+        model = MiniBatchKMeans(n_clusters=best_clusters, **kmeans_params)
+        model.fit(X, sample_weight=sample_weight)
+        return compact_labels(model.labels_, self.label_dtypes)
+
+    def score_candidates(self, X_train, model, candidates: List[int], fit_data=None,
+                         fit_params: Optional[dict] = None) -> pd.DataFrame:
+        """
+        Параллельно обучает модель для каждого числа кластеров и считает метрики
         :param X_train: обучающаяся выборка
-        :param model: модель для которой определить лучшие кластеры
-        :param n_minmax: интервал в котором ищем
+        :param model: модель-шаблон
+        :param candidates: числа кластеров
+        :param fit_data: данные для обучения, если отличаются от X_train
+        :param fit_params: дополнительные параметры fit
+        :return: таблица метрик с индексом по числу кластеров
         """
-        n_min, n_max = n_minmax
-        # считаем метрики
-        calinski_harabasz_scores = []
-        davies_bouldin_scores = []
-        silhouette_scores = []
-        for n in range(n_min, n_max + 1):
-            model.set_params(n_clusters=n)
-            model.fit(X_train)
-            calinski_harabasz_scores.append(calinski_harabasz_score(X_train, model.labels_))
-            davies_bouldin_scores.append(davies_bouldin_score(X_train, model.labels_))
-            silhouette_scores.append(silhouette_score(X_train, model.labels_))
-
-        # вычисляем лучшее количество кластеров
-        df_metrics = pd.DataFrame(data={'cal_har': calinski_harabasz_scores,
-                                        'dav_bould': davies_bouldin_scores,
-                                        'silhouette': silhouette_scores
-                                        },
-                                  index=range(n_min, n_max + 1)
-                                  )
+        results = Parallel(n_jobs=self.n_jobs)(delayed(fit_and_score)(model, self.scorer, n, fit_data, fit_params)
+                                               for n in candidates)
+        scores, times, peaks = zip(*results)
+        self.scoring_stats['score_time'] = self.scoring_stats.get('score_time', 0) + sum(times)
+        self.scoring_stats['score_peak'] = max(self.scoring_stats.get('score_peak', 0), *peaks)
+        return pd.DataFrame(data=list(scores),
+                            columns=['cal_har', 'dav_bould', 'silhouette'],
+                            index=candidates)
 
+    def union_metric(self, df_metrics: pd.DataFrame) -> pd.Series:
+        """
+        Объединяет метрики в одну нормализованную
+        :param df_metrics: таблица метрик
+        :return: объединенная метрика для каждого числа кластеров
+        """
+        df_metrics = df_metrics.sort_index()
         # инвертируем для удобства сравнивания метрик по максимуму
         # (так как у этой метрики лучшие значения у минимума)
         df_metrics['dav_bould'] = 1 / df_metrics['dav_bould']
@@ -98,8 +203,61 @@ class Cluster:
         df_metrics[df_metrics.columns] = scaler.fit_transform(df_metrics)
 
         # объединенная метрика
-        union_metric = 1 / 3 * df_metrics['cal_har'] \
-                       + 1 / 3 * df_metrics['dav_bould'] \
-                       + 1 / 3 * df_metrics['silhouette']
+        return 1 / 3 * df_metrics['cal_har'] \
+               + 1 / 3 * df_metrics['dav_bould'] \
+               + 1 / 3 * df_metrics['silhouette']
+
+    def get_best_n_clusters(self, X_train, model, n_minmax: Tuple[int, int], fit_data=None,
+                            fit_params: Optional[dict] = None) -> int:
+        """
+        Вычисляет лучшее количество кластеров ориентируясь на метрики
+        :param X_train: обучающаяся выборка
+        :param model: модель для которой определить лучшие кластеры
+        :param n_minmax: интервал в котором ищем
+        :param fit_data: данные для обучения модели, если отличаются от X_train
+        :param fit_params: дополнительные параметры fit модели
+        """
+        trace_memory = self.scorer.trace_memory
+        _, prepare_time, prepare_peak = measure_call(self.scorer.prepare, X_train, trace_memory=trace_memory)
+        self.scoring_stats = {'prepare_time': prepare_time, 'prepare_peak': prepare_peak}
+        best = self.search_best_n_clusters(X_train, model, n_minmax, fit_data, fit_params)
+        message = (f"Оценка кластеров: подготовка {prepare_time:.2f} c, "
+                   f"метрики {self.scoring_stats['score_time']:.2f} c")
+        if trace_memory:
+            message += (f" (пик памяти: подготовка {prepare_peak / 2 ** 20:.1f} МБ, "
+                        f"метрики {self.scoring_stats['score_peak'] / 2 ** 20:.1f} МБ)")
+        logging.info(message)
+        return best
+
+    def search_best_n_clusters(self, X_train, model, n_minmax: Tuple[int, int], fit_data=None,
+                               fit_params: Optional[dict] = None) -> int:
+        """
+        Перебор числа кластеров: полный или от грубой сетки к точной
+        :param X_train: обучающаяся выборка
+        :param model: модель для которой определить лучшие кластеры
+        :param n_minmax: интервал в котором ищем
+        :param fit_data: данные для обучения модели, если отличаются от X_train
+        :param fit_params: дополнительные параметры fit модели
+        """
+        n_min, n_max = n_minmax
+        if self.exhaustive or n_max - n_min <= 2 * self.coarse_step:
+            df_metrics = self.score_candidates(X_train, model, list(range(n_min, n_max + 1)),
+                                               fit_data, fit_params)
+            return self.union_metric(df_metrics).idxmax()
 
-        return union_metric.idxmax()
+        # грубая сетка, затем уточнение вокруг пика, пока шаг не станет единичным.
+        # метрики нормализуются по всем посчитанным точкам, поэтому результат может
+        # отличаться от полного перебора
+        candidates = sorted(set(range(n_min, n_max + 1, self.coarse_step)) | {n_max})
+        df_metrics = self.score_candidates(X_train, model, candidates, fit_data, fit_params)
+        step = self.coarse_step
+        while step > 1:
+            best = self.union_metric(df_metrics).idxmax()
+            step = max(step // 2, 1)
+            candidates = [n for n in range(max(best - step, n_min), min(best + step, n_max) + 1)
+                          if n not in df_metrics.index]
+            if candidates:
+                df_metrics = pd.concat([df_metrics,
+                                        self.score_candidates(X_train, model, candidates,
+                                                              fit_data, fit_params)])
+        return self.union_metric(df_metrics).idxmax()
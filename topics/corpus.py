@@ -0,0 +1,209 @@
+import hashlib
+import pickle
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+IDS_FILE = 'ids.bin'
+OFFSETS_FILE = 'offsets.npy'
+VOCAB_FILE = 'vocab.pkl'
+
+
+def load_ids(path: Path, mmap_mode: Optional[str] = 'r') -> np.array:
+    """
+    Индексы токенов из файла, отображённые в память
+    :param path: файл индексов int32
+    :param mmap_mode: режим отображения, None - прочитать в память
+    """
+    if path.stat().st_size == 0:
+        # пустой файл нельзя отобразить в память
+        return np.zeros(0, dtype=np.int32)
+    if mmap_mode is None:
+        return np.fromfile(path, dtype=np.int32)
+    return np.memmap(path, dtype=np.int32, mode=mmap_mode)
+
+
+class TokenCorpus:
+    def __init__(self, vocab: np.array, ids: np.array, offsets: np.array) -> None:
+        """
+        Компактный токенизированный корпус в стиле CSR: словарь токенов,
+        плоский массив индексов токенов всех текстов и границы текстов.
+        Токены текста i - vocab[ids[offsets[i]:offsets[i + 1]]]
+        :param vocab: массив уникальных токенов (dtype=object)
+        :param ids: индексы токенов в словаре (int32)
+        :param offsets: границы текстов в ids, длина - количество текстов + 1
+        """
+        self.vocab = vocab
+        self.ids = ids
+        self.offsets = offsets
+
+    @classmethod
+    def from_texts(cls, texts: Iterable[List[str]], vocab: Optional[Dict[str, int]] = None) -> 'TokenCorpus':
+        """
+        Собирает корпус из токенизированных текстов
+        :param texts: токенизированные тексты
+        :param vocab: словарь токен - индекс, дополняется новыми токенами
+               (общий словарь для корпусов, собираемых по частям)
+        """
+        if vocab is None:
+            vocab = {}
+        ids, lengths = [], [0]
+        for text in texts:
+            ids.extend(vocab.setdefault(word, len(vocab)) for word in text)
+            lengths.append(len(text))
+        return cls(np.array(list(vocab), dtype=object),
+                   np.array(ids, dtype=np.int32),
+                   np.cumsum(lengths, dtype=np.int64))
+
+    @classmethod
+    def concat(cls, corpora: List['TokenCorpus']) -> 'TokenCorpus':
+        """
+        Склеивает корпуса с общим словарём (последний корпус содержит полный словарь)
+        :param corpora: корпуса, собранные from_texts с одним словарём
+        """
+        if not corpora:
+            return cls.from_texts([])
+        offsets = [np.zeros(1, dtype=np.int64)]
+        shift = 0
+        for corpus in corpora:
+            offsets.append(corpus.offsets[1:] + shift)
+            shift += len(corpus.ids)
+        return cls(corpora[-1].vocab,
+                   np.concatenate([corpus.ids for corpus in corpora]),
+                   np.concatenate(offsets))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    # количество текстов, индексы которых за раз переводятся в списки при обходе
+    ITER_BLOCK = 10_000
+
+    def __iter__(self) -> Iterator[List[str]]:
+        """
+        Тексты списками токенов. Корпус можно обходить многократно (нужно для обучения gensim).
+        Индексы читаются блоками, поэтому корпус на диске обходится потоково
+        """
+        words = self.vocab.tolist()
+        for block_start in range(0, len(self), self.ITER_BLOCK):
+            offsets = self.offsets[block_start:block_start + self.ITER_BLOCK + 1].tolist()
+            ids = self.ids[offsets[0]:offsets[-1]].tolist()
+            shift = offsets[0]
+            for start, end in zip(offsets[:-1], offsets[1:]):
+                yield [words[i] for i in ids[start - shift:end - shift]]
+
+    def __getitem__(self, item: Union[int, slice, np.array, List[int]]) -> Union[List[str], 'TokenCorpus']:
+        """
+        Текст по номеру или подкорпус по срезу, индексам или булевой маске
+        """
+        if isinstance(item, (int, np.integer)):
+            return self.vocab[self.ids[self.offsets[item]:self.offsets[item + 1]]].tolist()
+        if isinstance(item, slice):
+            index = np.arange(len(self))[item]
+        else:
+            index = np.asarray(item)
+            if index.dtype == bool:
+                index = np.flatnonzero(index)
+        return self.take(index)
+
+    def take(self, index: np.array) -> 'TokenCorpus':
+        """
+        Подкорпус из текстов с указанными номерами. Словарь не копируется
+        :param index: номера текстов
+        """
+        lengths = self.lengths()[index]
+        starts = self.offsets[:-1][index]
+        offsets = np.concatenate([np.zeros(1, dtype=np.int64), np.cumsum(lengths, dtype=np.int64)])
+        # позиции токенов выбранных текстов в ids
+        positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return TokenCorpus(self.vocab, self.ids[positions], offsets)
+
+    def lengths(self) -> np.array:
+        """
+        Количество токенов в каждом тексте
+        """
+        return np.diff(self.offsets)
+
+    def token_counts(self) -> Tuple[np.array, np.array]:
+        """
+        Частоты токенов корпуса
+        :return: токены, встречающиеся в корпусе, и их частоты
+        """
+        counts = np.bincount(self.ids, minlength=len(self.vocab))
+        used = counts > 0
+        return self.vocab[used], counts[used]
+
+    def join(self) -> str:
+        """
+        Все токены корпуса одной строкой через пробел
+        """
+        return ' '.join(self.vocab[self.ids].tolist())
+
+    def fingerprint(self) -> str:
+        """
+        Хеш содержимого корпуса. Массивы хешируются блоками, корпус на диске в память не читается
+        """
+        digest = hashlib.sha256(pickle.dumps(self.vocab.tolist(), protocol=pickle.HIGHEST_PROTOCOL))
+        digest.update(np.ascontiguousarray(self.offsets).tobytes())
+        step = 2 ** 24
+        for start in range(0, len(self.ids), step):
+            digest.update(np.ascontiguousarray(self.ids[start:start + step]).tobytes())
+        return digest.hexdigest()
+
+    def save(self, path: Union[str, Path]) -> None:
+        """
+        Сохраняет корпус в папку
+        :param path: папка корпуса
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.ascontiguousarray(self.ids, dtype=np.int32).tofile(path / IDS_FILE)
+        np.save(path / OFFSETS_FILE, self.offsets)
+        with open(path / VOCAB_FILE, 'wb') as f:
+            pickle.dump(self.vocab.tolist(), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path: Union[str, Path], mmap_mode: Optional[str] = 'r') -> 'TokenCorpus':
+        """
+        Загружает корпус из папки. Индексы токенов отображаются в память
+        :param path: папка корпуса
+        :param mmap_mode: режим отображения индексов, None - прочитать в память
+        """
+        path = Path(path)
+        with open(path / VOCAB_FILE, 'rb') as f:
+            vocab = np.array(pickle.load(f), dtype=object)
+        return cls(vocab, load_ids(path / IDS_FILE, mmap_mode), np.load(path / OFFSETS_FILE))
+
+
+class TokenCorpusWriter:
+    def __init__(self, path: Union[str, Path]) -> None:
+        """
+        Потоковая запись корпуса на диск порциями.
+        В памяти остаются только словарь и границы текстов
+        :param path: папка корпуса
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.vocab = {}
+        self.offsets = [0]
+        self.file = open(self.path / IDS_FILE, 'wb')
+
+    def write(self, texts: Iterable[List[str]]) -> None:
+        """
+        Дописывает порцию токенизированных текстов
+        :param texts: токенизированные тексты
+        """
+        chunk = TokenCorpus.from_texts(texts, self.vocab)
+        self.file.write(chunk.ids.tobytes())
+        self.offsets.extend((chunk.offsets[1:] + self.offsets[-1]).tolist())
+
+    def close(self) -> TokenCorpus:
+        """
+        Завершает запись
+        :return: записанный корпус, отображённый в память
+        """
+        self.file.close()
+        np.save(self.path / OFFSETS_FILE, np.array(self.offsets, dtype=np.int64))
+        with open(self.path / VOCAB_FILE, 'wb') as f:
+            pickle.dump(list(self.vocab), f, protocol=pickle.HIGHEST_PROTOCOL)
+        return TokenCorpus.load(self.path)
@@ -0,0 +1,259 @@
+import json
+import os
+import pickle
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .corpus import TokenCorpus, TokenCorpusWriter
+
+
+class CommentsFile:
+    def __init__(self, path: Union[str, Path]) -> None:
+        """
+        Сырые комментарии на диске (по одному json в строке) с доступом по номеру.
+        В памяти хранятся только смещения строк
+        :param path: файл комментариев
+        """
+        self.path = Path(path)
+        self.offsets = np.load(self.path.with_suffix('.offsets.npy'))
+
+    @staticmethod
+    def write(path: Union[str, Path], pages: Iterable[List[str]]) -> Iterator[List[str]]:
+        """
+        Записывает страницы комментариев по мере их прохождения дальше по конвейеру
+        :param path: файл комментариев
+        :param pages: страницы сырых комментариев
+        :return: те же страницы
+        """
+        path = Path(path)
+        offsets = [0]
+        with open(path, 'wb') as f:
+            for page in pages:
+                for comment in page:
+                    f.write(json.dumps(comment, ensure_ascii=False).encode('utf-8') + b'\n')
+                    offsets.append(f.tell())
+                yield page
+        np.save(path.with_suffix('.offsets.npy'), np.array(offsets, dtype=np.int64))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        with open(self.path, 'rb') as f:
+            f.seek(self.offsets[i])
+            return json.loads(f.read(self.offsets[i + 1] - self.offsets[i]))
+
+
+# блокировки папок запусков: один корпус не записывается двумя задачами одновременно
+_locks: Dict[Path, threading.Lock] = {}
+_locks_lock = threading.Lock()
+
+
+def tmp_name(name: str) -> str:
+    """
+    Имя временного файла, уникальное для процесса и потока
+    :param name: имя итогового файла
+    """
+    return f'{name}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+
+class DiskStore:
+    CORPUS_DIR = 'corpus'
+    COMMENTS_FILE = 'comments.jsonl'
+    SOURCE_INDEX_FILE = 'source_index.npy'
+    META_FILE = 'meta.json'
+
+    def __init__(self, root: Union[str, Path]) -> None:
+        """
+        Хранилище данных одного запуска в режиме канала.
+        Корпус, эмбеддинги и проекции лежат в файлах и отображаются в память,
+        поэтому миллион комментариев не держится в оперативной памяти целиком.
+        Каждое обновление корпуса пишется в новую папку версии внутри папки запуска,
+        поэтому открытые результаты продолжают читать файлы своей версии
+        :param root: папка запуска
+        """
+        self.root = Path(root)
+        # папка версии, с которой работает хранилище
+        self.path = self.latest()
+
+    def latest(self) -> Optional[Path]:
+        """
+        Последняя полностью записанная версия
+        """
+        versions = [path for path in self.root.glob('*')
+                    if path.name.isdigit() and (path / self.META_FILE).exists()]
+        return max(versions, key=lambda path: int(path.name), default=None)
+
+    def lock(self) -> threading.Lock:
+        """
+        Блокировка папки запуска: под ней проверяется свежесть корпуса и пишется новая версия
+        """
+        with _locks_lock:
+            return _locks.setdefault(self.root.resolve(), threading.Lock())
+
+    def is_fresh(self, max_age: Optional[float] = None) -> bool:
+        """
+        Проверяет, что корпус записан полностью и не устарел.
+        Хранилище переключается на последнюю записанную версию
+        :param max_age: максимальный возраст корпуса в секундах
+        """
+        self.path = self.latest()
+        if self.path is None:
+            return False
+        meta_file = self.path / self.META_FILE
+        return max_age is None or time.time() - meta_file.stat().st_mtime <= max_age
+
+    def touch(self) -> None:
+        """
+        Отмечает использование версии, чтобы её не вытеснили раньше давно неиспользованных
+        """
+        try:
+            os.utime(self.path)
+        except (OSError, TypeError):
+            pass
+
+    @staticmethod
+    def evict(root: Union[str, Path], max_size_mb: float, min_age: float = 0,
+              keep: Optional[Path] = None) -> None:
+        """
+        Удаляет устаревшие версии запусков (вытесненные более новой версией, недописанные)
+        и папки давно использованных запусков, пока все вместе они больше максимального размера
+        :param root: папка с папками запусков
+        :param max_size_mb: максимальный размер всех запусков в мегабайтах
+        :param min_age: папки, использованные не раньше чем столько секунд назад, не удаляются
+               (их файлы могут читать ещё открытые результаты или дописывать другие задачи)
+        :param keep: папка версии текущего запуска, не удаляется
+        """
+        runs, now = [], time.time()
+        for run_path in Path(root).glob('*'):
+            latest = DiskStore(run_path).latest()
+            for path in run_path.glob('*'):
+                try:
+                    files = [file.stat() for file in path.rglob('*') if file.is_file()] if path.is_dir() else []
+                    # папку используют, пока в неё пишут
+                    used = max([path.stat().st_mtime] + [stat.st_mtime for stat in files])
+                    size = sum(stat.st_size for stat in files) if path.is_dir() else path.stat().st_size
+                except OSError:
+                    continue
+                runs.append((used, size, path, path == latest))
+
+        def remove(path: Path) -> None:
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink(missing_ok=True)
+            # пустая папка запуска больше не нужна
+            try:
+                path.parent.rmdir()
+            except OSError:
+                pass
+
+        total = sum(size for _, size, _, _ in runs)
+        for used, size, path, is_latest in sorted(runs, key=lambda run: run[:2]):
+            if path == keep or now - used < min_age:
+                continue
+            if is_latest and total <= max_size_mb * 2 ** 20:
+                continue
+            remove(path)
+            total -= size
+
+    def write_corpus(self, pages: Iterable[List[str]],
+                     clean: Callable[[Iterable[List[str]]], Iterator[Tuple[List[List[str]], np.array]]],
+                     n_comments: Callable[[], int]) -> None:
+        """
+        Потоково скачивает, очищает и записывает корпус на диск
+        :param pages: страницы сырых комментариев
+        :param clean: потоковая очистка (TextPreprocessor.iter_clean_text)
+        :param n_comments: количество обработанных сырых комментариев после очистки
+        """
+        # новая версия пишется во временную папку и переименовывается целиком.
+        # старые версии не трогаются: их файлы могут читать открытые результаты, их удаляет evict
+        version = str(time.time_ns())
+        tmp_path = self.root / tmp_name(f'.{version}')
+        tmp_path.mkdir(parents=True)
+        try:
+            writer = TokenCorpusWriter(tmp_path / self.CORPUS_DIR)
+            indexes = []
+            for clean_text, index in clean(CommentsFile.write(tmp_path / self.COMMENTS_FILE, pages)):
+                writer.write(clean_text)
+                indexes.append(index)
+            writer.close()
+            source_index = np.concatenate(indexes) if indexes else np.array([], dtype=np.int32)
+            np.save(tmp_path / self.SOURCE_INDEX_FILE, source_index)
+            # метка о полностью записанном корпусе
+            with open(tmp_path / self.META_FILE, 'w') as f:
+                json.dump({'n_comments': n_comments()}, f)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        os.replace(tmp_path, self.root / version)
+        self.path = self.root / version
+
+    def load_corpus(self) -> Tuple[TokenCorpus, int, np.array, CommentsFile]:
+        """
+        Загружает записанный корпус
+        :return: очищенный корпус, количество сырых комментариев,
+                 индексы исходных комментариев и сырые комментарии
+        """
+        with open(self.path / self.META_FILE) as f:
+            n_comments = json.load(f)['n_comments']
+        return (TokenCorpus.load(self.path / self.CORPUS_DIR),
+                n_comments,
+                np.load(self.path / self.SOURCE_INDEX_FILE),
+                CommentsFile(self.path / self.COMMENTS_FILE))
+
+    def cached_corpus(self, name: str, key: str, build: Callable[[], TokenCorpus]) -> TokenCorpus:
+        """
+        Производный корпус (например, после схлопывания дубликатов), отображённый в память
+        :param name: имя корпуса
+        :param key: ключ входных данных
+        :param build: функция, строящая корпус
+        """
+        path = self.path / f'{name}-{key}'
+        if not path.exists():
+            tmp_path = path.with_name(tmp_name(path.name))
+            build().save(tmp_path)
+            os.replace(tmp_path, path)
+        return TokenCorpus.load(path)
+
+    def cached_array(self, name: str, key: str, shape: Tuple[int, ...],
+                     build: Callable[[np.array], Any], dtype=np.float32) -> Tuple[np.array, Any]:
+        """
+        Массив в файле .npy, отображённый в память. Функция заполняет массив по частям
+        :param name: имя массива
+        :param key: ключ входных данных
+        :param shape: размер массива
+        :param build: функция, заполняющая переданный массив. Её результат сохраняется рядом
+        :param dtype: тип массива
+        :return: массив и результат функции
+        """
+        file = self.path / f'{name}-{key}.npy'
+        extra_file = file.with_suffix('.pkl')
+        if not file.exists():
+            tmp_file = file.with_name(tmp_name(file.stem) + '.npy')
+            out = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=dtype, shape=shape)
+            extra = build(out)
+            out.flush()
+            del out
+            with open(extra_file, 'wb') as f:
+                pickle.dump(extra, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, file)
+        with open(extra_file, 'rb') as f:
+            extra = pickle.load(f)
+        return np.load(file, mmap_mode='r'), extra
+
+    def rename_array(self, name: str, key: str, new_key: str) -> None:
+        """
+        Переносит массив и результат функции под другой ключ
+        :param name: имя массива
+        :param key: текущий ключ
+        :param new_key: новый ключ
+        """
+        file, new_file = self.path / f'{name}-{key}.npy', self.path / f'{name}-{new_key}.npy'
+        os.replace(file.with_suffix('.pkl'), new_file.with_suffix('.pkl'))
+        os.replace(file, new_file)
@@ -1,45 +1,105 @@
-from typing import List, Optional
+import time
+from typing import List, Optional, Tuple, Union
 
 import numpy as np
 from gensim.models import FastText
+from scipy.sparse import csr_matrix
+
+from .corpus import TokenCorpus
 
 
 class Emdedder:
-    def __init__(self):
+    def __init__(self, dtype=np.float32):
+        """
+        :param dtype: тип эмбеддингов
+        """
+        self.dtype = np.dtype(dtype)
         self.model_tokens = None
+        self.model = None
+        self.warm_start = False
+        self.train_time = None
+
+    def corpus2ids(self, corpus: Union[TokenCorpus, List[List[str]]],
+                   model: FastText) -> Tuple[np.array, np.array, np.array]:
+        """
+        Переводит корпус в индексы таблицы векторов уникальных токенов корпуса.
+        Токены словаря модели берутся из model.wv.vectors, для остальных вектор
+        собирается из n-грамм, как при model.wv[word]
+        :param corpus: список токенизированных тестов
+        :param model: FastText обученная модель
+        :return: таблица векторов, плоский массив индексов токенов, количество токенов каждого текста
+        """
+        if not isinstance(corpus, TokenCorpus):
+            corpus = TokenCorpus.from_texts(corpus)
+        flat_ids, lengths = corpus.ids, corpus.lengths()
+
+        words = corpus.vocab.tolist()
+        key_to_index = model.wv.key_to_index
+        valid = np.array([word in key_to_index for word in words], dtype=bool)
+        table = np.zeros(shape=(len(words), model.vector_size), dtype=self.dtype)
+        table[valid] = model.wv.vectors[[key_to_index[word] for word in words if word in key_to_index]]
+        # токены вне словаря
+        for j in np.flatnonzero(~valid):
+            try:
+                table[j] = model.wv[words[j]]
+                valid[j] = True
+            except KeyError:
+                continue
+
+        # отбрасываем токены без вектора
+        keep = valid[flat_ids]
+        text_ids = np.repeat(np.arange(len(corpus)), lengths)
+        counts = np.bincount(text_ids[keep], minlength=len(corpus))
+        return table, flat_ids[keep], counts
 
-    def text2embedding(self, corpus: List[List[str]], model: FastText) -> np.array:
+    def text2embedding(self, corpus: Union[TokenCorpus, List[List[str]]], model: FastText,
+                       out: Optional[np.array] = None, batch_size: Optional[int] = None) -> np.array:
         """
         Трансформация сырого токенизированного текста в эмбединг
         :param corpus: список токенизированных тестов
         :param model: FastText обученная модель
+        :param out: массив для результата (например, отображённый в память файл)
+        :param batch_size: количество текстов, эмбеддинги которых считаются за раз.
+               None - все тексты сразу
         :return: матрица эмбедингов текстов
         """
         n_col, n_row = model.vector_size, len(corpus)
-        embeddings = np.zeros(shape=(n_row, n_col))
-        for i, sent in enumerate(corpus):
-            vectors = []
-            for word in sent:
-                try:
-                    vectors.append(model.wv[word])
-                except KeyError:
-                    continue
-            if vectors:
-                embeddings[i] = np.mean(np.array(vectors), axis=0)
-        return embeddings
+        table, flat_ids, counts = self.corpus2ids(corpus, model)
+        # среднее по сегментам: токены каждого текста идут подряд, поэтому
+        # корпус - это CSR-матрица (текст x токен), а сумма векторов - её произведение на таблицу
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+        texts = csr_matrix((np.ones(len(flat_ids), dtype=self.dtype), flat_ids, indptr),
+                           shape=(n_row, len(table)))
+        if out is None:
+            out = np.empty((n_row, n_col), dtype=self.dtype)
+        batch_size = batch_size or max(n_row, 1)
+        for start in range(0, n_row, batch_size):
+            end = min(start + batch_size, n_row)
+            embeddings = np.asarray(texts[start:end] @ table, dtype=self.dtype)
+            batch_counts = counts[start:end]
+            nonempty = batch_counts > 0
+            embeddings[nonempty] /= batch_counts[nonempty, None]
+            # тексты без известных токенов остаются нулевыми
+            out[start:end] = embeddings
+        return out
 
     def get_embeddings_ft(self,
-                          corpus: List[List[str]],
+                          corpus: Union[TokenCorpus, List[List[str]]],
                           model: Optional[FastText] = None,
                           ft_params: Optional[dict] = None,
-                          epochs: int = 40) -> np.array:
+                          epochs: int = 40,
+                          out: Optional[np.array] = None,
+                          batch_size: Optional[int] = None) -> np.array:
         """
         Обучение модели FastText и преобразование корпуса
-        в векторное представление на обученных эмбедингах слов
+        в векторное представление на обученных эмбедингах слов.
+        Корпус обходится потоково, поэтому может лежать на диске (TokenCorpus.load)
         :param corpus: список токенизированных тестов
         :param model: предобученная модель FastText
         :param ft_params: парметры для создания модели FastText
         :param epochs: количество эпох обучения
+        :param out: массив для результата (например, отображённый в память файл)
+        :param batch_size: количество текстов, эмбеддинги которых считаются за раз
         :return: матрица эмбедингов текстов
         """
 
@@ -51,9 +111,13 @@ class Emdedder:
             model = FastText(**ft_params)
 
         # тренеруем модель
+        start = time.perf_counter()
         model.build_vocab(corpus, update=update)
         model.train(corpus, total_examples=model.corpus_count, epochs=epochs)
+        self.train_time = time.perf_counter() - start
+        self.warm_start = update
 
-        # сохраняем список уникальных токенов модели
+        # сохраняем модель и список уникальных токенов модели
+        self.model = model
         self.model_tokens = model.wv.index_to_key
-        return self.text2embedding(corpus, model)
+        return self.text2embedding(corpus, model, out=out, batch_size=batch_size)
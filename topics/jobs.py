@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+class Job:
+    def __init__(self, key: str, title: str) -> None:
+        """
+        Фоновая задача: состояние, этап и результат
+        :param key: ключ параметров задачи (одинаковые задачи объединяются)
+        :param title: описание задачи для списка запусков
+        """
+        self.id = uuid.uuid4().hex[:12]
+        self.key = key
+        self.title = title
+        self.status = 'queued'
+        # текущий этап и пояснение к нему (например, сколько комментариев скачано)
+        self.stage: Optional[str] = None
+        self.info: Optional[str] = None
+        self.result: Any = None
+        self.error: Optional[Exception] = None
+        self.submitted = time.time()
+        self.finished: Optional[float] = None
+        # последнее обращение к задаче: вытесняются давно не открывавшиеся результаты
+        self.accessed = self.submitted
+
+    @property
+    def done(self) -> bool:
+        return self.status in ('done', 'error')
+
+    def update(self, stage: str, info: Optional[str] = None) -> None:
+        """
+        Отмечает прогресс задачи. Вызывается из потока задачи
+        :param stage: этап
+        :param info: пояснение
+        """
+        self.stage, self.info = stage, info
+
+
+class JobRunner:
+    def __init__(self, max_workers: int = 2, keep_seconds: float = 3600, max_jobs: int = 20) -> None:
+        """
+        Локальный пул фоновых задач. Скрипт страницы только ставит задачу и опрашивает её,
+        поэтому сеанс не блокируется, а результат переживает обновление страницы
+        и доступен из другого сеанса по номеру задачи
+        :param max_workers: количество одновременно выполняемых задач
+        :param keep_seconds: сколько хранить завершённые задачи
+        :param max_jobs: сколько хранить завершённых задач. Каждая держит в памяти
+               модели и проекции запуска, лишние вытесняются по давности обращения
+        """
+        self.keep_seconds = keep_seconds
+        self.max_jobs = max_jobs
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self.jobs: Dict[str, Job] = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key: str, func: Callable[[Callable[..., None]], Any], title: str = '') -> str:
+        """
+        Ставит задачу в очередь. Если такая же задача уже выполняется или успешно завершена,
+        возвращается её номер
+        :param key: ключ параметров задачи
+        :param func: функция задачи, принимает функцию отметки прогресса Job.update
+        :param title: описание задачи
+        :return: номер задачи
+        """
+        with self.lock:
+            self.forget_expired()
+            for job in self.jobs.values():
+                if job.key == key and job.status != 'error':
+                    logging.info(f"Задача {job.id} уже поставлена, подключаемся к ней")
+                    job.accessed = time.time()
+                    return job.id
+            job = Job(key, title)
+            self.jobs[job.id] = job
+        self.executor.submit(self.run, job, func)
+        logging.info(f"Задача {job.id} поставлена в очередь: {title}")
+        return job.id
+
+    def run(self, job: Job, func: Callable[[Callable[..., None]], Any]) -> None:
+        """
+        Выполняет задачу в потоке пула
+        """
+        job.status = 'running'
+        start = time.perf_counter()
+        try:
+            job.result = func(job.update)
+            job.status = 'done'
+            logging.info(f"Задача {job.id} завершена: {time.perf_counter() - start:.2f} c")
+        except Exception as e:
+            job.error = e
+            job.status = 'error'
+            logging.exception(f"Задача {job.id} завершилась с ошибкой")
+        job.finished = time.time()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """
+        Задача по номеру
+        :param job_id: номер задачи
+        :return: задача или None, если её нет или она устарела
+        """
+        with self.lock:
+            self.forget_expired()
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job.accessed = time.time()
+            return job
+
+    def recent(self, job_ids: Iterable[str]) -> List[Job]:
+        """
+        Задачи из списка номеров от новых к старым. Номера задач знает только
+        поставивший их сеанс, поэтому чужие запуски в список не попадают
+        :param job_ids: номера задач
+        """
+        with self.lock:
+            self.forget_expired()
+            jobs = [self.jobs[job_id] for job_id in set(job_ids) if job_id in self.jobs]
+            return sorted(jobs, key=lambda job: job.submitted, reverse=True)
+
+    def forget_expired(self) -> None:
+        """
+        Удаляет завершённые задачи старше keep_seconds и давно не открывавшиеся
+        сверх max_jobs (вызывается под блокировкой). Выполняемые задачи не удаляются
+        """
+        now = time.time()
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job.finished is not None and now - job.finished > self.keep_seconds]:
+            del self.jobs[job_id]
+        finished = sorted((job for job in self.jobs.values() if job.finished is not None),
+                          key=lambda job: job.accessed)
+        for job in finished[:max(len(finished) - self.max_jobs, 0)]:
+            logging.info(f"Задача {job.id} вытеснена из списка готовых")
+            del self.jobs[job.id]
+
+
+_runner: Optional[JobRunner] = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner(max_workers: int = 2, keep_seconds: float = 3600, max_jobs: int = 20) -> JobRunner:
+    """
+    Общий на процесс пул задач: сеансы Streamlit приходят и уходят, а задачи остаются
+    :param max_workers: количество одновременно выполняемых задач
+    :param keep_seconds: сколько хранить завершённые задачи
+    :param max_jobs: сколько хранить завершённых задач
+    """
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner(max_workers=max_workers, keep_seconds=keep_seconds, max_jobs=max_jobs)
+        return _runner
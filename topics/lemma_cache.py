@@ -0,0 +1,107 @@
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+
+class LemmaCache:
+    def __init__(self, path: Optional[Union[str, Path]] = None, max_size: int = 200_000) -> None:
+        """
+        Кеш лемм по словоформе. Хранится в памяти с вытеснением давно использованных (LRU)
+        и сохраняется в файл между перезапусками.
+        Лемма словоформы одна на все тексты: mystem снимает омонимию по контексту,
+        а в кеш попадает разбор слова без контекста, поэтому у омонимов результат
+        может отличаться от лемматизации целых текстов
+        :param path: файл кеша. None - кеш только в памяти
+        :param max_size: максимальное количество словоформ
+        """
+        self.path = Path(path) if path is not None else None
+        self.max_size = max_size
+        self.lemmas = OrderedDict()
+        self.lock = threading.Lock()
+        # статистика обращений за всё время работы процесса
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self.lemmas)
+
+    def lookup(self, tokens: Iterable[str]) -> Tuple[Dict[str, str], List[str]]:
+        """
+        Ищет леммы словоформ в кеше
+        :param tokens: уникальные словоформы
+        :return: найденные леммы и словоформы, которых нет в кеше
+        """
+        found, missing = {}, []
+        with self.lock:
+            for token in tokens:
+                lemma = self.lemmas.get(token)
+                if lemma is None:
+                    missing.append(token)
+                else:
+                    self.lemmas.move_to_end(token)
+                    found[token] = lemma
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def update(self, lemmas: Dict[str, str]) -> None:
+        """
+        Добавляет леммы и вытесняет давно использованные словоформы
+        :param lemmas: словарь словоформа - лемма
+        """
+        with self.lock:
+            self.lemmas.update(lemmas)
+            for token in lemmas:
+                self.lemmas.move_to_end(token)
+            while len(self.lemmas) > self.max_size:
+                self.lemmas.popitem(last=False)
+
+    def load(self) -> None:
+        """
+        Загружает кеш из файла, если он есть
+        """
+        if self.path is None:
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                items = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return
+        self.update(dict(items[-self.max_size:]))
+        logging.info(f'Кеш лемм загружен: {len(self.lemmas)} словоформ')
+
+    def save(self) -> None:
+        """
+        Сохраняет кеш в файл (от давно использованных к недавним)
+        """
+        if self.path is None:
+            return
+        with self.lock:
+            items = list(self.lemmas.items())
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.path.with_name(f'{self.path.name}.{os.getpid()}-{threading.get_ident()}.tmp')
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(items, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, self.path)
+
+
+_caches: Dict[Path, LemmaCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_lemma_cache(path: Union[str, Path], max_size: int = 200_000) -> LemmaCache:
+    """
+    Общий на процесс кеш лемм для файла
+    :param path: файл кеша
+    :param max_size: максимальное количество словоформ
+    """
+    path = Path(path)
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = LemmaCache(path, max_size)
+        return _caches[path]
@@ -0,0 +1,102 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple
+
+from pymystem3 import Mystem
+
+
+class MystemPool:
+    # разделитель текстов в одном запросе к mystem, '#' удаляется при очистке текста
+    SEPARATOR = ' # '
+
+    def __init__(self, n_workers: int = 4, chunk_size: int = 200) -> None:
+        """
+        Пул лемматизаторов Mystem. У каждого потока свой процесс mystem,
+        процессы живут между запросами. Потоки только ждут ответа от процессов,
+        поэтому лемматизация идёт на нескольких ядрах
+        :param n_workers: количество потоков (процессов mystem)
+        :param chunk_size: количество текстов (слов) в одном запросе к mystem
+        """
+        self.n_workers = n_workers
+        self.chunk_size = chunk_size
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix='mystem')
+
+    def get_mystem(self) -> Mystem:
+        """
+        Mystem текущего потока, создаётся при первом обращении
+        """
+        if not hasattr(self.local, 'mystem'):
+            self.local.mystem = Mystem()
+        return self.local.mystem
+
+    def lemmatize_chunk(self, texts: List[str]) -> List[str]:
+        """
+        Лемматизирует порцию текстов в потоке пула одним запросом к mystem:
+        тексты соединяются разделителем и разбиваются по нему обратно.
+        Если разделитель не сохранился (количество текстов не совпало),
+        тексты порции лемматизируются по одному
+        :param texts: список текстов без переносов строк и символа разделителя
+        :return: список лемматизированных текстов в том же порядке
+        """
+        mystem = self.get_mystem()
+        # mystem дописывает перенос строки в конец результата
+        lemmas = ''.join(mystem.lemmatize(self.SEPARATOR.join(texts))).rstrip('\n').split(self.SEPARATOR)
+        if len(lemmas) != len(texts):
+            lemmas = [''.join(mystem.lemmatize(text)).rstrip('\n') for text in texts]
+        return lemmas
+
+    def lemmatize(self, texts: List[str]) -> List[str]:
+        """
+        Лемматизирует тексты порциями на всех процессах пула.
+        Порции собираются по индексу, разделитель действует только внутри порции
+        :param texts: список текстов без переносов строк
+        :return: список лемматизированных текстов в том же порядке
+        """
+        chunks = [texts[i:i + self.chunk_size] for i in range(0, len(texts), self.chunk_size)]
+        lemmas = []
+        for chunk_lemmas in self.executor.map(self.lemmatize_chunk, chunks):
+            lemmas.extend(chunk_lemmas)
+        return lemmas
+
+    def lemmatize_words_chunk(self, words: List[str]) -> List[str]:
+        """
+        Лемматизирует порцию отдельных слов одним запросом к mystem.
+        Если количество лемм не совпало со словами, слова лемматизируются по одному
+        :param words: список слов без пробелов
+        :return: список лемм в том же порядке
+        """
+        mystem = self.get_mystem()
+        lemmas = ''.join(mystem.lemmatize(' '.join(words))).split()
+        if len(lemmas) != len(words):
+            lemmas = [''.join(mystem.lemmatize(word)).strip() for word in words]
+        return lemmas
+
+    def lemmatize_words(self, words: List[str]) -> List[str]:
+        """
+        Лемматизирует отдельные слова порциями на всех процессах пула
+        :param words: список слов без пробелов
+        :return: список лемм в том же порядке
+        """
+        chunks = [words[i:i + self.chunk_size] for i in range(0, len(words), self.chunk_size)]
+        lemmas = []
+        for chunk_lemmas in self.executor.map(self.lemmatize_words_chunk, chunks):
+            lemmas.extend(chunk_lemmas)
+        return lemmas
+
+
+_pools: Dict[Tuple[int, int], MystemPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_mystem_pool(n_workers: int = 4, chunk_size: int = 200) -> MystemPool:
+    """
+    Общий на процесс пул Mystem, чтобы не запускать mystem заново
+    для каждого предобработчика
+    :param n_workers: количество потоков (процессов mystem)
+    :param chunk_size: количество текстов в одном запросе к mystem
+    """
+    with _pools_lock:
+        if (n_workers, chunk_size) not in _pools:
+            _pools[n_workers, chunk_size] = MystemPool(n_workers, chunk_size)
+        return _pools[n_workers, chunk_size]
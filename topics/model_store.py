@@ -0,0 +1,98 @@
+import json
+import re
+import shutil
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+from gensim.models import FastText
+
+from .stage_cache import StageCache
+
+
+class ModelStore:
+    MODEL_FILE = 'fasttext.model'
+    LOG_FILE = 'training.jsonl'
+
+    def __init__(self, path: Union[str, Path], mmap: Optional[str] = 'c') -> None:
+        """
+        Хранилище обученных моделей FastText на диске
+        :param path: папка хранилища
+        :param mmap: режим отображения массивов модели в память при загрузке.
+               'r' - только чтение, 'c' - копирование при записи (модель можно дообучать,
+               изменения не попадают в файл)
+        """
+        self.path = Path(path)
+        self.mmap = mmap
+
+    def model_dir(self, key: str, params: Optional[dict] = None) -> Path:
+        """
+        Папка модели по ключу (id канала или имя корпуса) и параметрам создания модели.
+        Модель с другими параметрами (например, vector_size) хранится отдельно
+        :param key: ключ модели
+        :param params: параметры создания модели FastText
+        """
+        name = re.sub(r'[^\w\-]', '_', key)
+        if params is not None:
+            name = f'{name}-{StageCache.make_key(params)[:12]}'
+        return self.path / name
+
+    def load(self, key: str, params: Optional[dict] = None) -> Optional[FastText]:
+        """
+        Загружает сохраненную модель
+        :param key: ключ модели
+        :param params: параметры создания модели FastText
+        :return: модель или None, если модели нет
+        """
+        model_file = self.model_dir(key, params) / self.MODEL_FILE
+        if not model_file.exists():
+            return None
+        return FastText.load(str(model_file), mmap=self.mmap)
+
+    def version(self, key: str, params: Optional[dict] = None) -> Optional[int]:
+        """
+        Версия сохраненной модели (время записи файла модели). Меняется при каждом дообучении
+        :param key: ключ модели
+        :param params: параметры создания модели FastText
+        :return: версия или None, если модели нет
+        """
+        model_file = self.model_dir(key, params) / self.MODEL_FILE
+        if not model_file.exists():
+            return None
+        return model_file.stat().st_mtime_ns
+
+    def save(self, key: str, model: FastText, params: Optional[dict] = None) -> None:
+        """
+        Сохраняет модель. Сначала во временную папку, затем подменяет старую,
+        чтобы параллельный запуск не прочитал модель наполовину
+        :param key: ключ модели
+        :param model: обученная модель
+        :param params: параметры создания модели FastText
+        """
+        model_dir = self.model_dir(key, params)
+        tmp_dir = model_dir.with_name(f'{model_dir.name}.tmp-{time.time_ns()}')
+        tmp_dir.mkdir(parents=True)
+        model.save(str(tmp_dir / self.MODEL_FILE))
+
+        old_dir = None
+        if model_dir.exists():
+            old_dir = model_dir.with_name(f'{model_dir.name}.old-{time.time_ns()}')
+            model_dir.rename(old_dir)
+        tmp_dir.rename(model_dir)
+        if old_dir is not None:
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+    def log_training(self, key: str, seconds: float, warm_start: bool, n_texts: int, epochs: int) -> None:
+        """
+        Записывает время обучения для сравнения холодных и тёплых запусков
+        :param key: ключ модели
+        :param seconds: время обучения
+        :param warm_start: флаг - модель дообучалась
+        :param n_texts: количество текстов
+        :param epochs: количество эпох
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        record = {'key': key, 'time': time.time(), 'seconds': round(seconds, 3),
+                  'warm_start': warm_start, 'n_texts': n_texts, 'epochs': epochs}
+        with open(self.path / self.LOG_FILE, 'a') as f:
+            f.write(json.dumps(record) + '\n')
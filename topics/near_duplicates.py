@@ -0,0 +1,115 @@
+import logging
+import zlib
+from collections import defaultdict
+from typing import List, Tuple, Union
+
+import numpy as np
+
+from .corpus import TokenCorpus
+
+# простое число больше 2^32 для универсального хеширования (a * x + b) mod p
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+class NearDuplicates:
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, block_size: int = 2000,
+                 seed: int = 7) -> None:
+        """
+        Поиск почти одинаковых комментариев (боты, копипаста) через MinHash и LSH.
+        Комментарий рассматривается как множество токенов
+        :param threshold: порог сходства Жаккара, начиная с которого комментарии схлопываются
+        :param num_perm: количество хеш-функций MinHash
+        :param block_size: количество комментариев, для которых подписи считаются за раз
+        :param seed: зерно хеш-функций
+        """
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.block_size = block_size
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, MAX_HASH, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, MAX_HASH, size=num_perm, dtype=np.uint64)
+        self.bands, self.rows = self.optimal_bands()
+
+    def optimal_bands(self) -> Tuple[int, int]:
+        """
+        Разбиение подписи на полосы LSH, при котором вероятность стать кандидатами
+        (1 / bands) ^ (1 / rows) ближе всего к порогу
+        :return: количество полос и строк в полосе
+        """
+        options = [(bands, self.num_perm // bands) for bands in range(1, self.num_perm + 1)
+                   if self.num_perm % bands == 0]
+        return min(options, key=lambda option: abs((1 / option[0]) ** (1 / option[1]) - self.threshold))
+
+    def signatures(self, corpus: TokenCorpus) -> np.array:
+        """
+        MinHash подписи текстов. Каждый токен словаря хешируется один раз,
+        повторы токена в тексте на минимум не влияют
+        :param corpus: токенизированные тексты (непустые)
+        :return: матрица подписей (тексты x num_perm)
+        """
+        signatures = np.empty((len(corpus), self.num_perm), dtype=np.uint64)
+        # crc32 разносит токены по всем 32 битам, иначе a * x + b от маленьких индексов
+        # не доходит до модуля и минимум всегда даёт токен с наименьшим индексом
+        token_hashes = np.fromiter((zlib.crc32(word.encode('utf-8')) for word in corpus.vocab.tolist()),
+                                   dtype=np.uint64, count=len(corpus.vocab))
+        offsets = corpus.offsets
+        for start in range(0, len(corpus), self.block_size):
+            end = min(start + self.block_size, len(corpus))
+            hashes = token_hashes[corpus.ids[offsets[start]:offsets[end]]]
+            # (a * x + b) mod p для всех токенов блока, x < 2^32 и a < 2^32 - без переполнения
+            permuted = (np.outer(hashes, self.a) + self.b) % MERSENNE_PRIME
+            signatures[start:end] = np.minimum.reduceat(permuted, offsets[start:end] - offsets[start], axis=0)
+        return signatures
+
+    def collapse(self, corpus: Union[TokenCorpus, List[List[str]]]) -> Tuple[np.array, np.array]:
+        """
+        Схлопывает почти одинаковые тексты в один представитель (первое вхождение).
+        Кандидаты из общей корзины LSH сравниваются с первым текстом корзины
+        по точному сходству Жаккара, поэтому огромные группы спама не дают квадратичного перебора
+        :param corpus: токенизированные тексты (непустые)
+        :return: индексы представителей в исходном порядке и веса - количество схлопнутых в них текстов
+        """
+        if not isinstance(corpus, TokenCorpus):
+            corpus = TokenCorpus.from_texts(corpus)
+        n = len(corpus)
+        parent = list(range(n))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        token_sets = {}
+
+        def token_set(i: int) -> set:
+            # множества токенов строятся только для кандидатов
+            if i not in token_sets:
+                token_sets[i] = set(corpus.ids[corpus.offsets[i]:corpus.offsets[i + 1]].tolist())
+            return token_sets[i]
+
+        signatures = self.signatures(corpus)
+        for band in range(self.bands):
+            buckets = defaultdict(list)
+            # полоса подписи одной строкой байт - ключ корзины
+            band_rows = np.ascontiguousarray(signatures[:, band * self.rows:(band + 1) * self.rows])
+            band_keys = band_rows.view(f'V{band_rows.itemsize * self.rows}').ravel()
+            for i, key in enumerate(band_keys.tolist()):
+                buckets[key].append(i)
+            for members in buckets.values():
+                first = members[0]
+                for i in members[1:]:
+                    root_first, root_i = find(first), find(i)
+                    if root_first == root_i:
+                        continue
+                    jaccard = len(token_set(first) & token_set(i)) / len(token_set(first) | token_set(i))
+                    if jaccard >= self.threshold:
+                        # представитель группы - самый ранний текст
+                        parent[max(root_first, root_i)] = min(root_first, root_i)
+
+        roots = np.array([find(i) for i in range(n)])
+        representatives, weights = np.unique(roots, return_counts=True)
+        logging.info(f'Почти одинаковых комментариев схлопнуто: {n - len(representatives)} '
+                     f'(порог Жаккара {self.threshold})')
+        return representatives, weights
@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from pynndescent import NNDescent
+from scipy.sparse import csr_matrix
+from sklearn.neighbors import NearestNeighbors
+
+
+class NeighborGraph:
+    def __init__(self, X, n_neighbors: int = 30, metric: str = 'euclidean',
+                 random_state: Optional[int] = None, n_jobs: int = -1) -> None:
+        """
+        Приближённый граф k ближайших соседей (NN-descent), общий для всех алгоритмов запуска.
+        Строится один раз при первом обращении, соседи точки включают её саму
+        :param X: точки
+        :param n_neighbors: количество соседей, не меньше нужного любому из алгоритмов
+        :param metric: метрика
+        :param random_state: зерно NN-descent
+        :param n_jobs: количество потоков построения
+        """
+        self.X = X
+        self.n_neighbors = n_neighbors
+        self.metric = metric
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+        self.index: Optional[NNDescent] = None
+        self.indices = None
+        self.distances = None
+        self.radius_index: Optional[NearestNeighbors] = None
+        self.radius_graphs: Dict[float, csr_matrix] = {}
+        # алгоритмы кластеризации обращаются к графу из разных потоков
+        self.lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state.pop('lock')
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def build(self) -> 'NeighborGraph':
+        """
+        Строит граф, если он ещё не построен
+        """
+        with self.lock:
+            if self.indices is None:
+                start = time.perf_counter()
+                self.index = NNDescent(self.X, n_neighbors=self.n_neighbors, metric=self.metric,
+                                       random_state=self.random_state, n_jobs=self.n_jobs)
+                self.indices, self.distances = self.index.neighbor_graph
+                logging.info(f"Граф {self.n_neighbors} ближайших соседей ({len(self.X)} точек): "
+                             f"{time.perf_counter() - start:.2f} c")
+        return self
+
+    def knn(self, n_neighbors: Optional[int] = None) -> Tuple[np.array, np.array]:
+        """
+        Индексы и расстояния первых n соседей каждой точки
+        :param n_neighbors: количество соседей. None - все соседи графа
+        """
+        n_neighbors = n_neighbors or self.n_neighbors
+        if n_neighbors > self.n_neighbors:
+            raise ValueError(f'Граф построен для {self.n_neighbors} соседей, запрошено {n_neighbors}')
+        self.build()
+        return self.indices[:, :n_neighbors], self.distances[:, :n_neighbors]
+
+    def knn_graph(self, n_neighbors: Optional[int] = None) -> csr_matrix:
+        """
+        Разреженная матрица расстояний до n соседей
+        (для affinity='precomputed_nearest_neighbors' и metric='precomputed')
+        :param n_neighbors: количество соседей
+        """
+        indices, distances = self.knn(n_neighbors)
+        n, k = indices.shape
+        return csr_matrix((distances.ravel(), indices.ravel(), np.arange(0, n * k + 1, k)), shape=(n, n))
+
+    def radius_graph(self, radius: float) -> csr_matrix:
+        """
+        Разреженная матрица расстояний до всех точек в радиусе (для DBSCAN с metric='precomputed').
+        Запрос точный, индекс для запросов строится один раз на все радиусы
+        :param radius: радиус окрестности
+        """
+        with self.lock:
+            if radius not in self.radius_graphs:
+                if self.radius_index is None:
+                    self.radius_index = NearestNeighbors(metric=self.metric, n_jobs=self.n_jobs).fit(self.X)
+                self.radius_graphs[radius] = self.radius_index.radius_neighbors_graph(radius=radius,
+                                                                                      mode='distance')
+            return self.radius_graphs[radius]
+
+    def umap_knn(self, n_neighbors: int) -> Tuple[np.array, np.array, NNDescent]:
+        """
+        Граф в формате параметра precomputed_knn модели UMAP
+        :param n_neighbors: количество соседей UMAP
+        """
+        indices, distances = self.knn(n_neighbors)
+        return indices, distances, self.index
@@ -1,26 +1,131 @@
 
+import hashlib
+import logging
+import queue
 import re
 import string
-from typing import List
+import threading
+import time
+from itertools import chain
+from typing import List, Iterable, Iterator, Optional, Set, Tuple
+
+import numpy as np
 
 from nltk.corpus import stopwords
-from pymystem3 import Mystem
 from stop_words import get_stop_words
 import nltk
+
+from .lemmatizer import get_mystem_pool
+from .lemma_cache import LemmaCache
+from .corpus import TokenCorpus
+
 nltk.download('stopwords')
 
+# символы смайлов по коду юникода
+EMOJI_CHARS = (u"\U0001F600-\U0001F64F"  # emoticons
+               u"\U0001F300-\U0001F5FF"  # symbols & pictographs
+               u"\U0001F680-\U0001F6FF"  # transport & map symbols
+               u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
+               u"\U00002500-\U00002BEF"  # chinese char
+               u"\U00002702-\U000027B0"
+               u"\U00002702-\U000027B0"
+               u"\U000024C2-\U0001F251"
+               u"\U0001f926-\U0001f937"
+               u"\U00010000-\U0010ffff"
+               u"\u2640-\u2642"
+               u"\u2600-\u2B55"
+               u"\u200d"
+               u"\u23cf"
+               u"\u23e9"
+               u"\u231a"
+               u"\ufe0f"  # dingbats
+               u"\u3030")
+
+
+def background_iter(iterable: Iterable, buffer_size: int, poll_interval: float = 0.1) -> Iterator:
+    """
+    Итерирует по последовательности в фоновом потоке,
+    чтобы её получение (например, загрузка из сети) шло параллельно с обработкой.
+    Если потребитель остановился или упал, фоновый поток завершается, а не ждёт места в буфере
+    :param iterable: исходная последовательность
+    :param buffer_size: максимум элементов, полученных заранее
+    :param poll_interval: как часто фоновый поток при полном буфере проверяет остановку, секунд
+    :return: элементы последовательности в исходном порядке
+    """
+    buffer = queue.Queue(maxsize=buffer_size)
+    stop = threading.Event()
+    end = object()
+    errors = []
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=poll_interval)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in iterable:
+                if not put(item):
+                    break
+        except Exception as e:
+            errors.append(e)
+        finally:
+            put(end)
+            if stop.is_set() and hasattr(iterable, 'close'):
+                # освобождаем ресурсы источника (например, пул загрузки комментариев)
+                iterable.close()
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        yield from iter(buffer.get, end)
+    finally:
+        stop.set()
+    if errors:
+        raise errors[0]
+
+
+def join_chunks(chunks: Iterable[Tuple[List[List[str]], np.array]]) -> Tuple[TokenCorpus, np.array]:
+    """
+    Собирает порции iter_clean_text в один компактный корпус.
+    Порции переводятся в индексы токенов по мере поступления, списки строк не накапливаются
+    :param chunks: порции очищенных текстов с индексами исходных текстов
+    :return: очищенный корпус и индексы исходных текстов
+    """
+    vocab = {}
+    corpora, indexes = [], []
+    for clean_text, index in chunks:
+        corpora.append(TokenCorpus.from_texts(clean_text, vocab))
+        indexes.append(index)
+    return TokenCorpus.concat(corpora), np.concatenate(indexes) if indexes else np.array([], dtype=np.int32)
+
 
 class TextPreprocessor:
-    def __init__(self, stopwords: bool = True, min_symbols: int = 2, min_words: int = 3) -> None:
+    def __init__(self, stopwords: bool = True, min_symbols: int = 2, min_words: int = 3,
+                 chunk_size: int = 1000, n_workers: int = 4, mystem_chunk_size: int = 200,
+                 lemma_cache: Optional[LemmaCache] = None) -> None:
         """
         :param stopwords: флаг - учитывать или нет стоп-слова
         :param min_symbols: минимум символов для валидного токена
         :param min_words:  минимум токенов для валидного текста
+        :param chunk_size: размер порции комментариев при потоковой обработке
+        :param n_workers: количество процессов mystem для лемматизации
+        :param mystem_chunk_size: количество текстов в одном запросе к mystem
+        :param lemma_cache: кеш лемм по словоформе (без снятия омонимии по контексту).
+               None - лемматизировать тексты целиком
         """
         self.min_symbols = min_symbols
         self.min_words = min_words
+        self.chunk_size = chunk_size
+        self.compile_patterns()
+        # количество обработанных сырых комментариев
+        self.n_comments = 0
         # self.morph = pymorphy2.MorphAnalyzer()
-        self.mystem = Mystem()
+        self.mystem_pool = get_mystem_pool(n_workers, mystem_chunk_size)
+        self.lemma_cache = lemma_cache
 
         if stopwords:
             self.set_stopwords()
@@ -42,74 +147,77 @@ class TextPreprocessor:
         """
         return text.lower()
 
+    def compile_patterns(self) -> None:
+        """
+        Компилирует регулярные выражения один раз на весь предобработчик
+        """
+        self.emoji_pattern = re.compile(f'[{EMOJI_CHARS}]+', re.UNICODE)
+        self.html_pattern = re.compile('<.*?>')
+        self.url_pattern = re.compile(r'https?://\S+|www\.\S+|bit.ly/\S+')
+        self.spec_symbols_pattern = re.compile(r'&\S+?;')
+        self.files_pattern = re.compile(r'\S+\.(?:csv|xlsx|py|ipynb|pdf|zip|rar|docx)')
+        self.punctuation_pattern = re.compile(fr'[{string.punctuation}]')
+        self.digits_pattern = re.compile(r'\d+')
+        self.ru_en_pattern = re.compile(r'[^a-zа-яё ]')
+        self.russian_pattern = re.compile(r'[а-яё]')
+        self.whitespace_pattern = re.compile(r'\s+')
+
+        # Шаблоны для слитной очистки в preprocessing.
+        # Эмодзи не удаляются отдельным проходом: в ссылках, спецсимволах и файлах
+        # они не считаются частью слова (как пробел, которым их заменял remove_emojis),
+        # а в конце удаляются вместе с остальными небуквенными символами.
+        # Точка в 'bit.ly' соответствовала одному символу или серии эмодзи, заменённой пробелом
+        word = f'[^\\s{EMOJI_CHARS}]'
+        any_char = f'(?:[{EMOJI_CHARS}]+|.)'
+        self.fused_url_pattern = re.compile(fr'https?://{word}+|www\.{word}+|bit{any_char}ly/{word}+')
+        self.fused_spec_symbols_pattern = re.compile(fr'&{word}+?;')
+        self.fused_files_pattern = re.compile(fr'{word}+\.(?:csv|xlsx|py|ipynb|pdf|zip|rar|docx)')
+        # пунктуация, цифры, небуквенные символы и лишние пробелы одним проходом
+        self.non_letters_pattern = re.compile(r'[^a-zа-яё]+')
+        # без расширения файла дорогой шаблон файлов заведомо ничего не найдёт
+        self.file_extension_pattern = re.compile(r'\.(?:csv|xlsx|py|ipynb|pdf|zip|rar|docx)')
+
     def remove_emojis(self, text: str) -> str:
         """
         Удаляет смайлы по коду юникода
         """
-        emoj = re.compile("["
-                          u"\U0001F600-\U0001F64F"  # emoticons
-                          u"\U0001F300-\U0001F5FF"  # symbols & pictographs
-                          u"\U0001F680-\U0001F6FF"  # transport & map symbols
-                          u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
-                          u"\U00002500-\U00002BEF"  # chinese char
-                          u"\U00002702-\U000027B0"
-                          u"\U00002702-\U000027B0"
-                          u"\U000024C2-\U0001F251"
-                          u"\U0001f926-\U0001f937"
-                          u"\U00010000-\U0010ffff"
-                          u"\u2640-\u2642"
-                          u"\u2600-\u2B55"
-                          u"\u200d"
-                          u"\u23cf"
-                          u"\u23e9"
-                          u"\u231a"
-                          u"\ufe0f"  # dingbats
-                          u"\u3030"
-                          "]+", re.UNICODE)
-        return re.sub(emoj, ' ', text)
+        return self.emoji_pattern.sub(' ', text)
 
     def remove_html(self, text: str) -> str:
         """
         Удаление html кода
         """
-        pattern = re.compile('<.*?>')
-        return pattern.sub(' ', text)
+        return self.html_pattern.sub(' ', text)
 
     def remove_urls(self, text: str) -> str:
         """
         Удаление некоторых ссылок
         """
-        re_urls = ['https?://\S+', 'www\.\S+', 'bit.ly/\S+']
-        url_pattern = re.compile(r'|'.join(re_urls))
-        return url_pattern.sub(' ', text)
+        return self.url_pattern.sub(' ', text)
 
     def remove_spec_symbols(self, text: str) -> str:
         """
         Удаление спецсимволов
         """
-        pattern = re.compile(r'&\S+?;')
-        return pattern.sub(' ', text)
+        return self.spec_symbols_pattern.sub(' ', text)
 
     def remove_files(self, text: str) -> str:
         """
         Удаление некоторых файлов
         """
-        pattern = re.compile(r'\S+\.(?:csv|xlsx|py|ipynb|pdf|zip|rar|docx)')
-        return pattern.sub(' ', text)
+        return self.files_pattern.sub(' ', text)
 
     def remove_punctuation(self, text: str) -> str:
         """
         Удаление знаков пунктуации
         """
-        pattern = re.compile(fr'[{string.punctuation}]')
-        return pattern.sub(' ', text)
+        return self.punctuation_pattern.sub(' ', text)
 
     def remove_digits(self, text: str) -> str:
         """
         Удаление цифр
         """
-        pattern = re.compile(r'\d+')
-        return pattern.sub(' ', text)
+        return self.digits_pattern.sub(' ', text)
 
     def only_ru_en_chars(self, text: str) -> str:
         """
@@ -117,22 +225,19 @@ class TextPreprocessor:
         Казалось бы почему сразу не применить эту функцию,
         но тогда останутся внутренности html, ссылок и подобные вещи
         """
-        pattern = re.compile(r'[^a-zа-яё ]')
-        return pattern.sub(' ', text)
+        return self.ru_en_pattern.sub(' ', text)
 
     def remove_all_non_russian(self, text: str) -> str:
         """
         Обнуляет строки, состоящие полностью на не русском языке
         """
-        pattern = re.compile(r'[а-яё]')
-        return text if re.search(pattern, text) else ''
+        return text if self.russian_pattern.search(text) else ''
 
     def remove_whitespace(self, text: str) -> str:
         """
         Удаляет лишние пробелы
         """
-        pattern = re.compile(r'\s+')
-        return pattern.sub(' ', text)
+        return self.whitespace_pattern.sub(' ', text)
 
     def tokenizer(self, text: str) -> List[str]:
         """
@@ -148,12 +253,26 @@ class TextPreprocessor:
         :param list_text: список текстов
         :return: список текстов со словами в нормальной форме
         """
-        # соединяем все тексты в один большой
-        text = " # ".join(list_text)
-        # лемматизируем с pymystem
-        lemmas = self.mystem.lemmatize(text)
-        # возвращаем текст в исходный вид
-        return ''.join(lemmas).split(' # ')
+        if self.lemma_cache is None:
+            # лемматизируем с pymystem порциями на пуле процессов
+            return self.mystem_pool.lemmatize(list_text)
+
+        # в mystem отправляются только словоформы, которых нет в кеше
+        tokenized_text = [text.split() for text in list_text]
+        lemmas, missing = self.lemma_cache.lookup(set(chain.from_iterable(tokenized_text)))
+        start = time.perf_counter()
+        new_lemmas = dict(zip(missing, self.mystem_pool.lemmatize_words(missing)))
+        elapsed = time.perf_counter() - start
+        self.lemma_cache.update(new_lemmas)
+        lemmas.update(new_lemmas)
+
+        n_hits = len(lemmas) - len(new_lemmas)
+        if lemmas:
+            # сэкономленное время оценивается по средней скорости лемматизации новых словоформ
+            saved = elapsed / len(missing) * n_hits if missing else 0
+            logging.info(f'Кеш лемм: {n_hits} из {len(lemmas)} словоформ ({n_hits / len(lemmas):.0%}), '
+                         f'{len(missing)} новых за {elapsed:.2f} c, сэкономлено ~{saved:.2f} c')
+        return [' '.join(lemmas[token] for token in tokens) for tokens in tokenized_text]
 
     def remove_stopwords(self, token_list: List[str]) -> List[str]:
         """
@@ -163,27 +282,41 @@ class TextPreprocessor:
         """
         return [word for word in token_list if word not in self.russian_stopwords]
 
-    def text_filter(self, tokenized_text: List[List[str]]) -> List[List[str]]:
+    def text_filter(self, tokenized_text: List[List[str]],
+                    seen: Optional[Set[bytes]] = None) -> Tuple[List[List[str]], np.array]:
         """
-        Фильтрует тексты по минимальному количеству токенов и символов и удаляет дубликаты.
+        Фильтрует тексты по минимальному количеству токенов и символов и удаляет дубликаты за один проход.
+        Дубликаты ищутся по 128-битному дайджесту blake2b текста: в отличие от hash(),
+        совпадение дайджестов разных текстов практически невозможно, а памяти нужно меньше, чем на сами тексты
         :param tokenized_text: список токенизированных текстов
-        :return: писок токенизированных, отфильтрованных текстов
-        """
-        # фильтрация по минимальному количеству символов (букв)
-        filtered_tokenized_text = [[word for word in text if len(word) >= self.min_symbols]
-                                   for text in tokenized_text]
-
-        # фильтрация по минимальному количеству слов в комментарие
-        filtered_tokenized_text = [text for text in filtered_tokenized_text if len(text) >= self.min_words]
+        :param seen: дайджесты текстов, встреченных ранее (для удаления дубликатов между порциями),
+               дополняется новыми дайджестами
+        :return: писок токенизированных, отфильтрованных текстов в исходном порядке
+                 и индексы этих текстов в tokenized_text
+        """
+        if seen is None:
+            seen = set()
+        unique_text, index = [], []
+        for i, text in enumerate(tokenized_text):
+            # фильтрация по минимальному количеству символов (букв)
+            text = [word for word in text if len(word) >= self.min_symbols]
+            # фильтрация по минимальному количеству слов в комментарие
+            if len(text) < self.min_words:
+                continue
+            # Удаление дубликатов строк, оставляем первое вхождение
+            # токены без пробелов, поэтому склеенная через пробел строка однозначна
+            digest = hashlib.blake2b(' '.join(text).encode('utf-8'), digest_size=16).digest()
+            if digest in seen:
+                continue
+            seen.add(digest)
+            unique_text.append(text)
+            index.append(i)
+        return unique_text, np.array(index, dtype=np.int32)
 
-        # Удаление дубликатов строк
-        filtered_tokenized_text = set([' '.join(text) for text in filtered_tokenized_text])
-        filtered_tokenized_text = list(map(str.split, filtered_tokenized_text))
-        return filtered_tokenized_text
-
-    def preprocessing(self, text: str) -> str:
+    def preprocessing_chain(self, text: str) -> str:
         """
-        Выполняеет основную предобработку строк
+        Основная предобработка строк последовательными шагами.
+        Эталон для preprocessing
         """
         text = self.lowercase(text)
         text = self.remove_emojis(text)
@@ -198,11 +331,32 @@ class TextPreprocessor:
         text = self.remove_whitespace(text)
         return text
 
-    def get_clean_text(self, text_corpus: List[str]) -> List[List[str]]:
+    def preprocessing(self, text: str) -> str:
         """
-        Главная функция для очистки и предобработки текста
+        Выполняеет основную предобработку строк.
+        Результат совпадает с preprocessing_chain, но за меньшее число проходов.
+        html, ссылки, спецсимволы и файлы удаляются по порядку, так как шаги влияют друг на друга
+        """
+        text = text.lower()
+        # шаги пропускаются, если в тексте нет обязательной части шаблона
+        if '<' in text:
+            text = self.html_pattern.sub(' ', text)
+        if 'http' in text or 'www.' in text or 'ly/' in text:
+            text = self.fused_url_pattern.sub(' ', text)
+        if '&' in text:
+            text = self.fused_spec_symbols_pattern.sub(' ', text)
+        if self.file_extension_pattern.search(text):
+            text = self.fused_files_pattern.sub(' ', text)
+        text = self.non_letters_pattern.sub(' ', text)
+        return text if self.russian_pattern.search(text) else ''
+
+    def clean_chunk(self, text_corpus: List[str],
+                    seen: Optional[Set[bytes]] = None) -> Tuple[List[List[str]], np.array]:
+        """
+        Очистка и предобработка порции текстов
         :param text_corpus: список сырых текстов
-        :return: список токенизированных, очищенных текстов
+        :param seen: дайджесты текстов, встреченных в предыдущих порциях
+        :return: список токенизированных, очищенных текстов и их индексы в text_corpus
         """
         # Основная предобработка тектса
         preproces_text = [self.preprocessing(text) for text in text_corpus]
@@ -213,5 +367,39 @@ class TextPreprocessor:
         # удаляем стоп слова
         tokenized_text = [self.remove_stopwords(tokens) for tokens in tokenized_text]
         # фильтруем по количеству символов\слов, дубликаты
-        clean_text = self.text_filter(tokenized_text)
-        return clean_text
+        return self.text_filter(tokenized_text, seen)
+
+    def iter_clean_text(self, pages: Iterable[List[str]]) -> Iterator[Tuple[List[List[str]], np.array]]:
+        """
+        Потоковая очистка текстов. Страницы текстов читаются в фоне
+        и обрабатываются порциями по chunk_size, дубликаты удаляются между порциями
+        :param pages: последовательность страниц сырых текстов
+        :return: порции токенизированных, очищенных текстов и индексы их исходных текстов
+                 в общей последовательности сырых текстов
+        """
+        seen = set()
+        chunk = []
+        # номер первого сырого текста порции
+        offset = 0
+        for page in background_iter(pages, buffer_size=max(self.chunk_size // 100, 2)):
+            chunk.extend(page)
+            self.n_comments += len(page)
+            if len(chunk) >= self.chunk_size:
+                clean_text, index = self.clean_chunk(chunk, seen)
+                yield clean_text, index + offset
+                offset += len(chunk)
+                chunk = []
+        if chunk:
+            clean_text, index = self.clean_chunk(chunk, seen)
+            yield clean_text, index + offset
+        if self.lemma_cache is not None:
+            self.lemma_cache.save()
+
+    def get_clean_text(self, text_corpus: List[str]) -> Tuple[TokenCorpus, np.array]:
+        """
+        Главная функция для очистки и предобработки текста
+        :param text_corpus: список сырых текстов
+        :return: список токенизированных, очищенных текстов и индексы их исходных текстов в text_corpus
+        """
+        pages = (text_corpus[i:i + self.chunk_size] for i in range(0, len(text_corpus), self.chunk_size))
+        return join_chunks(self.iter_clean_text(pages))
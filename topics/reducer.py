@@ -1,21 +1,179 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict
+
+import numba
 import numpy as np
 import umap
-from sklearn.pipeline import make_pipeline
+from sklearn.neighbors import NearestNeighbors
+from sklearn.pipeline import make_pipeline, Pipeline
 from sklearn.preprocessing import StandardScaler
 
+from .neighbors import NeighborGraph
+
 
 class Reducer:
-    def __init__(self):
-        pass
+    # до этого числа точек UMAP ищет соседей точно (umap-learn, UMAP._small_data)
+    SMALL_DATA = 4096
+
+    def __init__(self, sample_size: Optional[int] = None, batch_size: Optional[int] = None,
+                 n_jobs: int = 1, quality_sample: Optional[int] = None,
+                 random_state: Optional[int] = None, dtype=np.float32):
+        """
+        :param sample_size: размер случайной выборки для обучения StandardScaler и UMAP.
+               None - обучение на всех данных
+        :param batch_size: количество точек, проецируемых за раз при обучении на выборке
+        :param n_jobs: количество потоков для проецирования порций
+               (больше одного только со слоем потоков numba tbb или omp)
+        :param quality_sample: размер выборки для оценки потери качества графа соседей
+               относительно полного обучения. None - не оценивать. Оценка обучает
+               ещё один UMAP, поэтому включается только для отладки
+        :param random_state: зерно для выборок
+        :param dtype: тип данных StandardScaler и UMAP (данные другого типа приводятся к нему)
+        """
+        self.sample_size = sample_size
+        self.batch_size = batch_size
+        self.n_jobs = n_jobs
+        self.quality_sample = quality_sample
+        self.random_state = random_state
+        self.dtype = np.dtype(dtype)
+        # обученный конвейер, им можно проецировать новые комментарии без переобучения
+        self.pipeline: Optional[Pipeline] = None
+        self.umap_params = None
+        self.quality: Optional[Dict[str, float]] = None
+
+    def is_sampled(self, n: int) -> bool:
+        """
+        Проверяет, обучается ли модель на выборке
+        :param n: количество точек
+        """
+        return self.sample_size is not None and self.sample_size < n
 
-    def umap_transform(self, data: np.array, umap_params: dict) -> np.array:
+    def fit(self, data: np.array, umap_params: dict) -> 'Reducer':
         """
-        Снижение размерности алгоритмом UMAP
+        Обучает StandardScaler и UMAP (на выборке, если задан её размер).
+        Начиная с SMALL_DATA точек граф соседей для UMAP строится один раз через NeighborGraph
+        и передаётся модели готовым (precomputed_knn). На таких данных UMAP и сам строит
+        приближённый граф NN-descent, так что подход к поиску соседей тот же.
+        На меньших данных UMAP считает точных соседей сам
         :param data: данные, у которых понизить размерность
         :param umap_params: параметры модели UMAP
+        """
+        self.umap_params = umap_params
+        if self.is_sampled(len(data)):
+            rng = np.random.default_rng(self.random_state)
+            sample = np.sort(rng.choice(len(data), size=self.sample_size, replace=False))
+            data = data[sample]
+        scaler = StandardScaler()
+        # StandardScaler сохраняет тип входа, поэтому UMAP тоже работает в self.dtype
+        scaled = scaler.fit_transform(np.asarray(data, dtype=self.dtype))
+        if len(scaled) < self.SMALL_DATA:
+            # на малых данных UMAP сам считает точных соседей по матрице расстояний,
+            # приближённый граф NN-descent только ухудшил бы проекцию
+            model = umap.UMAP(**umap_params)
+        else:
+            n_neighbors = umap_params.get('n_neighbors', 15)
+            graph = NeighborGraph(scaled, n_neighbors=n_neighbors, metric=umap_params.get('metric', 'euclidean'),
+                                  random_state=umap_params.get('random_state'))
+            model = umap.UMAP(precomputed_knn=graph.umap_knn(n_neighbors), **umap_params)
+        model.fit(scaled)
+        self.pipeline = make_pipeline(scaler, model)
+        return self
+
+    def parallel_jobs(self) -> int:
+        """
+        Количество потоков для проецирования. transform UMAP компилируется numba,
+        а слой потоков numba workqueue падает при параллельных вызовах из нескольких потоков,
+        поэтому параллельно проецируется только со слоями tbb и omp
+        """
+        if self.n_jobs <= 1:
+            return 1
+        try:
+            layer = numba.threading_layer()
+        except ValueError:
+            # слой выбирается при первом параллельном вызове, до него безопасность неизвестна
+            layer = None
+        if layer not in ('tbb', 'omp'):
+            logging.info(f"Слой потоков numba {layer}: проекция UMAP идёт в одном потоке")
+            return 1
+        return self.n_jobs
+
+    def transform(self, data: np.array, out: Optional[np.array] = None) -> np.array:
+        """
+        Проецирует точки обученной моделью порциями
+        :param data: данные (в том числе новые комментарии)
+        :param out: массив для результата (например, отображённый в память файл)
         :return: преобразованные данные
         """
-        pipe_umap = make_pipeline(StandardScaler(),
-                                  umap.UMAP(**umap_params)
-                                  )
-        return pipe_umap.fit_transform(data)
+        if out is None:
+            out = np.empty((len(data), self.umap_params.get('n_components', 2)), dtype=self.dtype)
+        batch_size = self.batch_size or max(len(data), 1)
+        starts = range(0, len(data), batch_size)
+
+        def project(start: int) -> None:
+            out[start:start + batch_size] = self.pipeline.transform(
+                np.asarray(data[start:start + batch_size], dtype=self.dtype))
+
+        if self.parallel_jobs() > 1:
+            with ThreadPoolExecutor(max_workers=self.n_jobs) as executor:
+                list(executor.map(project, starts))
+        else:
+            for start in starts:
+                project(start)
+        return out
+
+    def umap_transform(self, data: np.array, umap_params: dict, out: Optional[np.array] = None) -> np.array:
+        """
+        Снижение размерности алгоритмом UMAP.
+        При обучении на выборке все точки проецируются порциями
+        :param data: данные, у которых понизить размерность
+        :param umap_params: параметры модели UMAP
+        :param out: массив для результата (например, отображённый в память файл)
+        :return: преобразованные данные
+        """
+        self.fit(data, umap_params)
+        if not self.is_sampled(len(data)):
+            # проекция обучающих точек уже посчитана при обучении
+            result = self.pipeline[-1].embedding_
+            if out is None:
+                return result.astype(self.dtype, copy=False)
+            out[:] = result
+            return out
+
+        out = self.transform(data, out)
+        if self.quality_sample:
+            self.quality = self.neighbor_quality(data, out)
+            logging.info(f"Сохранение соседей UMAP: выборка {self.quality['sampled']:.3f}, "
+                         f"полное обучение {self.quality['full']:.3f}, "
+                         f"потеря {self.quality['loss']:.3f}")
+        return out
+
+    def neighbor_overlap(self, X: np.array, X_low: np.array, metric: str) -> float:
+        """
+        Доля общих k ближайших соседей точки в исходном пространстве и в проекции
+        :param X: точки в исходном пространстве
+        :param X_low: те же точки в проекции
+        :param metric: метрика исходного пространства
+        """
+        k = min(self.umap_params.get('n_neighbors', 15), len(X) - 1)
+        high = NearestNeighbors(n_neighbors=k, metric=metric).fit(X).kneighbors(return_distance=False)
+        low = NearestNeighbors(n_neighbors=k).fit(X_low).kneighbors(return_distance=False)
+        return float(np.mean([len(np.intersect1d(h, l, assume_unique=True)) / k for h, l in zip(high, low)]))
+
+    def neighbor_quality(self, data: np.array, projection: np.array) -> Dict[str, float]:
+        """
+        Оценивает потерю качества графа соседей от обучения на выборке.
+        На отдельной выборке точек сравнивается сохранение соседей проекцией модели,
+        обученной на выборке, и UMAP, обученного на этих точках целиком
+        :param data: исходные данные
+        :param projection: проекция модели, обученной на выборке
+        :return: сохранение соседей при обучении на выборке, при полном обучении и их разница
+        """
+        rng = np.random.default_rng(self.random_state)
+        size = min(self.quality_sample, len(data))
+        idx = np.sort(rng.choice(len(data), size=size, replace=False))
+        metric = self.umap_params.get('metric', 'euclidean')
+        X = self.pipeline[0].transform(np.asarray(data[idx], dtype=self.dtype))
+        sampled = self.neighbor_overlap(X, projection[idx], metric)
+        full = self.neighbor_overlap(X, umap.UMAP(**self.umap_params).fit_transform(X), metric)
+        return {'sampled': sampled, 'full': full, 'loss': full - sampled}
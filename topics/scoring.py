@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+import tracemalloc
+from typing import Optional, Tuple, Callable, Any
+
+import numpy as np
+from sklearn.metrics import (calinski_harabasz_score,
+                             davies_bouldin_score,
+                             silhouette_score,
+                             pairwise_distances)
+
+
+# tracemalloc общий на весь процесс: одновременные замеры сбрасывали бы пик друг друга
+_trace_lock = threading.Lock()
+
+
+def measure_call(func: Callable, *args, trace_memory: bool = False, **kwargs) -> Tuple[Any, float, int]:
+    """
+    Вызывает функцию и замеряет время и, для отладки, пиковую память.
+    tracemalloc замедляет каждое выделение памяти и общий для процесса,
+    поэтому замеры памяти выполняются по одному
+    :param func: функция
+    :param trace_memory: флаг - замерять пик памяти через tracemalloc
+    :return: результат функции, время в секундах, пик памяти в байтах (0 без замера памяти)
+    """
+    if not trace_memory:
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        return result, time.perf_counter() - start, 0
+
+    with _trace_lock:
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            if not tracing:
+                tracemalloc.stop()
+    return result, elapsed, peak
+
+
+class ClusterScorer:
+    def __init__(self, sample_size: Optional[int] = None, random_state: Optional[int] = None,
+                 max_exact: int = 5000, trace_memory: bool = False) -> None:
+        """
+        :param sample_size: размер стратифицированной выборки для silhouette.
+               None - считать по всем данным через предпосчитанную матрицу расстояний
+        :param random_state: зерно для выборки
+        :param max_exact: наибольшее число точек для матрицы расстояний n x n
+               (5000 точек - около 100 МБ во float32). На больших данных
+               silhouette считается по выборке такого размера
+        :param trace_memory: флаг - замерять пик памяти оценки (отладка, замедляет расчёт)
+        """
+        self.sample_size = sample_size
+        self.random_state = random_state
+        self.max_exact = max_exact
+        self.trace_memory = trace_memory
+        self.X = None
+        self.distances = None
+        self.n_sample = sample_size
+
+    def prepare(self, X) -> None:
+        """
+        Запоминает выборку и, если выборка не сэмплируется,
+        один раз считает матрицу попарных расстояний для всех кандидатов
+        :param X: данные для оценки кластеров
+        """
+        if X is self.X:
+            return
+        n_sample, distances = self.sample_size, None
+        if len(X) > self.max_exact and (n_sample is None or n_sample >= len(X)):
+            logging.info(f"Silhouette по выборке {self.max_exact} из {len(X)} точек: "
+                         f"матрица расстояний не поместится в память")
+            n_sample = self.max_exact
+        if n_sample is None or n_sample >= len(X):
+            # float32 вдвое уменьшает матрицу n x n
+            distances = pairwise_distances(np.asarray(X, dtype=np.float32))
+            np.fill_diagonal(distances, 0)
+        # X запоминается последним: по нему проверяется, что оценщик уже подготовлен
+        self.n_sample, self.distances = n_sample, distances
+        self.X = X
+
+    def stratified_sample(self, labels: np.array) -> np.array:
+        """
+        Стратифицированная по кластерам выборка индексов ровно из n_sample точек.
+        Каждый кластер представлен не менее чем двумя точками, остаток выборки делится
+        пропорционально размерам кластеров. Если кластеров больше, чем помещается
+        по две точки, в выборку попадают самые крупные
+        :param labels: метки кластеров
+        :return: отсортированные индексы выборки
+        """
+        rng = np.random.default_rng(self.random_state)
+        clusters, counts = np.unique(labels, return_counts=True)
+        reserved = np.minimum(counts, 2)
+        if reserved.sum() >= self.n_sample:
+            order = np.argsort(-counts, kind='stable')
+            keep = order[np.cumsum(reserved[order]) <= self.n_sample]
+            quotas = np.zeros_like(counts)
+            quotas[keep] = reserved[keep]
+        else:
+            # остаток делится пропорционально точкам кластеров сверх минимума,
+            # округление вниз добирается по наибольшим дробным частям
+            extra = (counts - reserved) * (self.n_sample - reserved.sum()) / (len(labels) - reserved.sum())
+            quotas = reserved + np.floor(extra).astype(int)
+            remainder = np.argsort(-(extra - np.floor(extra)), kind='stable')
+            quotas[remainder[:self.n_sample - quotas.sum()]] += 1
+        idx = [rng.choice(np.flatnonzero(labels == cluster), size=quota, replace=False)
+               for cluster, quota in zip(clusters, quotas)]
+        return np.sort(np.concatenate(idx))
+
+    def silhouette(self, labels: np.array) -> float:
+        """
+        Silhouette Score по предпосчитанной матрице или по выборке
+        :param labels: метки кластеров
+        """
+        if self.distances is not None:
+            return silhouette_score(self.distances, labels, metric='precomputed')
+        idx = self.stratified_sample(labels)
+        return silhouette_score(self.X[idx], labels[idx])
+
+    def score(self, labels: np.array) -> Tuple[float, float, float]:
+        """
+        Считает метрики кластеризации
+        :param labels: метки кластеров
+        :return: метрики calinski_harabasz, davies_bouldin, silhouette
+        """
+        return (calinski_harabasz_score(self.X, labels),
+                davies_bouldin_score(self.X, labels),
+                self.silhouette(labels))
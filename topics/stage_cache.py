@@ -0,0 +1,130 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional, Union
+
+
+class StageCache:
+    SUFFIX = '.pkl'
+
+    def __init__(self, path: Union[str, Path], max_size_mb: int = 2048, enabled: bool = True) -> None:
+        """
+        Дисковый кеш результатов этапов моделирования.
+        Результат хранится под хешем входных данных этапа, старые записи вытесняются (LRU)
+        :param path: папка кеша
+        :param max_size_mb: максимальный размер кеша в мегабайтах
+        :param enabled: флаг - использовать кеш
+        """
+        self.path = Path(path)
+        self.max_size = max_size_mb * 2 ** 20
+        self.enabled = enabled
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """
+        Хеш от параметров этапа (ключей предыдущих этапов, секций конфига и т.п.)
+        :param parts: сериализуемые в json части ключа
+        :return: ключ
+        """
+        dump = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(dump.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def fingerprint(obj: Any) -> str:
+        """
+        Хеш от содержимого данных
+        :param obj: данные, которые можно сериализовать pickle
+        :return: ключ
+        """
+        return hashlib.sha256(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()
+
+    def file(self, stage: str, key: str) -> Path:
+        """
+        Файл записи кеша
+        :param stage: имя этапа
+        :param key: ключ
+        """
+        return self.path / stage / f'{key}{self.SUFFIX}'
+
+    def get(self, stage: str, key: str, max_age: Optional[float] = None) -> Optional[Any]:
+        """
+        Достает результат этапа из кеша
+        :param stage: имя этапа
+        :param key: ключ
+        :param max_age: максимальный возраст записи в секундах
+        :return: результат или None, если записи нет
+        """
+        if not self.enabled:
+            return None
+        file = self.file(stage, key)
+        try:
+            with open(file, 'rb') as f:
+                created, value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if max_age is not None and time.time() - created > max_age:
+            return None
+        # время доступа для вытеснения давно неиспользованных записей
+        try:
+            os.utime(file)
+        except OSError:
+            pass
+        return value
+
+    def set(self, stage: str, key: str, value: Any) -> None:
+        """
+        Сохраняет результат этапа в кеш
+        :param stage: имя этапа
+        :param key: ключ
+        :param value: результат этапа
+        """
+        if not self.enabled:
+            return
+        file = self.file(stage, key)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = file.with_name(f'{file.name}.{os.getpid()}-{threading.get_ident()}.tmp')
+        with open(tmp_file, 'wb') as f:
+            pickle.dump((time.time(), value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, file)
+        self.evict()
+
+    def cached(self, stage: str, key: str, func: Callable[[], Any], max_age: Optional[float] = None) -> Any:
+        """
+        Достает результат этапа из кеша или вычисляет и сохраняет его
+        :param stage: имя этапа
+        :param key: ключ
+        :param func: функция без аргументов, вычисляющая результат
+        :param max_age: максимальный возраст записи в секундах
+        :return: результат этапа
+        """
+        value = self.get(stage, key, max_age)
+        if value is not None:
+            logging.info(f"Этап '{stage}' взят из кеша")
+            return value
+        value = func()
+        self.set(stage, key, value)
+        return value
+
+    def evict(self) -> None:
+        """
+        Удаляет давно использованные записи, пока кеш больше максимального размера
+        """
+        files = []
+        for file in self.path.glob(f'*/*{self.SUFFIX}'):
+            try:
+                stat = file.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, file))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, file in sorted(files):
+            if total <= self.max_size:
+                break
+            file.unlink(missing_ok=True)
+            total -= size
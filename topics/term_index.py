@@ -0,0 +1,108 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix
+
+from .corpus import TokenCorpus
+
+
+class TermIndex:
+    def __init__(self, vocab: np.array, clusters: np.array, counts: csr_matrix, top_k: int = 10,
+                 allowed: Optional[np.array] = None) -> None:
+        """
+        Статистика слов по кластерам одного алгоритма: частоты (кластер x слово),
+        веса c-TF-IDF и top_k ключевых слов каждого кластера.
+        Облака слов, подсказки и выгрузки читают её без повторного обхода корпуса
+        :param vocab: словарь токенов корпуса
+        :param clusters: кластеры по возрастанию (строки матрицы)
+        :param counts: частоты слов в кластерах
+        :param top_k: количество ключевых слов кластера
+        :param allowed: маска слов словаря, из которых выбираются ключевые слова
+               (та же, что у облаков слов). None - все слова
+        """
+        self.vocab = vocab
+        self.clusters = clusters
+        self.counts = counts
+        self.weights = self.ctfidf(counts)
+
+        # ключевые слова по убыванию веса, недостающие дополняются -1
+        self.top_terms = np.full((len(clusters), top_k), -1, dtype=np.int32)
+        self.top_weights = np.zeros((len(clusters), top_k), dtype=np.float32)
+        for row in range(len(clusters)):
+            start, end = self.weights.indptr[row], self.weights.indptr[row + 1]
+            terms, weights = self.weights.indices[start:end], self.weights.data[start:end]
+            if allowed is not None:
+                keep = allowed[terms]
+                terms, weights = terms[keep], weights[keep]
+            top = np.argsort(-weights, kind='stable')[:top_k]
+            self.top_terms[row, :len(top)] = terms[top]
+            self.top_weights[row, :len(top)] = weights[top]
+
+    @classmethod
+    def from_labels(cls, corpus: TokenCorpus, labels: np.array, top_k: int = 10,
+                    allowed: Optional[np.array] = None) -> 'TermIndex':
+        """
+        Строит статистику одной группировкой по индексам токенов корпуса
+        :param corpus: очищенный корпус
+        :param labels: метки кластеров текстов корпуса
+        :param top_k: количество ключевых слов кластера
+        :param allowed: маска слов словаря для ключевых слов
+        """
+        clusters, rows = np.unique(np.asarray(labels), return_inverse=True)
+        token_rows = np.repeat(rows.astype(np.int32), corpus.lengths())
+        ids = np.asarray(corpus.ids)
+        # повторы пар (кластер, слово) суммируются при переводе в CSR
+        counts = coo_matrix((np.ones(len(ids), dtype=np.int32), (token_rows, ids)),
+                            shape=(len(clusters), len(corpus.vocab))).tocsr()
+        return cls(corpus.vocab, clusters, counts, top_k=top_k, allowed=allowed)
+
+    @staticmethod
+    def ctfidf(counts: csr_matrix) -> csr_matrix:
+        """
+        Веса c-TF-IDF: доля слова в кластере * log(1 + среднее число слов в кластере / частота слова).
+        Матрица весов использует структуру матрицы частот
+        :param counts: частоты слов в кластерах
+        """
+        cluster_words = np.asarray(counts.sum(axis=1)).ravel()
+        term_freq = np.asarray(counts.sum(axis=0)).ravel()
+        tf = counts.data / np.repeat(np.maximum(cluster_words, 1), np.diff(counts.indptr))
+        idf = np.log1p(cluster_words.mean() / term_freq[counts.indices])
+        return csr_matrix(((tf * idf).astype(np.float32), counts.indices, counts.indptr),
+                          shape=counts.shape, copy=False)
+
+    def row(self, cluster: int) -> int:
+        """
+        Строка кластера в матрицах
+        :param cluster: номер кластера
+        """
+        row = int(np.searchsorted(self.clusters, cluster))
+        if row == len(self.clusters) or self.clusters[row] != cluster:
+            raise KeyError(cluster)
+        return row
+
+    def frequencies(self, cluster: int, allowed: Optional[np.array] = None,
+                    n: Optional[int] = None) -> Dict[str, int]:
+        """
+        Частоты слов кластера
+        :param cluster: номер кластера
+        :param allowed: маска допустимых слов словаря
+        :param n: количество самых частых слов. None - все слова
+        :return: словарь слово - частота по убыванию частоты
+        """
+        row = self.row(cluster)
+        start, end = self.counts.indptr[row], self.counts.indptr[row + 1]
+        terms, counts = self.counts.indices[start:end], self.counts.data[start:end]
+        if allowed is not None:
+            keep = allowed[terms]
+            terms, counts = terms[keep], counts[keep]
+        top = np.argsort(-counts, kind='stable')[:n]
+        return dict(zip(self.vocab[terms[top]].tolist(), counts[top].tolist()))
+
+    def keywords(self, cluster: int, n: Optional[int] = None) -> List[str]:
+        """
+        Ключевые слова кластера по убыванию веса c-TF-IDF
+        :param cluster: номер кластера
+        :param n: количество слов, не больше top_k. None - все top_k
+        """
+        terms = self.top_terms[self.row(cluster), :n]
+        return self.vocab[terms[terms >= 0]].tolist()
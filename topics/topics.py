@@ -1,12 +1,52 @@
 import logging
-from collections import Counter
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from operator import attrgetter
+from typing import Optional, List, Tuple, Dict, Callable, Any, Iterable, Iterator
 
 import numpy as np
 import pandas as pd
 from wordcloud import WordCloud
 
-from loader import config
-from topics import (YouTubeApi, TextPreprocessor, Reducer, Emdedder, Cluster)
+from loader import config, ROOT_DIR, VALID_ALGORITHM, FEATURES_DTYPE, COORDINATES_DTYPE, LABEL_DTYPES
+from topics import (CommentArchive, YouTubeApi, TextPreprocessor, Reducer, Emdedder, Cluster, ClusterScorer,
+                    ModelStore, StageCache)
+from topics.lemma_cache import get_lemma_cache
+from topics.preprocessing import join_chunks
+from topics.near_duplicates import NearDuplicates
+from topics.corpus import TokenCorpus
+from topics.clusters import search_jobs
+from topics.disk_store import DiskStore
+from topics.neighbors import NeighborGraph
+from topics.term_index import TermIndex
+from topics.wordclouds import WordClouds
+
+# этапы моделирования для отображения прогресса
+STAGES = {'fetch': 'Скачивание и предобработка комментариев',
+          'clean': 'Схлопывание почти одинаковых комментариев',
+          'embed': 'Векторизация',
+          'reduce': 'Снижение размерности',
+          'cluster': 'Кластеризация'}
+
+
+def no_progress(stage: str, info: Optional[str] = None) -> None:
+    """
+    Отметка прогресса по умолчанию - ничего не делает
+    """
+
+
+def timed_call(func: Callable, *args, **kwargs) -> Tuple[Any, float]:
+    """
+    Вызывает функцию и замеряет время её работы.
+    Функция уровня модуля, чтобы её можно было передать в пул процессов
+    :param func: функция
+    :return: результат функции и время в секундах
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
 
 
 class Topics:
@@ -17,77 +57,490 @@ class Topics:
         self.youtube_api_key = youtube_api_key
         self.len_comments_corpus = None
         self.cleaned_corpus = None
+        # ключ содержимого очищенного корпуса (для кешей интерфейса)
+        self.corpus_key = None
+        # сырые комментарии и индексы исходного комментария для каждого очищенного
+        self.comments = None
+        self.source_index = None
+        # веса комментариев - количество схлопнутых в них почти одинаковых комментариев
+        self.weights = None
         self.data = pd.DataFrame()
         self.wordcloud = None
+        # облака слов кластеров
+        self.wordclouds = None
+        # ошибки и время работы алгоритмов кластеризации
+        self.errors = {}
+        self.timings = {}
+        # данные для ленивой кластеризации невыбранными алгоритмами
+        self.X_umap = None
+        self.umap_key = None
+        # ключи меток алгоритмов (для кеша производных от них данных)
+        self.label_keys = {}
+        # статистика слов кластеров каждого алгоритма
+        self.term_indexes: Dict[str, TermIndex] = {}
+        # обученный понижатель размерности
+        self.reducer = None
+        # граф соседей проекции, общий для алгоритмов кластеризации
+        self.neighbor_graph = None
+        # сеансы, подключённые к одной задаче, делят результат: ленивая кластеризация
+        # одного алгоритма выполняется один раз
+        self.cluster_lock = threading.Lock()
+        # режим канала: данные запуска хранятся в файлах
+        self.channel_mode = False
+        # отметка прогресса по этапам из STAGES
+        self.progress = no_progress
+        self.cache = StageCache(ROOT_DIR / config['cache']['path'],
+                                max_size_mb=config['cache']['max_size_mb'],
+                                enabled=config['cache']['enabled'])
 
-    def generate_topics(self, url: str, max_comments: int, n_videos: int) -> None:
+    def generate_topics(self, url: str, max_comments: int, n_videos: int,
+                        corpus_name: Optional[str] = None,
+                        algorithms: Optional[List[str]] = None,
+                        progress: Optional[Callable[[str, Optional[str]], None]] = None) -> None:
         """
         Главная функция, запускающая процесс кластеризации
         :param url: url видео-ролика
         :param max_comments: максимальное число комментариев
         :param n_videos: число дополнительных видео
+        :param corpus_name: имя корпуса для хранилища моделей FastText.
+               По умолчанию модель хранится по id канала
+        :param algorithms: алгоритмы кластеризации, которые запустить сразу.
+               По умолчанию все, остальные считаются при первом обращении (get_labels)
+        :param progress: функция отметки прогресса: этап из STAGES и пояснение
         """
-        # Парсинг комментариев с ютуба
-        youtube = YouTubeApi(self.youtube_api_key)
-        comments_corpus = youtube.get_comments(url,
-                                               max_comments=max_comments,
-                                               n_videos=n_videos)
+        cache = self.cache
+        self.progress = progress or no_progress
+        self.progress('fetch')
 
-        assert len(comments_corpus) != 0, 'Количество комментариев равно 0. ' \
-                                          'Возможно они скрыты или отсутствуют, или ' \
-                                          'видео недоступно'
+        # Парсинг и предобработка комментариев с ютуба.
+        # комментарии очищаются порциями по мере скачивания
+        archive = None
+        if config['archive']['enabled']:
+            archive = CommentArchive(ROOT_DIR / config['archive']['path'])
+        youtube = YouTubeApi(self.youtube_api_key,
+                             archive=archive,
+                             max_age=config['archive']['max_age'],
+                             offline=config['archive']['offline'],
+                             **config['youtube'])
+        # с кешем лемм омонимы лемматизируются без контекста, поэтому корпуса различаются
+        corpus_key = cache.make_key(url, max_comments, n_videos, config['preprocessing'],
+                                    config['lemma_cache']['enabled'])
+        channel_params = config['channel_mode']
+        self.channel_mode = channel_params['enabled'] or n_videos >= channel_params['min_videos']
+        store = None
+        if self.channel_mode:
+            # корпус пишется на диск по мере скачивания и очистки
+            store = DiskStore(ROOT_DIR / channel_params['path'] / corpus_key)
+            # задачи с тем же корпусом ждут записи и берут готовую версию
+            with store.lock():
+                if not store.is_fresh(config['cache']['comments_ttl']):
+                    self.write_channel_corpus(youtube, url, max_comments, n_videos, store)
+            cleaned_corpus, len_comments_corpus, source_index, comments = store.load_corpus()
+            store.touch()
+            # прошлые версии и папки давно использованных запусков вытесняются по размеру,
+            # как записи кеша этапов
+            DiskStore.evict(ROOT_DIR / channel_params['path'], channel_params['max_size_mb'],
+                            min_age=channel_params['min_age'], keep=store.path)
+            logging.info("Режим канала: данные хранятся в файлах")
+        else:
+            cleaned_corpus, len_comments_corpus, source_index, comments = cache.cached(
+                'corpus', corpus_key,
+                lambda: self.get_clean_corpus(youtube, url, max_comments, n_videos),
+                max_age=config['cache']['comments_ttl'])
 
-        self.len_comments_corpus = len(comments_corpus)
-        logging.info(f"Получено комментариев: {len(comments_corpus)}")
+        assert len_comments_corpus != 0, 'Количество комментариев равно 0. ' \
+                                         'Возможно они скрыты или отсутствуют, или ' \
+                                         'видео недоступно'
 
-        # предобработка текста
-        prep = TextPreprocessor(**config['preprocessing'])
-        cleaned_corpus = prep.get_clean_text(text_corpus=comments_corpus)
+        self.len_comments_corpus = len_comments_corpus
+        logging.info(f"Получено комментариев: {len_comments_corpus}")
 
         assert len(cleaned_corpus) != 0, 'Количество валидных данных после очистки текста равна 0.' \
                                          'Возможно все комментарии на иностранном языке или короткие'
 
-        self.cleaned_corpus = cleaned_corpus
         logging.info(f"Количество комментариев после предобработки: {len(cleaned_corpus)}")
 
+        self.progress('clean', f'{len(cleaned_corpus)} комментариев после предобработки')
+        # схлопывание почти одинаковых комментариев (боты, копипаста) в один с весом.
+        # ключи следующих этапов строятся от содержимого корпуса,
+        # поэтому повторно скачанные те же комментарии попадают в кеш
+        dedup_key = cache.make_key(cleaned_corpus.fingerprint(), config['near_duplicates'])
+        if config['near_duplicates']['enabled']:
+            params = {k: v for k, v in config['near_duplicates'].items() if k != 'enabled'}
+            representatives, weights = cache.cached('near_duplicates', dedup_key,
+                                                    lambda: NearDuplicates(**params).collapse(cleaned_corpus))
+            if store is not None:
+                full_corpus = cleaned_corpus
+                cleaned_corpus = store.cached_corpus('near_duplicates', dedup_key,
+                                                     lambda: full_corpus[representatives])
+            else:
+                cleaned_corpus = cleaned_corpus[representatives]
+            source_index = source_index[representatives]
+            logging.info(f"Количество комментариев после схлопывания почти одинаковых: {len(cleaned_corpus)}")
+        else:
+            weights = np.ones(len(cleaned_corpus), dtype=np.int64)
+
+        self.cleaned_corpus, self.corpus_key = cleaned_corpus, dedup_key
+        self.comments, self.source_index = comments, source_index
+        self.weights = weights
+
         # векторизация текста
-        emb = Emdedder()
-        embeddings = emb.get_embeddings_ft(corpus=cleaned_corpus,
-                                           ft_params=config['fasttext']['init'],
-                                           epochs=config['fasttext']['train']['epochs'])
+        self.progress('embed')
+        model_store, model_name = self.get_model_store(youtube, url, corpus_name)
+
+        def make_embeddings_key() -> str:
+            # дообученная модель канала меняется от запуска к запуску, поэтому в ключ входит её версия
+            version = None if model_store is None else model_store.version(model_name, config['fasttext']['init'])
+            return cache.make_key(dedup_key, config['fasttext'], config['dtype']['features'], version)
+
+        embeddings_key = make_embeddings_key()
+        if store is not None:
+            # эмбеддинги считаются порциями сразу в файл
+            shape = (len(cleaned_corpus), config['fasttext']['init'].get('vector_size', 100))
+            embeddings, model_tokens = store.cached_array(
+                'embeddings', embeddings_key, shape,
+                lambda out: self.get_embeddings(cleaned_corpus, model_store, model_name, out=out,
+                                                batch_size=channel_params['batch_size'])[1],
+                dtype=FEATURES_DTYPE)
+        else:
+            embeddings, model_tokens = cache.cached('embeddings', embeddings_key,
+                                                    lambda: self.get_embeddings(cleaned_corpus,
+                                                                                model_store, model_name))
+        # эмбеддинги посчитаны только что сохраненной моделью: переносим их под ключ её версии,
+        # чтобы следующий запуск с той же моделью их нашёл
+        trained_key = make_embeddings_key()
+        if trained_key != embeddings_key:
+            if store is not None:
+                store.rename_array('embeddings', embeddings_key, trained_key)
+            else:
+                cache.set('embeddings', trained_key, (embeddings, model_tokens))
+            embeddings_key = trained_key
         logging.info(f"Размерность эмбеддинга комментариев: {embeddings.shape}")
 
         # понижение размерности
-        red = Reducer()
-        X_umap = red.umap_transform(data=embeddings, umap_params=config['umap'])
-        # изменим тип данных для сокращения памяти
-        self.data[['x', 'y', 'z']] = X_umap.astype(np.float16)
+        self.progress('reduce')
+        umap_key = cache.make_key(embeddings_key, config['umap'], config['reducer'])
+        reducer_params = {'random_state': config['umap'].get('random_state'), 'dtype': FEATURES_DTYPE,
+                          **config['reducer']}
+        if store is not None:
+            # UMAP обучается на выборке, остальные точки проецируются порциями
+            reducer_params.update(sample_size=channel_params['umap_sample'],
+                                  batch_size=channel_params['batch_size'])
+            umap_key = cache.make_key(umap_key, reducer_params)
+
+            def project(out: np.array) -> Reducer:
+                reducer = Reducer(**reducer_params)
+                reducer.umap_transform(data=embeddings, umap_params=config['umap'], out=out)
+                return reducer
+
+            shape = (len(embeddings), config['umap'].get('n_components', 2))
+            X_umap, reducer = store.cached_array('umap', umap_key, shape, project, dtype=FEATURES_DTYPE)
+            # проекция небольшая (n x 3), для кластеризации читаем её в память
+            X_umap = np.array(X_umap)
+        else:
+            def project() -> Tuple[np.array, Reducer]:
+                reducer = Reducer(**reducer_params)
+                return reducer.umap_transform(data=embeddings, umap_params=config['umap']), reducer
+
+            X_umap, reducer = cache.cached('umap', umap_key, project)
+        # обученный UMAP сохраняется для проекции новых комментариев без переобучения
+        self.reducer = reducer
+        # тип координат для графиков задаётся отдельно (float16 вдвое сокращает память)
+        self.data[['x', 'y', 'z']] = X_umap.astype(COORDINATES_DTYPE)
+        self.data['weight'] = weights
         logging.info(f"Размерность данных после снижения размерности: {X_umap.shape}")
 
-        # кластеризация
-        cluster = Cluster()
-        self.data['HDBSCAN'] = cluster.hdbscan_clusters(X_umap, **config['clusters']['hdbscan'])
-        logging.info("HDBSCAN OK")
-        self.data['DBSCAN'] = cluster.dbscan_clusters(X_umap, **config['clusters']['dbscan'])
-        logging.info("DBSCAN OK")
-        self.data['Agglomerative'] = cluster.agglomerative_clusters(X_umap,
-                                                                    **config['clusters']['agglomerative'])
-        logging.info("Agglomerative OK")
-        self.data['Spectral'] = cluster.spectral_clusters(X_umap,
-                                                          n_minmax=tuple(config['clusters']['n_minmax']),
-                                                          **config['clusters']['spectral'])
-        logging.info("Spectral OK")
-        self.data['KMeans'] = cluster.kmeans_clusters(X_umap,
-                                                      n_minmax=tuple(config['clusters']['n_minmax']),
-                                                      **config['clusters']['kmeans'])
-
-        logging.info("KMeans OK")
-        logging.info("Кластеризация выполнена успешно")
-
-        # облако слов
+        self.X_umap, self.umap_key = X_umap, umap_key
+
+        # облако слов. Строится до кластеризации: его маска допустимых слов
+        # нужна и ключевым словам кластеров
         # выделяем токены корпуса которых нет в токенах модели (для стопслов wordcloud)
-        diff_words = set(Counter(sum(cleaned_corpus, [])).keys()).difference(set(emb.model_tokens))
+        corpus_tokens, _ = cleaned_corpus.token_counts()
+        diff_words = set(corpus_tokens.tolist()).difference(model_tokens)
         wordcloud = WordCloud(**config['wordcloud'],
                               stopwords=diff_words)
         self.wordcloud = wordcloud
+        self.wordclouds = WordClouds(wordcloud, cleaned_corpus.vocab, cache=cache, **config['wordcloud_render'])
+
+        # строится при первом обращении Spectral или DBSCAN
+        self.neighbor_graph = NeighborGraph(X_umap, **config['neighbors'])
+        self.progress('cluster')
+        self.run_clusters(VALID_ALGORITHM if algorithms is None else algorithms)
+
+        # дальнейшие ленивые кластеризации идут уже не в рамках запуска
+        self.progress = no_progress
         logging.info("Успешно завершено моделирование топиков")
+
+    def run_clusters(self, algorithms: List[str]) -> None:
+        """
+        Кластеризация выбранными алгоритмами.
+        Алгоритмы независимы, поэтому запускаются параллельно.
+        Ошибка одного алгоритма не прерывает остальные
+        :param algorithms: имена алгоритмов из VALID_ALGORITHM
+        """
+        scoring_params = dict(config['clusters']['scoring'])
+        if self.channel_mode:
+            # в режиме канала матрица расстояний n x n не помещается в память
+            scoring_params['sample_size'] = config['channel_mode']['scoring_sample']
+
+        executor_params = config['clusters']['executor']
+        search_params = dict(config['clusters']['search'])
+        if search_params['n_jobs'] is None:
+            # переборы идут внутри пула алгоритмов и параллельных задач: ядра делятся между ними
+            n_outer = min(executor_params['max_workers'], len(algorithms)) * config['jobs']['runner']['max_workers']
+            search_params['n_jobs'] = search_jobs(n_outer)
+
+        def make_cluster() -> Cluster:
+            # оценщик и статистика подбора числа кластеров хранят состояние,
+            # поэтому параллельные алгоритмы не должны делить один Cluster
+            return Cluster(scorer=ClusterScorer(**scoring_params),
+                           neighbor_graph=self.neighbor_graph,
+                           label_dtypes=LABEL_DTYPES,
+                           **search_params)
+
+        executor_cls = ProcessPoolExecutor if executor_params['kind'] == 'process' else ThreadPoolExecutor
+        if executor_cls is ProcessPoolExecutor and {'Spectral', 'DBSCAN'} & set(algorithms):
+            # в процессы уходит копия графа, поэтому строим его заранее, а не в каждом процессе
+            self.neighbor_graph.build()
+            if 'DBSCAN' in algorithms:
+                self.neighbor_graph.radius_graph(config['clusters']['dbscan'].get('eps', 0.5))
+        keys, futures = {}, {}
+        with executor_cls(max_workers=executor_params['max_workers']) as executor:
+            for algorithm, (get_method, params) in self.cluster_tasks().items():
+                if algorithm not in algorithms:
+                    continue
+                if self.channel_mode and algorithm not in config['channel_mode']['algorithms']:
+                    self.errors[algorithm] = 'Алгоритм недоступен в режиме канала (слишком много комментариев)'
+                    continue
+                # от настроек перебора числа кластеров зависят только Spectral и KMeans
+                search = {k: config['clusters'][k] for k in ('search', 'scoring')} if 'n_minmax' in params else None
+                # Spectral и DBSCAN работают по графу соседей проекции
+                neighbors = config['neighbors'] if algorithm in ('Spectral', 'DBSCAN') else None
+                keys[algorithm] = self.cache.make_key(self.umap_key, algorithm, params, search, neighbors,
+                                                      scoring_params if self.channel_mode else None)
+                labels = self.cache.get('labels', keys[algorithm])
+                if labels is not None:
+                    self.set_labels(algorithm, keys[algorithm], labels)
+                    logging.info(f"{algorithm} взят из кеша")
+                    continue
+                futures[algorithm] = executor.submit(timed_call, get_method(make_cluster()), self.X_umap, **params)
+
+            for done, (algorithm, future) in enumerate(futures.items(), 1):
+                try:
+                    labels, seconds = future.result()
+                except Exception as e:
+                    self.errors[algorithm] = f'{type(e).__name__}: {e}'
+                    logging.exception(f"{algorithm} завершился с ошибкой")
+                    continue
+                self.cache.set('labels', keys[algorithm], labels)
+                self.set_labels(algorithm, keys[algorithm], labels)
+                self.timings[algorithm] = seconds
+                self.progress('cluster', f'{algorithm} готов ({done} из {len(futures)})')
+                logging.info(f"{algorithm} OK: {seconds:.2f} c")
+        logging.info("Кластеризация выполнена")
+
+    def set_labels(self, algorithm: str, key: str, labels: np.array) -> None:
+        """
+        Запоминает метки алгоритма и строит по ним статистику слов кластеров
+        :param algorithm: имя алгоритма
+        :param key: ключ меток в кеше
+        :param labels: метки кластеров
+        """
+        start = time.perf_counter()
+        # ключевые слова выбираются из тех же слов, что попадают в облака
+        self.term_indexes[algorithm] = TermIndex.from_labels(self.cleaned_corpus, labels,
+                                                             allowed=self.wordclouds.allowed,
+                                                             **config['term_index'])
+        logging.info(f"Статистика слов кластеров {algorithm}: {time.perf_counter() - start:.2f} c")
+        self.label_keys[algorithm] = key
+        # метки - признак готовности алгоритма (is_clustered), поэтому записываются последними
+        self.data[algorithm] = labels
+
+    def is_clustered(self, algorithm: str) -> bool:
+        """
+        Проверяет, запускался ли алгоритм
+        :param algorithm: имя алгоритма
+        """
+        return algorithm in self.data or algorithm in self.errors
+
+    def get_labels(self, algorithm: str) -> Optional[pd.Series]:
+        """
+        Метки кластеров алгоритма. Если алгоритм не запускался,
+        кластеризация выполняется и запоминается
+        :param algorithm: имя алгоритма
+        :return: метки или None, если алгоритм завершился с ошибкой
+        """
+        if not self.is_clustered(algorithm):
+            with self.cluster_lock:
+                # пока ждали блокировку, алгоритм мог посчитать другой сеанс
+                if not self.is_clustered(algorithm):
+                    self.run_clusters([algorithm])
+        return self.data.get(algorithm)
+
+    def get_wordclouds(self, algorithm: str, clusters: List[int]) -> List[bytes]:
+        """
+        Облака слов кластеров алгоритма
+        :param algorithm: имя алгоритма
+        :param clusters: кластеры
+        :return: картинки PNG в порядке кластеров
+        """
+        key = self.cache.make_key(self.label_keys[algorithm], config['wordcloud'])
+        return self.wordclouds.get_images(key, algorithm, self.term_indexes[algorithm], clusters)
+
+    def get_keywords(self, algorithm: str, cluster: int, n: Optional[int] = None) -> List[str]:
+        """
+        Ключевые слова кластера по c-TF-IDF
+        :param algorithm: имя алгоритма
+        :param cluster: номер кластера
+        :param n: количество слов
+        """
+        return self.term_indexes[algorithm].keywords(cluster, n)
+
+    def get_preprocessor(self) -> TextPreprocessor:
+        """
+        Предобработчик текста с общим кешем лемм
+        """
+        lemma_cache = None
+        if config['lemma_cache']['enabled']:
+            lemma_cache = get_lemma_cache(ROOT_DIR / config['lemma_cache']['path'],
+                                          max_size=config['lemma_cache']['max_size'])
+        return TextPreprocessor(lemma_cache=lemma_cache, **config['preprocessing'])
+
+    def get_clean_corpus(self, youtube: YouTubeApi, url: str, max_comments: int,
+                         n_videos: int) -> Tuple[TokenCorpus, int, np.array, List[str]]:
+        """
+        Потоковое извлечение и очистка комментариев
+        :param youtube: парсер YouTube
+        :param url: url видео-ролика
+        :param max_comments: максимальное число комментариев
+        :param n_videos: число дополнительных видео
+        :return: очищенный корпус, количество сырых комментариев,
+                 индексы исходных комментариев и сырые комментарии
+        """
+        prep = self.get_preprocessor()
+        comments = []
+
+        def pages():
+            # сырые комментарии запоминаются по мере скачивания
+            for page in youtube.iter_comments(url, max_comments=max_comments, n_videos=n_videos):
+                comments.extend(page)
+                yield page
+
+        cleaned_corpus, source_index = join_chunks(prep.iter_clean_text(self.counted_pages(pages())))
+        return cleaned_corpus, prep.n_comments, source_index, comments
+
+    def write_channel_corpus(self, youtube: YouTubeApi, url: str, max_comments: int, n_videos: int,
+                             store: DiskStore) -> None:
+        """
+        Потоковое извлечение и очистка комментариев с записью на диск (режим канала)
+        :param youtube: парсер YouTube
+        :param url: url видео-ролика
+        :param max_comments: максимальное число комментариев
+        :param n_videos: число дополнительных видео
+        :param store: хранилище запуска
+        """
+        prep = self.get_preprocessor()
+        pages = youtube.iter_comments(url, max_comments=max_comments, n_videos=n_videos)
+        store.write_corpus(self.counted_pages(pages), prep.iter_clean_text, lambda: prep.n_comments)
+
+    def counted_pages(self, pages: Iterable[List[str]]) -> Iterator[List[str]]:
+        """
+        Отмечает прогресс скачивания по мере прохождения страниц комментариев
+        :param pages: страницы сырых комментариев
+        :return: те же страницы
+        """
+        n_comments = 0
+        for page in pages:
+            n_comments += len(page)
+            self.progress('fetch', f'скачано {n_comments} комментариев')
+            yield page
+
+    def get_source_comments(self, algorithm: str, cluster: int, n: Optional[int] = None) -> List[str]:
+        """
+        Исходные комментарии кластера
+        :param algorithm: имя алгоритма
+        :param cluster: номер кластера
+        :param n: максимальное количество комментариев
+        :return: список сырых комментариев
+        """
+        index = self.source_index[np.flatnonzero(self.data[algorithm].to_numpy() == cluster)[:n]]
+        return [self.comments[i] for i in index]
+
+    def get_model_store(self, youtube: YouTubeApi, url: str,
+                        corpus_name: Optional[str] = None) -> Tuple[Optional[ModelStore], Optional[str]]:
+        """
+        Хранилище моделей FastText и имя модели корпуса
+        :param youtube: парсер YouTube (для определения канала)
+        :param url: url видео-ролика
+        :param corpus_name: имя корпуса. По умолчанию модель хранится по id канала
+        :return: хранилище и имя модели или (None, None), если хранилище выключено
+        """
+        store_params = config['fasttext']['store']
+        if not store_params['enabled']:
+            return None, None
+        if corpus_name is None:
+            corpus_name = youtube.get_channel_id_by_video(youtube.extract_video_id_from_url(url))
+        return ModelStore(ROOT_DIR / store_params['path'], mmap=store_params['mmap']), corpus_name
+
+    def get_embeddings(self, cleaned_corpus: TokenCorpus, store: Optional[ModelStore] = None,
+                       corpus_name: Optional[str] = None, out: Optional[np.array] = None,
+                       batch_size: Optional[int] = None) -> Tuple[np.array, List[str]]:
+        """
+        Векторизация текста с дообучением сохраненной модели канала, если она есть
+        :param cleaned_corpus: очищенный корпус
+        :param store: хранилище моделей FastText, None - модель не сохраняется
+        :param corpus_name: имя модели в хранилище
+        :param out: массив для эмбеддингов (файл, отображённый в память)
+        :param batch_size: количество текстов, эмбеддинги которых считаются за раз
+        :return: матрица эмбеддингов и токены модели
+        """
+        model = None
+        ft_params = config['fasttext']['init']
+        if store is not None:
+            max_vocab = config['fasttext']['store']['max_vocab']
+            model = store.load(corpus_name, ft_params)
+            # при дообучении словарь только растёт, поэтому после предела модель обучается заново
+            if model is not None and len(model.wv) >= max_vocab:
+                logging.info(f"Словарь сохраненной модели ({len(model.wv)} токенов) достиг предела "
+                             f"{max_vocab}, модель обучается заново")
+                model = None
+            ft_params = {**ft_params, 'max_final_vocab': max_vocab}
+        epochs = config['fasttext']['train']['warm_epochs' if model is not None else 'epochs']
+
+        emb = Emdedder(dtype=FEATURES_DTYPE)
+        embeddings = emb.get_embeddings_ft(corpus=cleaned_corpus,
+                                           model=model,
+                                           ft_params=ft_params,
+                                           epochs=epochs,
+                                           out=out,
+                                           batch_size=batch_size)
+        logging.info(f"Обучение FastText ({'тёплый' if emb.warm_start else 'холодный'} старт, "
+                     f"эпох: {epochs}): {emb.train_time:.2f} c")
+
+        if store is not None:
+            store.save(corpus_name, emb.model, config['fasttext']['init'])
+            store.log_training(corpus_name, emb.train_time, emb.warm_start, len(cleaned_corpus), epochs)
+        return embeddings, emb.model_tokens
+
+    def cluster_tasks(self) -> Dict[str, Tuple[Callable[[Cluster], Callable], dict]]:
+        """
+        Методы и параметры алгоритмов кластеризации.
+        Метод берётся у переданного Cluster, поэтому объект создаётся только для запускаемых алгоритмов
+        :return: словарь {имя алгоритма: (функция, возвращающая метод объекта Cluster, параметры)}
+        """
+        n_minmax = tuple(config['clusters']['n_minmax'])
+        if self.channel_mode:
+            # на больших данных KMeans обучается по мини-батчам
+            kmeans = (lambda cluster: partial(cluster.minibatch_kmeans_clusters, sample_weight=self.weights),
+                      {'n_minmax': n_minmax, **config['clusters']['minibatch_kmeans']})
+        else:
+            # веса не входят в параметры, так как ключ кеша меток уже зависит от корпуса
+            kmeans = (lambda cluster: partial(cluster.kmeans_clusters, sample_weight=self.weights),
+                      {'n_minmax': n_minmax, **config['clusters']['kmeans']})
+        return {
+            'HDBSCAN': (attrgetter('hdbscan_clusters'), config['clusters']['hdbscan']),
+            'DBSCAN': (attrgetter('dbscan_clusters'), config['clusters']['dbscan']),
+            'Agglomerative': (attrgetter('agglomerative_clusters'), config['clusters']['agglomerative']),
+            'Spectral': (attrgetter('spectral_clusters'), {'n_minmax': n_minmax, **config['clusters']['spectral']}),
+            'KMeans': kmeans,
+        }
@@ -0,0 +1,158 @@
+import copy
+import io
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+from wordcloud import WordCloud
+
+from .stage_cache import StageCache
+from .term_index import TermIndex
+
+
+def render_png(wordcloud: WordCloud, frequencies: Dict[str, int]) -> bytes:
+    """
+    Рисует облако слов в PNG.
+    Функция уровня модуля, чтобы её можно было передать в пул процессов
+    :param wordcloud: настроенный объект WordCloud (не изменяется)
+    :param frequencies: частоты слов
+    :return: картинка PNG
+    """
+    if frequencies:
+        # generate_from_frequencies запоминает раскладку в объекте, поэтому рисуем на копии
+        image = copy.copy(wordcloud).generate_from_frequencies(frequencies).to_image()
+    else:
+        # в кластере нет слов для облака (например, все слова вне словаря FastText)
+        size = (int(wordcloud.width * wordcloud.scale), int(wordcloud.height * wordcloud.scale))
+        image = Image.new(wordcloud.mode, size, wordcloud.background_color)
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def render_batch(wordcloud: WordCloud, frequencies: List[Dict[str, int]]) -> List[bytes]:
+    """
+    Рисует несколько облаков. Задача пула процессов: WordCloud передаётся один раз на порцию облаков
+    :param wordcloud: настроенный объект WordCloud (не изменяется)
+    :param frequencies: частоты слов каждого облака
+    :return: картинки PNG
+    """
+    return [render_png(wordcloud, freq) for freq in frequencies]
+
+
+_pools: Dict[int, ProcessPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+
+def get_render_pool(max_workers: int) -> ProcessPoolExecutor:
+    """
+    Общий на процесс пул отрисовки облаков. Процессы запускаются один раз и через spawn:
+    fork из многопоточного сервера копировал бы захваченные другими потоками блокировки
+    :param max_workers: количество процессов
+    """
+    with _pools_lock:
+        if max_workers not in _pools:
+            _pools[max_workers] = ProcessPoolExecutor(max_workers=max_workers,
+                                                      mp_context=multiprocessing.get_context('spawn'))
+        return _pools[max_workers]
+
+
+def drop_render_pool(max_workers: int) -> None:
+    """
+    Убирает сломанный пул (процесс упал), следующий вызов создаст новый
+    :param max_workers: количество процессов
+    """
+    with _pools_lock:
+        pool = _pools.pop(max_workers, None)
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+
+class WordClouds:
+    def __init__(self, wordcloud: WordCloud, vocab: np.array, cache: Optional[StageCache] = None,
+                 kind: str = 'thread', max_workers: int = 4) -> None:
+        """
+        Облака слов кластеров. Частоты слов берутся из статистики кластеров (TermIndex),
+        без повторной склейки и разбора текста.
+        Картинки кешируются по ключу запуска, алгоритму и кластеру
+        :param wordcloud: настроенный объект WordCloud (его стоп-слова исключаются из частот)
+        :param vocab: словарь токенов корпуса
+        :param cache: дисковый кеш картинок
+        :param kind: пул для отрисовки облаков: thread или process (общий пул процессов spawn)
+        :param max_workers: количество параллельно рисуемых облаков
+        """
+        self.wordcloud = wordcloud
+        # стоп-слова уже учтены в частотах (allowed), без них объект легче передавать в процессы
+        self.render_wordcloud = copy.copy(wordcloud)
+        self.render_wordcloud.stopwords = set()
+        self.cache = cache
+        self.kind = kind
+        self.max_workers = max_workers
+        # картинки текущего сеанса, чтобы не читать их с диска при каждой перерисовке страницы
+        self.images: Dict[Tuple[str, str, int], bytes] = {}
+
+        # слова, которые WordCloud.generate отбросил бы при разборе текста
+        stopwords = {word.lower() for word in wordcloud.stopwords}
+        min_length = max(wordcloud.min_word_length, 2)
+        self.allowed = np.array([len(word) >= min_length and word.lower() not in stopwords
+                                 and (wordcloud.include_numbers or not word.isdigit())
+                                 for word in vocab.tolist()], dtype=bool)
+
+    def render(self, frequencies: List[Dict[str, int]]) -> List[bytes]:
+        """
+        Рисует облака параллельно
+        :param frequencies: частоты слов каждого облака
+        :return: картинки PNG
+        """
+        if len(frequencies) <= 1 or self.max_workers <= 1:
+            return render_batch(self.render_wordcloud, frequencies)
+        if self.kind != 'process':
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(frequencies))) as executor:
+                return list(executor.map(render_png, [self.render_wordcloud] * len(frequencies), frequencies))
+
+        # по одной порции облаков на процесс
+        step = -(-len(frequencies) // self.max_workers)
+        batches = [frequencies[i:i + step] for i in range(0, len(frequencies), step)]
+        try:
+            pool = get_render_pool(self.max_workers)
+            images = pool.map(render_batch, [self.render_wordcloud] * len(batches), batches)
+            return [image for batch in images for image in batch]
+        except BrokenProcessPool:
+            logging.exception("Пул отрисовки облаков слов сломан, облака рисуются в текущем процессе")
+            drop_render_pool(self.max_workers)
+            return render_batch(self.render_wordcloud, frequencies)
+
+    def get_images(self, key: str, algorithm: str, index: TermIndex, clusters: List[int]) -> List[bytes]:
+        """
+        Облака слов кластеров из кеша, недостающие рисуются
+        :param key: ключ запуска (меток алгоритма и настроек облака)
+        :param algorithm: имя алгоритма
+        :param index: статистика слов кластеров алгоритма
+        :param clusters: кластеры
+        :return: картинки PNG в порядке кластеров
+        """
+        clusters = [int(cluster) for cluster in clusters]
+        cache_keys = {cluster: StageCache.make_key(key, algorithm, cluster) for cluster in clusters}
+        for cluster in clusters:
+            if (key, algorithm, cluster) not in self.images and self.cache is not None:
+                image = self.cache.get('wordcloud', cache_keys[cluster])
+                if image is not None:
+                    self.images[key, algorithm, cluster] = image
+
+        missing = [cluster for cluster in clusters if (key, algorithm, cluster) not in self.images]
+        if missing:
+            start = time.perf_counter()
+            images = self.render([index.frequencies(cluster, self.allowed, self.wordcloud.max_words)
+                                  for cluster in missing])
+            for cluster, image in zip(missing, images):
+                self.images[key, algorithm, cluster] = image
+                if self.cache is not None:
+                    self.cache.set('wordcloud', cache_keys[cluster], image)
+            logging.info(f"Облака слов {algorithm} ({len(missing)} шт.): {time.perf_counter() - start:.2f} c")
+        return [self.images[key, algorithm, cluster] for cluster in clusters]
@@ -1,18 +1,234 @@
-from typing import List
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import List, Optional, Callable, Any, Iterator, Tuple
 from urllib.parse import urlparse, parse_qs
 
 import pyyoutube
+import requests
+from requests.adapters import HTTPAdapter
+
+from topics import CommentArchive
 
 
 class YouTubeApi:
     VALID_HOSTNAMES = ('youtu.be', 'www.youtube.com', 'youtube.com')
+    # коды ответа, при которых запрос повторяется
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+    # максимум комментариев на одной странице ответа API
+    PAGE_SIZE = 100
 
-    def __init__(self, youtube_api_key: str) -> None:
+    def __init__(self, youtube_api_key: Optional[str], max_workers: int = 8, retries: int = 3,
+                 backoff: float = 1.0, base_url: Optional[str] = None,
+                 archive: Optional[CommentArchive] = None, max_age: float = 86400,
+                 offline: bool = False, prefetch_pages: int = 10) -> None:
         """
         Инициализация парсера t
         :param youtube_api_key: ключ полученный на официальном сайте google cloud
+        :param max_workers: максимум одновременных запросов к API
+        :param retries: количество повторов запроса при превышении квоты или ошибке сервера
+        :param backoff: начальная задержка между повторами в секундах, удваивается с каждым повтором
+        :param base_url: адрес API (например, локальной заглушки для тестов)
+        :param archive: локальный архив комментариев
+        :param max_age: через сколько секунд комментарии видео в архиве нужно обновить
+        :param offline: флаг - брать данные только из архива, без обращений к API
+        :param prefetch_pages: сколько страниц каждого видео скачивается заранее,
+               пока обработка не дошла до этого видео
+        """
+        if offline and archive is None:
+            raise ValueError('Для работы без API нужен архив комментариев')
+        self.archive = archive
+        self.max_age = max_age
+        self.offline = offline
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.prefetch_pages = prefetch_pages
+
+        self.api = None
+        if not offline:
+            self.api = pyyoutube.Api(api_key=youtube_api_key)
+            if base_url is not None:
+                self.api.BASE_URL = base_url
+            # общий пул соединений для всех потоков
+            adapter = HTTPAdapter(pool_maxsize=max_workers)
+            self.api.session.mount('https://', adapter)
+            self.api.session.mount('http://', adapter)
+
+    def is_retryable(self, error: Exception) -> bool:
+        """
+        Проверяет, имеет ли смысл повторить запрос после ошибки
+        :param error: ошибка запроса
+        """
+        if isinstance(error, pyyoutube.PyYouTubeException):
+            message = (error.message or '').lower()
+            return error.status_code in self.RETRY_STATUS_CODES \
+                or (error.status_code == 403 and ('quota' in message or 'rate limit' in message))
+        # обрыв соединения или ответ сервера не в формате json
+        return isinstance(error, (requests.ConnectionError, requests.Timeout, ValueError))
+
+    def call_with_retry(self, func: Callable, **kwargs) -> Any:
+        """
+        Вызывает метод API, повторяя запрос с экспоненциальной задержкой
+        :param func: метод pyyoutube.Api
+        :return: ответ API
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return func(**kwargs)
+            except Exception as e:
+                if attempt == self.retries or not self.is_retryable(e):
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def iter_comment_threads(self, video_id: str, max_comments: int, order: str,
+                             page_token: Optional[str] = None) -> Iterator[Tuple[list, Optional[str]]]:
+        """
+        Постранично извлекает ветки комментариев под видео из API.
+        Каждая страница повторяется отдельно, поэтому сбой не перезапрашивает уже полученные
+        :param video_id: id видео
+        :param max_comments: максимальное число комментариев для парсинга
+        :param order: порядок полученных комментариев у API YouTube
+        :param page_token: токен страницы, с которой начать (продолжение прерванной загрузки)
+        return: страницы веток комментариев по мере получения и токены следующих страниц
+        """
+        remaining = max_comments
+        while remaining > 0:
+            limit = min(remaining, self.PAGE_SIZE)
+            try:
+                comments = self.call_with_retry(self.api.get_comment_threads,
+                                                video_id=video_id,
+                                                count=limit,
+                                                limit=limit,
+                                                order=order,
+                                                page_token=page_token)
+            except pyyoutube.PyYouTubeException as e:
+                # повторы не помогли: загрузку можно продолжить позже с этой страницы
+                if self.is_retryable(e):
+                    raise
+                # учитываем скрытые комментарии
+                return
+            remaining -= len(comments.items)
+            page_token = comments.nextPageToken
+            yield comments.items, page_token
+            if not comments.items or not page_token:
+                return
+
+    @staticmethod
+    def thread_comments(items: list) -> List[Tuple[str, str, str]]:
+        """
+        Комментарии верхнего уровня из веток для архива
+        :param items: ветки комментариев
+        :return: список (id комментария, текст, время публикации)
+        """
+        return [(item.snippet.topLevelComment.id,
+                 item.snippet.topLevelComment.snippet.textDisplay,
+                 item.snippet.topLevelComment.snippet.publishedAt) for item in items]
+
+    def fetch_listing(self, video_id: str, max_comments: int, order: str,
+                      fetched: int = 0, page_token: Optional[str] = None) -> Iterator[List[Tuple[str, str, str]]]:
+        """
+        Скачивает в архив выдачу API в порядке order. После каждой страницы архив
+        запоминает токен следующей, поэтому оборвавшаяся загрузка продолжается с места сбоя,
+        а при запросе большего числа комментариев выдача докачивается
+        :param video_id: id видео
+        :param max_comments: сколько комментариев выдачи должно быть в архиве
+        :param order: порядок полученных комментариев у API YouTube
+        :param fetched: сколько комментариев выдачи уже скачано
+        :param page_token: токен страницы, с которой продолжить
+        return: комментарии каждой страницы после её записи в архив
+        """
+        start_token, n_pages = page_token, 0
+        for items, page_token in self.iter_comment_threads(video_id, max_comments - fetched, order, page_token):
+            fetched += len(items)
+            n_pages += 1
+            comments = self.thread_comments(items)
+            self.archive.add_page(video_id, comments, order, fetched, page_token)
+            yield comments
+        if n_pages:
+            return
+        if start_token is not None:
+            # токен прошлой загрузки устарел: выдача скачивается заново
+            yield from self.fetch_listing(video_id, max_comments, order)
+        else:
+            # комментарии скрыты: запоминаем пустую выдачу, чтобы не запрашивать её снова
+            self.archive.add_page(video_id, [], order, 0, None)
+
+    def needs_backfill(self, video_id: str, max_comments: int, order: str) -> bool:
+        """
+        Проверяет, что выдачи API в порядке order в архиве меньше, чем нужно:
+        она не скачивалась или скачана не до конца и короче max_comments
+        :param video_id: id видео
+        :param max_comments: максимальное число комментариев для парсинга
+        :param order: порядок полученных комментариев у API YouTube
         """
-        self.api = pyyoutube.Api(api_key=youtube_api_key)
+        listing = self.archive.listing(video_id, order)
+        return listing is None or (listing[1] is not None and listing[0] < max_comments)
+
+    def refresh_archive(self, video_id: str, max_comments: int, order: str, stale: bool = True) -> None:
+        """
+        Докачивает в архив выдачу API в порядке order, если её не хватает
+        (в том числе продолжает прерванную загрузку со страницы сбоя).
+        Устаревшее видео дополняется комментариями новее последнего сохраненного
+        :param video_id: id видео
+        :param max_comments: максимальное число комментариев для парсинга
+        :param order: порядок полученных комментариев у API YouTube
+        :param stale: флаг - комментарии видео в архиве устарели
+        """
+        # для видео, которое ещё не скачивалось до конца, новые комментарии придут с его выдачей
+        last_published = None
+        if self.archive.refreshed_at(video_id) is not None:
+            last_published = self.archive.last_published(video_id)
+        if self.needs_backfill(video_id, max_comments, order):
+            listing = self.archive.listing(video_id, order)
+            # страницы записываются в архив по мере получения
+            for _ in self.fetch_listing(video_id, max_comments, order, *(listing or ())):
+                pass
+
+        if stale and last_published is not None:
+            # самые новые комментарии идут первыми
+            for items, _ in self.iter_comment_threads(video_id, max_comments, 'time'):
+                comments = self.thread_comments(items)
+                new_comments = [comment for comment in comments if comment[2] >= last_published]
+                self.archive.add_comments(video_id, new_comments)
+                # дошли до уже сохраненных комментариев
+                if len(new_comments) < len(comments):
+                    break
+        if stale:
+            self.archive.mark_refreshed(video_id)
+
+    def iter_comments_by_video(self, video_id: str, max_comments: int, order: str) -> Iterator[List[str]]:
+        """
+        Постранично извлекает комментарии под видео.
+        При наличии архива комментарии читаются из него, а из API докачиваются только новые
+        и недостающие в запрошенном порядке. Видео, которого ещё нет в архиве,
+        отдаётся постранично во время загрузки
+        :param video_id: id видео
+        :param max_comments: максимальное число комментариев для парсинга
+        :param order: порядок полученных комментариев у API YouTube
+        return: страницы комментариев по мере получения
+        """
+        if self.archive is None:
+            for items, _ in self.iter_comment_threads(video_id, max_comments, order):
+                yield [item.snippet.topLevelComment.snippet.textDisplay for item in items]
+            return
+
+        refreshed_at = self.archive.refreshed_at(video_id)
+        if not self.offline and refreshed_at is None and self.archive.listing(video_id, order) is None:
+            # видео скачивается впервые: страницы отдаются по мере записи в архив,
+            # обработка идёт параллельно загрузке
+            for comments in self.fetch_listing(video_id, max_comments, order):
+                yield [text for _, text, _ in comments]
+            self.archive.mark_refreshed(video_id)
+            return
+
+        stale = refreshed_at is None or time.time() - refreshed_at > self.max_age
+        # больше комментариев или другой порядок докачиваются, даже если архив свежий
+        if not self.offline and (stale or self.needs_backfill(video_id, max_comments, order)):
+            self.refresh_archive(video_id, max_comments, order, stale)
+        yield from self.archive.iter_comments(video_id, max_comments, self.PAGE_SIZE, order)
 
     def extract_comments_by_video(self, video_id: str, max_comments: int, order: str) -> List[str]:
         """
@@ -22,15 +238,58 @@ class YouTubeApi:
         :param order: порядок полученных комментариев у API YouTube
         return: список комментариев под видео
         """
-        try:
-            comments = self.api.get_comment_threads(video_id=video_id,
-                                                    count=max_comments,
-                                                    limit=max_comments,
-                                                    order=order)
-            return [item.snippet.topLevelComment.snippet.textDisplay for item in comments.items]
-        except pyyoutube.PyYouTubeException:
-            # учитываем скрытые комментарии
-            return []
+        return list(chain.from_iterable(self.iter_comments_by_video(video_id, max_comments, order)))
+
+    def iter_comments_by_list_of_video(self, video_ids: list, max_comments: int,
+                                       order: str) -> Iterator[List[str]]:
+        """
+        Постранично извлекает комментарии из каждого видео в списке.
+        Видео скачиваются параллельно, страницы отдаются в порядке video_ids
+        :param video_ids: список id видео
+        :param max_comments: максимальное число комментариев для парсинга
+        :param order: порядок полученных комментариев у API YouTube
+        return: страницы комментариев по мере получения
+        """
+        # загрузка видео идёт вперёд не больше чем на prefetch_pages страниц
+        pages = [queue.Queue(maxsize=self.prefetch_pages) for _ in video_ids]
+        stop = threading.Event()
+
+        def put(video_pages: queue.Queue, page: Optional[List[str]]) -> bool:
+            # ждём места в очереди, пока потребитель не остановился
+            while not stop.is_set():
+                try:
+                    video_pages.put(page, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def fetch(video_id: str, video_pages: queue.Queue) -> None:
+            # потребитель уже остановился: видео не запрашивается
+            if stop.is_set():
+                return
+            try:
+                for page in self.iter_comments_by_video(video_id, max_comments, order):
+                    if not put(video_pages, page):
+                        return
+            finally:
+                # признак конца видео
+                put(video_pages, None)
+
+        # не больше max_workers запросов одновременно
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(fetch, video_id, video_pages)
+                       for video_id, video_pages in zip(video_ids, pages)]
+            try:
+                for future, video_pages in zip(futures, pages):
+                    yield from iter(video_pages.get, None)
+                    # пробрасываем ошибку загрузки видео
+                    future.result()
+            finally:
+                # потребитель остановился или упал: загрузки завершаются, а не ждут места в очереди,
+                # ещё не начатые отменяются
+                stop.set()
+                executor.shutdown(cancel_futures=True)
 
     def extract_comments_by_list_of_video(self, video_ids: list, max_comments: int,
                                           order: str) -> List[List[str]]:
@@ -39,9 +298,12 @@ class YouTubeApi:
         :param video_ids: список id видео
         :param max_comments: максимальное число комментариев для парсинга
         :param order: порядок полученных комментариев у API YouTube
-        return: список списков комментариев под видео
+        return: список списков комментариев под видео в порядке video_ids
         """
-        return [self.extract_comments_by_video(video_id, max_comments, order) for video_id in video_ids]
+        # не больше max_workers запросов одновременно, map сохраняет порядок видео
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(lambda video_id: self.extract_comments_by_video(video_id, max_comments, order),
+                                     video_ids))
 
     def get_channel_id_by_video(self, video_id: str) -> str:
         """
@@ -49,8 +311,18 @@ class YouTubeApi:
         :param video_id: id видео у которого извлекаем канал
         :return: id канала
         """
-        video_by_id = self.api.get_video_by_id(video_id=video_id)
-        return video_by_id.items[0].snippet.channelId
+        if self.archive is not None:
+            channel_id = self.archive.get_channel(video_id)
+            if channel_id is not None:
+                return channel_id
+            if self.offline:
+                raise ValueError('Канал видео отсутствует в архиве')
+
+        video_by_id = self.call_with_retry(self.api.get_video_by_id, video_id=video_id)
+        channel_id = video_by_id.items[0].snippet.channelId
+        if self.archive is not None:
+            self.archive.set_channel(video_id, channel_id)
+        return channel_id
 
     def get_video_id_by_channel(self, channel_id: str, n_videos: int, video_id: str) -> List[str]:
         """
@@ -60,6 +332,8 @@ class YouTubeApi:
         :param video_id: id ролика, который включить в итоговый результат
         :return: список из id видео-роликов
         """
+        if self.offline:
+            return self.archive.channel_videos(channel_id, n_videos, video_id)
 
         # начальные условия
         video_ids = [video_id]
@@ -68,11 +342,12 @@ class YouTubeApi:
 
         while n < n_videos:
             # получаем активности на канале
-            activities = self.api.get_activities_by_channel(channel_id=channel_id,
-                                                            page_token=page_token,
-                                                            count=n_videos,
-                                                            limit=n_videos,
-                                                            )
+            activities = self.call_with_retry(self.api.get_activities_by_channel,
+                                              channel_id=channel_id,
+                                              page_token=page_token,
+                                              count=n_videos,
+                                              limit=n_videos,
+                                              )
             # вычленяем id видео из активностей связанные с загрузкой видео
             list_video = [item.contentDetails.upload.videoId for item in activities.items
                           if item.snippet.type == 'upload']
@@ -86,7 +361,11 @@ class YouTubeApi:
             if not page_token:
                 break
 
-        return video_ids[:n_videos]
+        video_ids = video_ids[:n_videos]
+        if self.archive is not None:
+            for v in video_ids:
+                self.archive.set_channel(v, channel_id)
+        return video_ids
 
     def extract_video_id_from_url(self, url: str) -> str:
         """
@@ -111,16 +390,16 @@ class YouTubeApi:
             video_id = video_id[0]
         return video_id
 
-    def get_comments(self, url: str, max_comments: int = 100, n_videos: int = 0,
-                     order_comments: str = 'relevance') -> List[str]:
+    def iter_comments(self, url: str, max_comments: int = 100, n_videos: int = 0,
+                      order_comments: str = 'relevance') -> Iterator[List[str]]:
         """
-        Главная функция по извлечению комментариев.
+        Постранично извлекает комментарии по мере их получения.
         :param url: ссылка на видео
         :param max_comments: лимит по количеству комментариев
         :param n_videos: количество дополнительных видео с того же канала что и на переданной ссылке.
                n_videos=0 - если учитывать только видео по ссылке.
         :param order_comments: порядок полученных комменатриев через API
-        :return: список комменатриев
+        :return: страницы комментариев
         """
         # получаем id видео
         video_id = self.extract_video_id_from_url(url)
@@ -136,11 +415,22 @@ class YouTubeApi:
                                                      video_id=video_id,
                                                      )
             # извлекаем комменарии
-            comments = self.extract_comments_by_list_of_video(video_ids=video_ids,
-                                                              max_comments=max_comments,
-                                                              order=order_comments,
-                                                              )
-            return sum(comments, [])
-
+            yield from self.iter_comments_by_list_of_video(video_ids=video_ids,
+                                                           max_comments=max_comments,
+                                                           order=order_comments,
+                                                           )
         else:
-            return self.extract_comments_by_video(video_id, max_comments, order_comments)
+            yield from self.iter_comments_by_video(video_id, max_comments, order_comments)
+
+    def get_comments(self, url: str, max_comments: int = 100, n_videos: int = 0,
+                     order_comments: str = 'relevance') -> List[str]:
+        """
+        Главная функция по извлечению комментариев.
+        :param url: ссылка на видео
+        :param max_comments: лимит по количеству комментариев
+        :param n_videos: количество дополнительных видео с того же канала что и на переданной ссылке.
+               n_videos=0 - если учитывать только видео по ссылке.
+        :param order_comments: порядок полученных комменатриев через API
+        :return: список комменатриев
+        """
+        return list(chain.from_iterable(self.iter_comments(url, max_comments, n_videos, order_comments)))
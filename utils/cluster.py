@@ -1,114 +1,146 @@
-from typing import Optional, List
+from typing import Optional, Tuple
 
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-import streamlit as st
-from wordcloud import WordCloud
 
 from loader import NOISE, NOISE_NAME, NOISE_COLOR
+from utils.ui_cache import ui_cache
 
 
-# кеш не ставить на plot_wc!!!!!!
-# бесконечно считает функцию
+# режимы детализации трехмерного графика
+PLOT_MODES = {'sample': 'Выборка', 'voxels': 'Вокселы', 'all': 'Все точки'}
 
-def create_wc_for_one_cluster(cloud: np.array) -> plt.Figure:
+
+def stratified_index(labels: np.array, max_points: int, min_points: int = 50,
+                     random_state: int = 7) -> np.array:
     """
-    Создаёт облако слов
-    :param cloud: данные для отрисовки картинки
+    Стратифицированная по кластерам выборка точек для графика.
+    Кластер представлен пропорционально размеру, но не менее чем min_points точками
+    :param labels: метки кластеров
+    :param max_points: бюджет точек
+    :param min_points: минимум точек маленького кластера
+    :param random_state: зерно выборки
+    :return: отсортированные индексы выборки
     """
-    fig, ax = plt.subplots(figsize=(12, 5))
-    ax.imshow(cloud, interpolation='bilinear')
-    ax.axis("off")
-    return fig
-
-
-def create_wc_for_all_clusters(text_corpus: np.array, labels: np.array,
-                               unique_clusters: np.array, wc: WordCloud) -> List[plt.Figure]:
+    n = len(labels)
+    if n <= max_points:
+        return np.arange(n)
+    rng = np.random.default_rng(random_state)
+    _, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    quotas = np.minimum(counts, np.maximum(np.round(counts * max_points / n).astype(int), min_points))
+    # точки в случайном порядке, сгруппированные по кластерам
+    order = rng.permutation(n)
+    order = order[np.argsort(inverse[order], kind='stable')]
+    ranks = np.arange(n) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.sort(order[ranks < np.repeat(quotas, counts)])
+
+
+def voxel_aggregate(points: np.array, labels: np.array, voxels: int) -> Tuple[np.array, np.array, np.array]:
     """
-    Создаёт список из графиков для каждого кластера
-    :param text_corpus: очищенный корпус текстов
+    Схлопывает точки одного кластера в одной ячейке сетки voxels^3 в центроид
+    :param points: координаты точек
     :param labels: метки кластеров
-    :param unique_clusters: уникальноые кластеры
-    :param wc: объект WordCloud
-    :return:
+    :param voxels: количество ячеек по каждой оси
+    :return: центроиды, их кластеры и количество точек в них
+    """
+    low = points.min(axis=0)
+    span = np.maximum(points.max(axis=0) - low, np.finfo(np.float32).eps)
+    cells = np.minimum(((points - low) / span * voxels).astype(np.int64), voxels - 1)
+    clusters, codes = np.unique(labels, return_inverse=True)
+    cell_ids = ((cells[:, 0] * voxels + cells[:, 1]) * voxels + cells[:, 2]) * len(clusters) + codes
+    cell_ids, inverse, counts = np.unique(cell_ids, return_inverse=True, return_counts=True)
+    centroids = np.stack([np.bincount(inverse, weights=points[:, i], minlength=len(cell_ids))
+                          for i in range(points.shape[1])], axis=1) / counts[:, None]
+    return centroids, clusters[cell_ids % len(clusters)], counts
+
+
+def discrete_colorscale(clusters: np.array, color_discrete_map: Optional[dict]) -> list:
     """
-    figs = []
-    for cluster in unique_clusters:
-        try:
-            text_sample = ' '.join(text_corpus[labels == cluster])
-            cloud = wc.generate(text_sample)
-            fig = create_wc_for_one_cluster(cloud)
-            figs.append(fig)
-        except Exception:
-            # ошибка что нет слов для облака возникает возможно из-за того что модель FastText
-            # не рассматривает слова с указанной малой частотой
-            fig, ax = plt.subplots(figsize=(12, 5))
-            ax.axis("off")
-            figs.append(fig)
-    return figs
-
-
-@st.cache(max_entries=30, ttl=3600)
-def plot_3d(df: pd.DataFrame,
+    Ступенчатая шкала цветов для числовых меток кластеров от clusters.min() до clusters.max()
+    :param clusters: кластеры
+    :param color_discrete_map: словарь с цветами для кластеров
+    :return: colorscale plotly, метке v соответствует середина её ступени при cmin=min-0.5, cmax=max+0.5
+    """
+    color_discrete_map = color_discrete_map or {}
+    values = range(int(clusters.min()), int(clusters.max()) + 1)
+    colorscale = []
+    for i, value in enumerate(values):
+        color = color_discrete_map.get(str(value), NOISE_COLOR)
+        colorscale += [[i / len(values), color], [(i + 1) / len(values), color]]
+    return colorscale
+
+
+@ui_cache(max_entries=30, ttl=3600)
+def plot_3d(_df: pd.DataFrame,
+            key: str,
             x='x',
             y='y',
             z='z',
             color: Optional[str] = None,
-            color_discrete_map: Optional[dict] = None) -> go.Figure:
+            color_discrete_map: Optional[dict] = None,
+            mode: str = 'sample',
+            max_points: int = 20000,
+            min_points: int = 50,
+            voxels: int = 40) -> Tuple[go.Figure, int]:
     """
-    Создаёт трехмерную визуализацию
-    :param df: таблица с данными с обязательными колонками x, y, z
+    Создаёт трехмерную визуализацию.
+    Кластеры рисуются одним следом с числовым цветом точек, шум - отдельным следом
+    :param _df: таблица с данными с обязательными колонками x, y, z
+    :param key: ключ данных таблицы (Topics.umap_key или ключ меток алгоритма)
     :param x: размерность x
     :param y: размерность y
     :param z: размерность z
     :param color: имя колонки кластеров
     :param color_discrete_map: словарь с цветами для кластеров
-    :return: figure plotly
+    :param mode: детализация из PLOT_MODES: sample - стратифицированная выборка max_points точек,
+           voxels - точки кластера в ячейке сетки схлопываются в одну, all - все точки
+    :param max_points: бюджет точек выборки
+    :param min_points: минимум точек маленького кластера в выборке
+    :param voxels: количество ячеек сетки по каждой оси
+    :return: figure plotly и размер сериализованного графика в байтах
     """
-    # если передан цвет (кластеры)
-
+    points = _df[[x, y, z]].to_numpy(dtype=np.float32)
+    labels = _df[color].to_numpy() if color is not None else np.zeros(len(_df), dtype=np.int8)
+    counts = None
+    if mode == 'sample':
+        index = stratified_index(labels, max_points, min_points)
+        points, labels = points[index], labels[index]
+    elif mode == 'voxels':
+        points, labels, counts = voxel_aggregate(points, labels, voxels)
+    # лишние знаки координат только раздувают json графика
+    points = np.round(points, 3)
+
+    def trace(mask: np.array, marker: dict, hover: str, name: str) -> go.Scatter3d:
+        marker = dict(marker)
+        customdata = None
+        if counts is not None:
+            # размер точки растёт с количеством схлопнутых в неё комментариев
+            marker['size'] = np.round(3 + 9 * np.log1p(counts[mask]) / np.log1p(counts.max()), 1)
+            customdata = counts[mask]
+            hover += '<br>Комментариев: %{customdata}'
+        return go.Scatter3d(x=points[mask, 0], y=points[mask, 1], z=points[mask, 2],
+                            mode='markers', marker=marker, customdata=customdata, name=name,
+                            hovertemplate=hover + '<extra></extra>')
+
+    noise = labels == NOISE if color is not None else np.zeros(len(labels), dtype=bool)
+    data = []
     if color is not None:
-        # строковый тип нужен для дискретного отображения кластеров plotly
-        df_ = df.copy()
-        df_.loc[:, color] = df_[color].astype(str)
-        # color_discrete_map = {str(k): v for k, v in color_discrete_map.items()}
-        # Разделяем на два графика чтобы прозрачность кластера Шума регулироовать, другое решение?
-        fig_outlier = None
-        df_outlier = df_[df_[color] == str(NOISE)]
-        df_norm = df_[df_[color] != str(NOISE)]
+        clusters = np.unique(labels[~noise])
+        if len(clusters):
+            marker = dict(color=labels[~noise],
+                          colorscale=discrete_colorscale(clusters, color_discrete_map),
+                          cmin=clusters.min() - 0.5, cmax=clusters.max() + 0.5,
+                          colorbar=dict(title='Кластер', tickvals=clusters, len=0.7))
+            data.append(trace(~noise, marker, 'Кластер %{marker.color}', 'Кластеры'))
         # отрисовываем выбросы если есть
-        if df_outlier.shape[0]:
-            fig_outlier = px.scatter_3d(df_outlier,
-                                        x=x,
-                                        y=y,
-                                        z=z,
-                                        opacity=.4,
-                                        color_discrete_sequence=[NOISE_COLOR],
-                                        hover_name=[NOISE_NAME] * len(df_outlier),
-                                        )
-
-        # отрисовываем кластеры
-        fig = px.scatter_3d(df_norm,
-                            x=x,
-                            y=y,
-                            z=z,
-                            color=color,
-                            labels={color: 'Кластер'},
-                            color_discrete_map=color_discrete_map,
-                            )
-
-        # если есть выбросы объединяем данные
-        data = fig.data
-        if fig_outlier is not None:
-            data = data + fig_outlier.data
-
-        fig = go.Figure(data=data)
+        if noise.any():
+            data.append(trace(noise, dict(color=NOISE_COLOR, opacity=.4), NOISE_NAME, NOISE_NAME))
     else:
-        fig = px.scatter_3d(df, x=x, y=y, z=z)
+        data.append(trace(~noise, dict(color=px.colors.qualitative.Plotly[0]), 'Комментарий', 'Комментарии'))
 
+    fig = go.Figure(data=data)
     fig.update_layout(legend=dict(
         orientation="v",
         yanchor="top",
@@ -117,23 +149,30 @@ def plot_3d(df: pd.DataFrame,
         x=1,
         title_text='Кластеры:',
     ))
-    return fig
+    return fig, len(fig.to_json())
 
 
-@st.cache(max_entries=30, ttl=3600)
-def pie_clusters_size(data: pd.DataFrame,
+@ui_cache(max_entries=30, ttl=3600)
+def pie_clusters_size(_data: pd.DataFrame,
+                      key: str,
                       algorithm: str,
                       color_discrete_map: Optional[dict] = None
                       ) -> go.Figure:
     """
     Отрисовывает круговую диаграму размеров кластеров
-    :param data: таблица с данными
+    :param _data: таблица с данными
+    :param key: ключ меток алгоритма
     :param algorithm: имя колонки кластеров
     :param color_discrete_map: словарь с цветами для кластеров
     :return: figure plotly
     """
     # Считаем количество комментариев в каждом кластере
-    df_pie = data[algorithm].value_counts().reset_index()
+    # с учётом схлопнутых почти одинаковых комментариев
+    if 'weight' in _data:
+        counts = _data.groupby(algorithm)['weight'].sum().sort_values(ascending=False)
+    else:
+        counts = _data[algorithm].value_counts()
+    df_pie = pd.DataFrame({'index': counts.index, algorithm: counts.to_numpy()})
     # Меняем имя кластера шума
     df_pie['index'] = df_pie['index'].where(df_pie['index'] != NOISE, NOISE_NAME)
     # приводим к строковому типу для идентификации с color_discrete_map
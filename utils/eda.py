@@ -1,23 +1,27 @@
-from collections import Counter
-from typing import List, Tuple
+from typing import Tuple
 
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-import streamlit as st
 
+from topics.corpus import TokenCorpus
 from utils.tool import remove_outlier_sigma
+from utils.ui_cache import ui_cache
 
 
-@st.cache(max_entries=10, ttl=3600)
-def plot_token_count(filtered_tokenized_text: List[List[str]]) -> Tuple[int, go.Figure]:
+@ui_cache(max_entries=10, ttl=3600)
+def plot_token_count(_filtered_tokenized_text: TokenCorpus, key: str) -> Tuple[int, go.Figure]:
     """
     Создаёт график количества популярных токенов
-    :param filtered_tokenized_text: очищенный, токенизированный текст
+    :param _filtered_tokenized_text: очищенный, токенизированный текст
+    :param key: ключ корпуса (Topics.corpus_key)
     :return: figure plotly
     """
-    count = Counter(sum(filtered_tokenized_text, []))
-    df_count = pd.DataFrame(count.most_common(50), columns=['Токен', 'Частота']).reset_index()
+    tokens, counts = _filtered_tokenized_text.token_counts()
+    # 50 самых частых, при равной частоте - в порядке появления, как Counter.most_common
+    top = np.argsort(-counts, kind='stable')[:50]
+    df_count = pd.DataFrame({'Токен': tokens[top], 'Частота': counts[top]}).reset_index()
     fig = px.bar(df_count.sort_values('Частота'),
                  y='Токен',
                  x='Частота',
@@ -30,18 +34,18 @@ def plot_token_count(filtered_tokenized_text: List[List[str]]) -> Tuple[int, go.
                       # title_text='Топ 50 частых токенов',
                       height=900)
     fig.update_coloraxes(showscale=False)
-    return len(count), fig
+    return len(tokens), fig
 
 
-@st.cache(max_entries=10, ttl=3600)
-def plot_tokens_distribution(filtered_tokenized_text: List[List[str]]) -> go.Figure:
+@ui_cache(max_entries=10, ttl=3600)
+def plot_tokens_distribution(_filtered_tokenized_text: TokenCorpus, key: str) -> go.Figure:
     """
     Создаёт график распределения комментариев по длине
-    :param filtered_tokenized_text: очищенный, токенизированный текст
+    :param _filtered_tokenized_text: очищенный, токенизированный текст
+    :param key: ключ корпуса (Topics.corpus_key)
     :return: figure plotly
     """
-    df_tokens = pd.DataFrame({'tokens': filtered_tokenized_text})
-    df_tokens['len'] = df_tokens['tokens'].apply(len)
+    df_tokens = pd.DataFrame({'len': _filtered_tokenized_text.lengths()})
 
     df_sigma = remove_outlier_sigma(df_tokens, 'len')
 
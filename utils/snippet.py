@@ -1,27 +1,122 @@
 
+import time
+from typing import List, Optional, Tuple
+
 import numpy as np
 import plotly.express as px
 import streamlit as st
 
-from loader import VALID_ALGORITHM, NOISE, NOISE_NAME
+from loader import VALID_ALGORITHM, NOISE, NOISE_NAME, config
 from topics import Topics
-from utils.cluster import plot_3d, pie_clusters_size, create_wc_for_all_clusters
+from topics.jobs import Job, get_job_runner
+from topics.stage_cache import StageCache
+from topics.topics import STAGES
+from utils.cluster import plot_3d, pie_clusters_size, PLOT_MODES
 from utils.tool import get_color_map
 
 
-@st.cache(max_entries=20, ttl=3600)
-def get_topics(url: str, max_comments: int, n_videos: int, yotube_api_key: str) -> Topics:
+def submit_topics(url: str, max_comments: int, n_videos: int, yotube_api_key: str,
+                  algorithms: Tuple[str, ...] = tuple(VALID_ALGORITHM)) -> str:
     """
-    Запускаем весь процесс моделирования топиков
+    Ставит моделирование топиков в фоновую очередь.
+    Одинаковые запуски объединяются в одну задачу, готовый результат переиспользуется
     :param url: url-видео
     :param max_comments: максимум комментов
     :param n_videos: макисмум доп. видео
     :param yotube_api_key: ключ API YouTube
-    :return: экземпляр Topics с результатами моделирования
+    :param algorithms: алгоритмы кластеризации, которые запустить сразу
+    :return: номер задачи
+    """
+    def run(progress) -> Topics:
+        top = Topics(yotube_api_key)
+        top.generate_topics(url, max_comments, n_videos, algorithms=list(algorithms), progress=progress)
+        return top
+
+    key = StageCache.make_key(url, max_comments, n_videos, sorted(algorithms))
+    title = f'{url} (комментариев: {max_comments}, доп. видео: {n_videos})'
+    return get_job_runner(**config['jobs']['runner']).submit(key, run, title=title)
+
+
+def get_job() -> Optional[Job]:
+    """
+    Задача текущего сеанса. После обновления страницы номер задачи берётся из адреса страницы
+    """
+    if 'job_id' not in st.session_state:
+        job_id = st.experimental_get_query_params().get('job')
+        if not job_id:
+            return None
+        st.session_state['job_id'] = job_id[0]
+        st.session_state.setdefault('job_ids', []).append(job_id[0])
+    return get_job_runner(**config['jobs']['runner']).get(st.session_state['job_id'])
+
+
+def attach_job(job_id: str) -> None:
+    """
+    Подключает сеанс к задаче и запоминает её номер в адресе страницы
+    :param job_id: номер задачи
+    """
+    st.session_state['job_id'] = job_id
+    st.session_state.pop('result', None)
+    st.session_state.setdefault('job_ids', []).append(job_id)
+    st.experimental_set_query_params(job=job_id)
+
+
+def session_jobs() -> List[Job]:
+    """
+    Запуски текущего сеанса от новых к старым
     """
-    top = Topics(yotube_api_key)
-    top.generate_topics(url, max_comments, n_videos)
-    return top
+    return get_job_runner(**config['jobs']['runner']).recent(st.session_state.get('job_ids', []))
+
+
+def get_result() -> Optional[Topics]:
+    """
+    Результат моделирования текущего сеанса, если задача завершена успешно
+    """
+    if 'result' not in st.session_state:
+        job = get_job()
+        if job is None or job.status != 'done':
+            return None
+        st.session_state['result'] = job.result
+    return st.session_state['result']
+
+
+def wait_job(job: Job, status) -> None:
+    """
+    Опрашивает задачу и показывает прогресс по этапам, пока она не завершится.
+    Скрипт не держит вычисления: любое действие на странице прерывает опрос,
+    задача продолжает выполняться и подхватывается при следующем запуске скрипта
+    :param job: задача
+    :param status: место на странице для прогресса
+    """
+    stages = list(STAGES)
+    while not job.done:
+        with status.container():
+            if job.stage is None:
+                st.info('Задача в очереди...')
+            else:
+                step = stages.index(job.stage)
+                st.progress(step / len(stages))
+                st.caption(f'Этап {step + 1} из {len(stages)}: {STAGES[job.stage]}'
+                           + (f' ({job.info})' if job.info else ''))
+        time.sleep(config['jobs']['poll_interval'])
+
+
+def plot_streamlit_3d(df, key: str, widget_key: str, **plot_params) -> None:
+    """
+    Трехмерная проекция с выбором детализации
+    :param df: таблица с колонками x, y, z и, возможно, кластеров
+    :param key: ключ данных таблицы для кеша графика
+    :param widget_key: уникальный ключ виджета
+    :param plot_params: параметры plot_3d
+    """
+    st.subheader('Проекция комментариев в 3-мерном пространстве')
+    mode = st.radio('Точки на графике', list(PLOT_MODES), format_func=PLOT_MODES.get,
+                    horizontal=True, key=f'plot-mode-{widget_key}',
+                    help='Выборка и вокселы облегчают график для браузера на больших данных')
+    fig_3d, payload = plot_3d(df, key, mode=mode, **plot_params, **config['plot_3d'])
+    st.plotly_chart(fig_3d, use_container_width=True)
+    st.caption(f'Точек на графике: {sum(len(trace.x) for trace in fig_3d.data)} из {len(df)}, '
+               f'размер графика: {payload / 2 ** 10:.0f} КБ')
 
 
 def plot_streamlit_clusters(result: Topics, algorithm: str) -> None:
@@ -31,8 +126,18 @@ def plot_streamlit_clusters(result: Topics, algorithm: str) -> None:
     :param algorithm: название алгоритма
     """
     st.header(algorithm)
+    # алгоритм не выбран при запуске - считаем по запросу и запоминаем в result
+    if algorithm in VALID_ALGORITHM and not result.is_clustered(algorithm):
+        st.info('Алгоритм не был выбран при запуске.')
+        if not st.button('Вычислить', key=f'compute-{algorithm}'):
+            return
+        with st.spinner(f'Кластеризация {algorithm}...'):
+            result.get_labels(algorithm)
+
     # вкладки для алгоритмов
-    if algorithm in VALID_ALGORITHM:
+    if algorithm in result.errors:
+        st.error(f'Алгоритм завершился с ошибкой: {result.errors[algorithm]}')
+    elif algorithm in VALID_ALGORITHM:
         # метки кластеров для каждого примера
         labels = result.data[algorithm]
         # Уникальные кластеры
@@ -42,32 +147,22 @@ def plot_streamlit_clusters(result: Topics, algorithm: str) -> None:
         # создаём словарь цветов для кластеров
         color_discrete_map = get_color_map(unique_clusters,
                                            px.colors.qualitative.Dark24)
-        # создаем 3D график
-        fig_3d = plot_3d(result.data[['x', 'y', 'z', algorithm]],
-                         color=algorithm,
-                         color_discrete_map=color_discrete_map)
         # создаем график пончик
         fig_cluster_size = pie_clusters_size(result.data,
+                                             result.label_keys[algorithm],
                                              algorithm,
                                              color_discrete_map=color_discrete_map)
 
-        # соединяем токены каждого комментария в одну строку
-        # обертываем в np.array для удобства фильтрации по кластерам
-        text_corpus = np.array([' '.join(tokens) for tokens in result.cleaned_corpus])
-
-        # создаем графики облаков слов
-        figs_of_wordcloud = create_wc_for_all_clusters(text_corpus=text_corpus,
-                                                       labels=labels,
-                                                       unique_clusters=unique_clusters,
-                                                       wc=result.wordcloud)
+        # облака слов (картинки PNG, при перерисовке берутся из кеша)
+        images_of_wordcloud = result.get_wordclouds(algorithm, unique_clusters)
 
         # выводим количество кластеров
         st.metric('Количество кластеров', len(unique_clusters),
                   help=f'Без кластера: {NOISE_NAME}')
 
         # рисуем 3D проекцию
-        st.subheader('Проекция комментариев в 3-мерном пространстве')
-        st.plotly_chart(fig_3d, use_container_width=True)
+        plot_streamlit_3d(result.data, result.label_keys[algorithm], algorithm,
+                          color=algorithm, color_discrete_map=color_discrete_map)
 
         # рисуем пончик
         st.subheader('Диаграмма размера кластеров')
@@ -75,11 +170,13 @@ def plot_streamlit_clusters(result: Topics, algorithm: str) -> None:
 
         # Рисуем облако слов
         st.subheader('Облако слов')
-        for fig_wordcloud, cluster in zip(figs_of_wordcloud, unique_clusters):
+        for image_wordcloud, cluster in zip(images_of_wordcloud, unique_clusters):
             st.markdown(f'**Кластер: {cluster}**')
-            st.pyplot(fig_wordcloud)
+            st.caption(f"Ключевые слова: {', '.join(result.get_keywords(algorithm, cluster))}")
+            st.image(image_wordcloud, use_column_width=True)
+            with st.expander('Комментарии кластера'):
+                for comment in result.get_source_comments(algorithm, cluster, n=10):
+                    st.text(comment)
     else:
         # вкладка Данные
-        fig_3d = plot_3d(result.data[['x', 'y', 'z']], color=None)
-        st.subheader('Проекция комментариев в 3-мерном пространстве')
-        st.plotly_chart(fig_3d, use_container_width=True)
+        plot_streamlit_3d(result.data, result.umap_key, algorithm, color=None)
@@ -0,0 +1,68 @@
+import functools
+import inspect
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+def ui_cache(max_entries: int = 30, ttl: Optional[float] = 3600) -> Callable:
+    """
+    Кеш результатов функций интерфейса, общий для всех сеансов
+    (по образцу st.cache_data/st.cache_resource, которых нет в streamlit 1.13).
+    В отличие от st.cache аргументы не хешируются целиком: ключ строится только из аргументов,
+    имя которых не начинается с '_'. Таблицы, корпус и Topics передаются в аргументах с '_',
+    а вместо них в ключ идёт дешёвый ключ данных запуска (Topics.corpus_key, umap_key, label_keys).
+    Результат отдаётся без копирования и не должен изменяться.
+    Время построения ключа и попадания в кеш пишутся в лог и в wrapper.stats
+    :param max_entries: максимальное количество записей, старые вытесняются (LRU)
+    :param ttl: время жизни записи в секундах, None - бессрочно
+    """
+    def decorator(func: Callable) -> Callable:
+        signature = inspect.signature(func)
+        entries = OrderedDict()
+        lock = threading.Lock()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = pickle.dumps([(name, value) for name, value in bound.arguments.items()
+                                if not name.startswith('_')], protocol=pickle.HIGHEST_PROTOCOL)
+            key_seconds = time.perf_counter() - start
+            with lock:
+                wrapper.stats['key_seconds'] += key_seconds
+                entry = entries.get(key)
+                if entry is not None and (ttl is None or time.time() - entry[0] <= ttl):
+                    entries.move_to_end(key)
+                    wrapper.stats['hits'] += 1
+                    logging.info(f"{func.__name__} из кеша: {(time.perf_counter() - start) * 1000:.2f} мс "
+                                 f"(ключ {key_seconds * 1000:.2f} мс)")
+                    return entry[1]
+
+            value = func(*args, **kwargs)
+            with lock:
+                wrapper.stats['misses'] += 1
+                entries[key] = (time.time(), value)
+                entries.move_to_end(key)
+                while len(entries) > max_entries:
+                    entries.popitem(last=False)
+            logging.info(f"{func.__name__} вычислен: {time.perf_counter() - start:.2f} c "
+                         f"(ключ {key_seconds * 1000:.2f} мс)")
+            return value
+
+        def clear() -> None:
+            """
+            Очищает кеш функции
+            """
+            with lock:
+                entries.clear()
+
+        wrapper.stats = {'hits': 0, 'misses': 0, 'key_seconds': 0.0}
+        wrapper.clear = clear
+        return wrapper
+
+    return decorator
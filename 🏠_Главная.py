@@ -1,6 +1,7 @@
 import streamlit as st
 
-from utils.snippet import get_topics
+from loader import VALID_ALGORITHM
+from utils.snippet import submit_topics, get_job, attach_job, wait_job, session_jobs
 
 header = st.container()
 body = st.container()
@@ -25,7 +26,10 @@ with header:
                     "число комментариев;\n"
                     "+ Качество и производительность алгоритмов напрямую зависят от указаннго количества "
                     "видео и комментариев;\n"
-                    "+ *Данные нигде не сохраняются, поэтому при обновлении страниц, данные теряются.")
+                    "+ При большом количестве видео включается режим канала: данные хранятся в файлах, "
+                    "доступны только HDBSCAN и KMeans;\n"
+                    "+ Моделирование идёт в фоне: после обновления страницы или в другом окне "
+                    "можно подключиться к запуску, готовые результаты хранятся на сервере час.")
 
     # форма для поиска
     with st.form(key='youtube-url'):
@@ -41,17 +45,43 @@ with header:
                                        min_value=1000,
                                        help="Устанавливаем предел по количеству комментариев под каждым видео, "
                                             "которые будут в дальнейшем обрабатываться")
+        algorithms = st.multiselect("Алгоритмы кластеризации",
+                                    VALID_ALGORITHM,
+                                    default=VALID_ALGORITHM,
+                                    help="Невыбранные алгоритмы можно вычислить позже "
+                                         "на странице Кластеризация")
 
         submitted = st.form_submit_button("Поехали")
 
-    # обработка нажатия кнопки
+    # обработка нажатия кнопки: задача ставится в фоновую очередь
     if submitted:
-        # st.markdown(f"URL: {url}\n\nn_videos={n_videos}\n\nmax_comments={max_comments}")
-        try:
-            status.warning('Обработка может занять несколько минут... Не уходите с этой страницы...')
-            result = get_topics(url, max_comments, n_videos, st.secrets["youtube-api-key"])
-            st.balloons()
-            st.session_state['result'] = result
-            status.success('Моделирование успешно завершено!')
-        except Exception as e:
-            status.error(f'Ошибка! {e.args}')
+        attach_job(submit_topics(url, max_comments, n_videos, st.secrets["youtube-api-key"],
+                                 tuple(algorithms)))
+
+    # готовые и текущие запуски этого сеанса
+    jobs = session_jobs()
+    if jobs:
+        with st.expander("Недавние запуски"):
+            for recent_job in jobs:
+                col1, col2 = st.columns([4, 1])
+                state = {'queued': 'в очереди', 'running': 'выполняется',
+                         'done': 'готово', 'error': 'ошибка'}[recent_job.status]
+                col1.markdown(f'{recent_job.title} — *{state}*')
+                if col2.button('Открыть', key=f'job-{recent_job.id}', disabled=recent_job.status == 'error'):
+                    attach_job(recent_job.id)
+                    st.experimental_rerun()
+
+    job = get_job()
+    if job is not None:
+        finished = job.done
+        wait_job(job, status)
+        if job.status == 'error':
+            status.error(f'Ошибка! {job.error.args}')
+        else:
+            st.session_state['result'] = job.result
+            status.success(f'Моделирование успешно завершено! {job.title}')
+            # шарики только для задачи, завершившейся на глазах пользователя
+            if not finished:
+                st.balloons()
+    elif 'job_id' in st.session_state:
+        status.warning('Запуск не найден: результаты устарели или сервер перезапускался')